@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Benchmark the sync and async modes of the FastAPI adapter under concurrent load
+
+In sync mode, starlette runs the route handlers in its threadpool (40 threads by default),
+in async mode the handlers run in the event loop with an AsyncSession (cfr. safrs/fastapi/async_session.py).
+The requests are sent by CLIENTS concurrent clients through an in-process ASGI transport,
+so the results measure the adapter and the database driver, not the network.
+
+requirements:
+$ pip install "sqlalchemy[asyncio]" aiosqlite httpx
+(without greenlet and aiosqlite, only the sync mode is benchmarked)
+
+run:
+$ python benchmarks/bench_fastapi_async.py [clients] [requests per client]
+"""
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from typing import Any
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, relationship, scoped_session, sessionmaker
+
+# import safrs from the repository root (when run from a checkout)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import safrs  # noqa: E402
+from safrs import SAFRSBase  # noqa: E402
+from safrs.fastapi.api import SafrsFastAPI  # noqa: E402
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+AUTHORS = 100
+BOOKS_PER_AUTHOR = 20
+
+# sync mode: every request has its own scoped session, removed by the session middleware.
+# The handlers run in the threadpool, so the session can't be scoped to the thread (the default):
+# the middleware runs in the event loop thread and the threads serve many requests
+request_scope: ContextVar[int] = ContextVar("request_scope", default=0)
+request_ids = itertools.count(1)
+
+Base = declarative_base()
+
+
+class Author(SAFRSBase, Base):
+    __tablename__ = "Authors"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    books = relationship("Book", back_populates="author")
+
+
+class Book(SAFRSBase, Base):
+    __tablename__ = "Books"
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    author_id = Column(Integer, ForeignKey("Authors.id"))
+    author = relationship("Author", back_populates="books")
+
+
+class DB:
+    """
+    The safrs.DB interface used by SAFRSBase: .session and .Model
+    """
+
+    def __init__(self, session: Any, model: Any) -> None:
+        self.session = session
+        self.Model = model
+
+
+def urls(client_id: int) -> list[str]:
+    """
+    :return: the urls requested by a client: a mix of collection, instance, relationship and filter requests
+    """
+    result = []
+    for i in range(REQUESTS):
+        author_id = (client_id * REQUESTS + i) % AUTHORS + 1
+        choices = [
+            "/Books?page[limit]=25&sort=-title",
+            f"/Authors/{author_id}",
+            f"/Authors/{author_id}/books?page[limit]=10",
+            f'/Books?filter={{"name":"author_id","op":"eq","val":{author_id}}}&include=author',
+        ]
+        result.append(choices[i % len(choices)])
+    return result
+
+
+async def run_clients(app: FastAPI) -> tuple[float, int]:
+    """
+    :return: duration and number of successful requests
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def run_client(client_id: int) -> int:
+            ok = 0
+            for url in urls(client_id):
+                response = await client.get(url)
+                ok += response.status_code == 200
+            return ok
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[run_client(i) for i in range(CLIENTS)])
+        return time.perf_counter() - start, sum(results)
+
+
+def create_app(async_session: Any = None) -> FastAPI:
+    app = FastAPI()
+    if async_session is None:
+
+        @app.middleware("http")
+        async def safrs_session_middleware(request: Any, call_next: Any) -> Any:
+            # the context (and the scope) is copied to the threadpool thread that runs the handler
+            token = request_scope.set(next(request_ids))
+            try:
+                return await call_next(request)
+            finally:
+                safrs.DB.session.remove()
+                request_scope.reset(token)
+
+    api = SafrsFastAPI(app, async_session=async_session)
+    api.expose_object(Author)
+    api.expose_object(Book)
+    return app
+
+
+def main() -> None:
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False})
+    Session = scoped_session(sessionmaker(bind=engine, autoflush=False), scopefunc=request_scope.get)
+    safrs.DB = DB(Session, Base)
+    Base.metadata.create_all(engine)
+    for i in range(AUTHORS):
+        author = Author(name=f"author {i}")
+        Session.add(author)
+        for j in range(BOOKS_PER_AUTHOR):
+            Session.add(Book(title=f"book {i}-{j}", author=author))
+    Session.commit()
+    Session.remove()
+
+    apps = [("sync ", create_app())]
+    async_engine = None
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+        apps.append(("async", create_app(async_sessionmaker(async_engine, autoflush=False))))
+    except ImportError as exc:
+        print(f"async mode skipped: {exc}")
+
+    async def bench() -> None:
+        total = CLIENTS * REQUESTS
+        print(f"{CLIENTS} concurrent clients, {total} requests")
+        for mode, app in apps:
+            # warm up: build the caches and fill the connection pools
+            await run_clients(app)
+            duration, ok = await run_clients(app)
+            print(f"{mode} : {total / duration:8.0f} requests/sec ({ok}/{total} ok, {duration:.2f}s)")
+        if async_engine is not None:
+            await async_engine.dispose()
+
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    main()
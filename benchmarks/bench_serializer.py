@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Benchmark the serialization of jsonapi attributes on a wide table
+
+The legacy implementation sent every attribute value through a
+json.loads(json.dumps(value, cls=current_app.json_encoder)) round trip,
+this is compared with the compiled AttributeSerializer used by `SAFRSBase._s_jsonapi_attrs`.
+
+run:
+$ python benchmarks/bench_serializer.py [rows] [columns]
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import decimal
+import uuid
+from typing import Any
+from flask import Flask, current_app
+from flask_sqlalchemy import SQLAlchemy
+
+# import safrs from the repository root (when run from a checkout)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from safrs import SAFRSBase, SafrsApi  # noqa: E402
+
+db = SQLAlchemy()
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+COLUMNS = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+REPEAT = 3
+
+# column type and sample value, cycled over the columns of the wide table
+COLUMN_TYPES = [
+    (db.String, "some text"),
+    (db.Integer, 12345),
+    (db.Float, 3.14),
+    (db.Boolean, True),
+    (db.DateTime, datetime.datetime(2020, 1, 2, 3, 4, 5)),
+    (db.Date, datetime.date(2020, 1, 2)),
+    (db.Numeric(10, 2), decimal.Decimal("1.50")),
+    (db.LargeBinary, b"\x01\x02\x03"),
+    (db.Uuid, uuid.UUID(int=1)),
+    (db.JSON, {"a": [1, 2, 3]}),
+]
+
+attrs: dict[str, Any] = {"__tablename__": "Wide", "id": db.Column(db.Integer, primary_key=True)}
+for i in range(COLUMNS):
+    col_type, _ = COLUMN_TYPES[i % len(COLUMN_TYPES)]
+    attrs[f"col_{i}"] = db.Column(col_type)
+Wide = type("Wide", (SAFRSBase, db.Model), attrs)
+
+
+def legacy_jsonapi_attrs(instance: Any) -> dict[str, Any]:
+    """
+    The attribute serialization as it was implemented before the AttributeSerializer
+    """
+    result = {}
+    fields = instance.__class__._s_jsonapi_attrs.keys()
+    ja_attr_names = [name for name in fields if instance._s_check_perm(name)]
+    for attr in fields:
+        attr_val = ""
+        if attr in ja_attr_names:
+            attr_val = getattr(instance, attr)
+        result[attr] = json.loads(json.dumps(attr_val, cls=current_app.json_encoder))
+    return result
+
+
+def compiled_jsonapi_attrs(instance: Any) -> dict[str, Any]:
+    return instance._s_jsonapi_attrs
+
+
+def bench(func: Any, instances: list[Any]) -> float:
+    """
+    :return: rows per second (best of REPEAT runs)
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for instance in instances:
+            func(instance)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return len(instances) / best
+
+
+def main() -> None:
+    app = Flask("bench_serializer")
+    app.config.update(SQLALCHEMY_DATABASE_URI="sqlite://")
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        api = SafrsApi(app)
+        api.expose_object(Wide)
+        for _ in range(ROWS):
+            values = {f"col_{i}": COLUMN_TYPES[i % len(COLUMN_TYPES)][1] for i in range(COLUMNS)}
+            db.session.add(Wide(**values))
+        db.session.commit()
+        instances = Wide.query.all()
+
+        with app.test_request_context("/Wide/"):
+            app.preprocess_request()
+            assert legacy_jsonapi_attrs(instances[0]) == compiled_jsonapi_attrs(instances[0])
+            legacy = bench(legacy_jsonapi_attrs, instances)
+            compiled = bench(compiled_jsonapi_attrs, instances)
+
+    print(f"{ROWS} rows, {COLUMNS + 1} columns")
+    print(f"legacy json round trip : {legacy:10.0f} rows/sec")
+    print(f"compiled serializer    : {compiled:10.0f} rows/sec ({compiled / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
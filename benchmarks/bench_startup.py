@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Benchmark the startup time of the flask and fastapi adapters for a synthetic schema (cfr. synthetic_schema.py)
+
+For every adapter, a new python process measures the duration of
+- import: importing safrs and the adapter
+- declare: declaring the models and configuring the sqla mappers
+- expose: expose_object for all models (route registration, with DEFERRED_SWAGGER the spec isn't generated yet)
+- spec: the first swagger.json (flask) or openapi.json (fastapi) request, ie. the spec generation
+- first_request: the first collection GET request, with include= of a relationship
+- second_request: the same request again, for comparison
+The results (the best of --repeat runs) are printed and written to a json file.
+
+requirements (fastapi adapter):
+$ pip install fastapi httpx
+
+run:
+$ python benchmarks/bench_startup.py --tables 50 --relationships 6 --output startup.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Iterator
+
+# import safrs from the repository root (when run from a checkout)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADAPTERS = ("flask", "fastapi")
+PHASES = ("import", "declare", "expose", "spec", "first_request", "second_request")
+ROWS = 10
+
+
+class Timer:
+    """
+    Collects the durations of the benchmark phases
+    """
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        self.durations[phase] = time.perf_counter() - start
+
+
+def check_response(response: Any) -> None:
+    if response.status_code != 200:
+        raise RuntimeError(f"request failed ({response.status_code}): {response.text[:200]}")
+
+
+def run_flask(tables: int, relationships: int) -> dict[str, float]:
+    timer = Timer()
+    with timer("import"):
+        from flask import Flask
+        from flask_sqlalchemy import SQLAlchemy
+        from sqlalchemy.orm import configure_mappers
+        from safrs import SAFRSBase, SAFRSAPI
+    from synthetic_schema import create_models, populate
+
+    db = SQLAlchemy()
+    with timer("declare"):
+        models = create_models((SAFRSBase, db.Model), db.metadata, tables, relationships)
+        configure_mappers()
+
+    app = Flask("bench_startup")
+    app.config.update(SQLALCHEMY_DATABASE_URI="sqlite://")
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        populate(db.session, models, ROWS, relationships)
+        with timer("expose"):
+            api = SAFRSAPI(app)
+            for model in models:
+                api.expose_object(model)
+
+    client = app.test_client()
+    with timer("spec"):
+        check_response(client.get("/swagger.json"))
+    url = f"/{models[0]._s_collection_name}/?include=rel0"
+    with timer("first_request"):
+        check_response(client.get(url))
+    with timer("second_request"):
+        check_response(client.get(url))
+    return timer.durations
+
+
+def run_fastapi(tables: int, relationships: int) -> dict[str, float]:
+    timer = Timer()
+    with timer("import"):
+        from fastapi import FastAPI
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import configure_mappers, declarative_base, scoped_session, sessionmaker
+        from sqlalchemy.pool import StaticPool
+        import safrs
+        from safrs import SAFRSBase
+        from safrs.fastapi.api import SafrsFastAPI
+    from fastapi.testclient import TestClient
+    from synthetic_schema import create_models, populate
+
+    with timer("declare"):
+        Base = declarative_base()
+        models = create_models((SAFRSBase, Base), Base.metadata, tables, relationships)
+        configure_mappers()
+
+    class DB:
+        """
+        The safrs.DB interface used by SAFRSBase: .session and .Model
+        """
+
+        def __init__(self, session: Any, model: Any) -> None:
+            self.session = session
+            self.Model = model
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Session = scoped_session(sessionmaker(bind=engine, autoflush=False))
+    safrs.DB = DB(Session, Base)
+    Base.metadata.create_all(engine)
+    populate(Session, models, ROWS, relationships)
+
+    with timer("expose"):
+        app = FastAPI()
+        api = SafrsFastAPI(app)
+        for model in models:
+            api.expose_object(model)
+
+    client = TestClient(app)
+    with timer("spec"):
+        check_response(client.get("/openapi.json"))
+    url = f"/{models[0]._s_collection_name}?include=rel0"
+    with timer("first_request"):
+        check_response(client.get(url))
+    with timer("second_request"):
+        check_response(client.get(url))
+    return timer.durations
+
+
+def run_adapter(adapter: str, args: argparse.Namespace) -> dict[str, float]:
+    """
+    Run the benchmark of `adapter` in new processes (the modules have to be imported and the models declared from scratch)
+
+    :return: the best duration of every phase
+    """
+    best: dict[str, float] = {}
+    for _ in range(args.repeat):
+        command = [sys.executable, os.path.abspath(__file__), "--run", adapter, "--tables", str(args.tables), "--relationships", str(args.relationships)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        durations = json.loads(output.splitlines()[-1])
+        for phase, duration in durations.items():
+            best[phase] = min(best.get(phase, duration), duration)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="safrs startup benchmark")
+    parser.add_argument("--tables", type=int, default=50, help="number of synthetic tables")
+    parser.add_argument("--relationships", type=int, default=6, help="number of relationships declared per table")
+    parser.add_argument("--adapters", default=",".join(ADAPTERS), help="comma separated adapters")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per adapter, the best durations are reported")
+    parser.add_argument("--output", default="bench_startup.json", help="json results file")
+    parser.add_argument("--run", choices=ADAPTERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # child process: print the durations as json
+        run = run_flask if args.run == "flask" else run_fastapi
+        print(json.dumps(run(args.tables, args.relationships)))
+        return
+
+    import safrs
+
+    results: dict[str, Any] = {
+        "python": platform.python_version(),
+        "safrs": safrs.__version__,
+        "tables": args.tables,
+        "relationships": args.relationships,
+        "rows": ROWS,
+        "durations": {},
+    }
+    print(f"{args.tables} tables, {args.relationships} relationships per table (+ backrefs), best of {args.repeat}")
+    print(f"{'':8}" + "".join(f"{phase:>16}" for phase in PHASES))
+    for adapter in args.adapters.split(","):
+        durations = run_adapter(adapter, args)
+        results["durations"][adapter] = durations
+        print(f"{adapter:8}" + "".join(f"{durations[phase] * 1000:14.1f}ms" for phase in PHASES))
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
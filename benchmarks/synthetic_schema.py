@@ -0,0 +1,108 @@
+"""
+Synthetic SQLAlchemy schema generator, used to benchmark how safrs scales with the schema size
+
+create_models(bases, metadata, tables, relationships) declares `tables` SAFRSBase models T0, T1, ...
+every model has a few columns and `relationships` relationships, the kinds of relationships are cycled:
+- many-to-one to another table (foreign key column rel{k}_id), with a one-to-many backref
+- self-referential many-to-one (parent), with a one-to-many backref (children)
+- many-to-many to another table, through an association table, with a many-to-many backref
+so every model has about twice as many relationships as requested (the declared ones and the backrefs)
+"""
+import datetime
+from typing import Any
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table
+from sqlalchemy.orm import backref, relationship
+
+MANY_TO_ONE, SELF_REFERENTIAL, MANY_TO_MANY = range(3)
+
+
+def relationship_kind(k: int) -> int:
+    """
+    :param k: index of the relationship of a model
+    :return: kind of the relationship
+    """
+    return k % 3
+
+
+def relationship_target(i: int, k: int, tables: int) -> int:
+    """
+    :return: index of the target table of the k-th relationship of table i (never i itself, except for self-referential relationships)
+    """
+    if relationship_kind(k) == SELF_REFERENTIAL:
+        return i
+    return (i + 1 + k % (tables - 1)) % tables
+
+
+def create_models(bases: tuple[Any, ...], metadata: Any, tables: int, relationships: int) -> list[Any]:
+    """
+    :param bases: base classes of the models, eg. (SAFRSBase, db.Model)
+    :param metadata: sqla metadata of the declarative base (for the association tables)
+    :param tables: number of models
+    :param relationships: number of relationships declared per model
+    :return: the model classes
+    """
+    if tables < 2:
+        raise ValueError("at least 2 tables are required")
+    models = []
+    for i in range(tables):
+        name = f"T{i}"
+        id_column = Column(Integer, primary_key=True)
+        attrs: dict[str, Any] = {
+            "__tablename__": name,
+            "__doc__": f"description: synthetic table {i}",
+            "id": id_column,
+            "name": Column(String(64)),
+            "value": Column(Integer),
+            "created": Column(DateTime, default=datetime.datetime(2020, 1, 1)),
+        }
+        for k in range(relationships):
+            kind = relationship_kind(k)
+            target = f"T{relationship_target(i, k, tables)}"
+            if kind == MANY_TO_MANY:
+                secondary = Table(
+                    f"{name}_rel{k}",
+                    metadata,
+                    Column("left_id", Integer, ForeignKey(f"{name}.id"), primary_key=True),
+                    Column("right_id", Integer, ForeignKey(f"{target}.id"), primary_key=True),
+                )
+                attrs[f"rel{k}"] = relationship(target, secondary=secondary, backref=f"{name}_rel{k}_back")
+                continue
+            fk_column = Column(Integer, ForeignKey(f"{target}.id"))
+            attrs[f"rel{k}_id"] = fk_column
+            if kind == SELF_REFERENTIAL:
+                attrs[f"rel{k}"] = relationship(
+                    name, foreign_keys=[fk_column], remote_side=[id_column], backref=backref(f"rel{k}_children", foreign_keys=[fk_column])
+                )
+            else:
+                attrs[f"rel{k}"] = relationship(target, foreign_keys=[fk_column], backref=backref(f"{name}_rel{k}_back", foreign_keys=[fk_column]))
+        models.append(type(name, bases, attrs))
+    return models
+
+
+def populate(session: Any, models: list[Any], rows: int, relationships: int) -> None:
+    """
+    Add `rows` rows to every table, the rows are related to the rows with the same id in the related tables
+
+    :param session: sqla session
+    :param models: result of create_models
+    :param rows: number of rows per table
+    :param relationships: number of relationships declared per model
+    """
+    for model in models:
+        for row_id in range(1, rows + 1):
+            values = {"id": row_id, "name": f"{model.__name__} {row_id}", "value": row_id}
+            for k in range(relationships):
+                if relationship_kind(k) == MANY_TO_ONE:
+                    values[f"rel{k}_id"] = row_id
+                elif relationship_kind(k) == SELF_REFERENTIAL:
+                    # a chain of parents
+                    values[f"rel{k}_id"] = row_id - 1 or None
+            session.add(model(**values))
+    session.flush()
+    for model in models:
+        for k in range(relationships):
+            if relationship_kind(k) == MANY_TO_MANY:
+                secondary = model.__table__.metadata.tables[f"{model.__tablename__}_rel{k}"]
+                session.execute(secondary.insert(), [{"left_id": row_id, "right_id": row_id} for row_id in range(1, rows + 1)])
+    session.commit()
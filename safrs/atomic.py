@@ -0,0 +1,335 @@
+# JSON:API Atomic Operations (https://jsonapi.org/ext/atomic/)
+#
+# The "atomic:operations" of a request to the operations endpoint are executed in a single transaction:
+# either all operations succeed and the transaction is committed once, or the transaction is rolled back
+# and the error of the failing operation is returned, with a pointer to the operation.
+#
+# Supported operations:
+#   add    : create a resource ("data"), or add members to a to-many relationship ("ref" with "relationship")
+#   update : update the attributes and relationships of a resource, or replace a relationship
+#   remove : delete a resource, or remove members from a to-many relationship
+# Resources created by an earlier operation can be referenced with their local id ("lid").
+# An operation is only allowed if the `http_methods` of the model (or of the relationship) contain
+# the corresponding http method: POST for add, PATCH for update and DELETE for remove.
+# The endpoint isn't exposed unless the ATOMIC_OPERATIONS setting is enabled (or with `expose_atomic_operations`).
+#
+# Consecutive operations of the same kind on the same type are batched:
+# "add" operations are inserted with bulk INSERT statements and "update" operations are
+# applied with `_s_bulk_patch` (cfr. bulk.py), "remove" operations load all instances at once.
+# Models that can't be bulk inserted (validators, insert listeners, cfr. `bulk_insert_supported`) are
+# created per row with `_s_new`.
+# Models that override `_s_post`, `_s_patch` or `_s_delete` or that set `db_commit` may commit
+# during the request, so the operations on these models are refused (cfr. `atomic_supported`).
+#
+from typing import Any, Callable, Optional
+import sqlalchemy
+from sqlalchemy.orm.interfaces import MANYTOONE
+import safrs
+from .bulk import bulk_insert, bulk_rows, fetch_instances
+from .conditional import mark_modified
+from .errors import GenericError, JsonapiError, NotFoundError, ValidationError
+
+ATOMIC_EXT = "https://jsonapi.org/ext/atomic"
+ATOMIC_MEDIA_TYPE = f'application/vnd.api+json; ext="{ATOMIC_EXT}"'
+ATOMIC_OPS = ("add", "update", "remove")
+# the http method that has to be allowed (cfr. `http_methods`) for an operation
+OP_HTTP_METHODS = {"add": "POST", "update": "PATCH", "remove": "DELETE"}
+
+
+def atomic_supported(model: Any) -> bool:
+    """
+    :param model: SAFRSBase subclass
+    :return: True if `model` instances can be modified in the transaction of an atomic request, i.e.
+        `_s_post`, `_s_patch` and `_s_delete` aren't overridden and `db_commit` isn't set (these may commit)
+    """
+    if getattr(model, "db_commit", False):
+        return False
+    if model._s_post.__func__ is not safrs.SAFRSBase._s_post.__func__:
+        return False
+    return model._s_patch is safrs.SAFRSBase._s_patch and model._s_delete is safrs.SAFRSBase._s_delete
+
+
+def operation_error(message: str, pointer: str, status_code: int = 400) -> ValidationError:
+    """
+    :param message: error message
+    :param pointer: JSON pointer to the invalid member of the request document
+    :param status_code: HTTP status code
+    :return: ValidationError with a `source` pointer
+    """
+    exc = ValidationError(message, status_code)
+    exc.source = {"pointer": pointer}  # type: ignore[attr-defined]
+    return exc
+
+
+class AtomicOperations:
+    """
+    Execute the operations of an atomic request
+    """
+
+    def __init__(self: Any, models: dict[str, Any], parse_attributes: Optional[Callable[[Any, dict[str, Any]], dict[str, Any]]] = None) -> None:
+        """
+        :param models: the exposed SAFRSBase subclasses by jsonapi type
+        :param parse_attributes: callable that coerces the attributes of a resource object (model, attributes) -> attributes
+        """
+        self.models = models
+        self.parse_attributes = parse_attributes or (lambda model, attributes: attributes)
+        self.lids: dict[tuple[str, str], Any] = {}
+        self.modified: set[Any] = set()
+
+    def execute(self: Any, operations: Any) -> list[Optional[tuple[Any, Any]]]:
+        """
+        Execute the operations, the changes are flushed but not committed
+
+        :param operations: "atomic:operations" member of the request document
+        :return: a (model, instance) tuple for operations that return a resource, None for the others
+        """
+        if not isinstance(operations, list) or not operations:
+            raise operation_error("atomic:operations must be a non-empty list", "/atomic:operations")
+        results: list[Optional[tuple[Any, Any]]] = [None] * len(operations)
+        start = 0
+        while start < len(operations):
+            batch = self._batch_key(start, operations[start])
+            end = start + 1
+            while batch is not None and end < len(operations) and self._batch_key(end, operations[end]) == batch:
+                end += 1
+            if batch is None:
+                results[start] = self._relationship_operation(start, operations[start])
+            elif batch[0] == "add":
+                results[start:end] = self._add(start, batch[1], operations[start:end])
+            elif batch[0] == "update":
+                results[start:end] = self._update(start, batch[1], operations[start:end])
+            else:
+                self._remove(start, batch[1], operations[start:end])
+            start = end
+        try:
+            safrs.DB.session.flush()
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            safrs.log.warning(str(exc))
+            raise GenericError(str(exc))
+        for model in self.modified:
+            mark_modified(model)
+        return results
+
+    @staticmethod
+    def _pointer(index: int, member: str = "") -> str:
+        return f"/atomic:operations/{index}{member}"
+
+    def _model(self: Any, index: int, resource_type: Any, member: str) -> Any:
+        model = self.models.get(resource_type)
+        if model is None:
+            raise operation_error(f"Invalid type {resource_type}", self._pointer(index, member + "/type"), 404)
+        if not atomic_supported(model):
+            raise operation_error(f"{resource_type} can't be modified with atomic operations", self._pointer(index, member + "/type"), 403)
+        return model
+
+    def _batch_key(self: Any, index: int, operation: Any) -> Optional[tuple[str, Any]]:
+        """
+        Validate an operation
+
+        :return: (op, model) for resource operations, None for relationship operations
+        """
+        if not isinstance(operation, dict):
+            raise operation_error("Invalid operation", self._pointer(index))
+        op = operation.get("op")
+        if op not in ATOMIC_OPS:
+            raise operation_error(f"Invalid op {op}", self._pointer(index, "/op"))
+        if "href" in operation:
+            raise operation_error("href is not supported, use ref", self._pointer(index, "/href"))
+        ref = operation.get("ref")
+        data = operation.get("data")
+        if ref is not None:
+            if not isinstance(ref, dict):
+                raise operation_error("Invalid ref", self._pointer(index, "/ref"))
+            model = self._model(index, ref.get("type"), "/ref")
+            if "relationship" in ref:
+                relationship = model._s_relationships.get(ref["relationship"])
+                if relationship is None:
+                    raise operation_error(f"Invalid relationship {ref['relationship']}", self._pointer(index, "/ref/relationship"), 404)
+                # the relationship endpoints may have custom http methods (cfr. SAFRSAPI.expose_relationship)
+                self._check_method(index, op, getattr(relationship, "http_methods", model.http_methods), f"{model._s_type}.{ref['relationship']}")
+                return None
+        if op == "remove":
+            if ref is None:
+                raise operation_error("remove requires a ref", self._pointer(index))
+            self._check_method(index, op, model.http_methods, model._s_type)
+            return op, model
+        if not isinstance(data, dict):
+            raise operation_error("Invalid data", self._pointer(index, "/data"))
+        data_model = self._model(index, data.get("type"), "/data")
+        if ref is not None and model is not data_model:
+            raise operation_error("The data type doesn't match the ref type", self._pointer(index, "/data/type"), 409)
+        self._check_method(index, op, data_model.http_methods, data_model._s_type)
+        return op, data_model
+
+    def _check_method(self: Any, index: int, op: str, http_methods: Any, name: str) -> None:
+        """
+        Operations are only allowed if the corresponding http method is allowed
+
+        :param http_methods: allowed http methods of the model or relationship
+        :param name: name of the model or relationship, for the error message
+        """
+        http_method = OP_HTTP_METHODS[op]
+        if http_method not in {str(method).upper() for method in http_methods}:
+            raise operation_error(f"{op} isn't allowed for {name}", self._pointer(index, "/op"), 405)
+
+    def _resolve(self: Any, identifier: Any, pointer: str, model: Any = None) -> Any:
+        """
+        :param identifier: resource identifier object ({"type": .., "id": ..} or {"type": .., "lid": ..})
+        :param pointer: JSON pointer to the identifier
+        :param model: expected model
+        :return: the identified instance
+        """
+        if not isinstance(identifier, dict):
+            raise operation_error("Invalid resource identifier", pointer)
+        resource_type = identifier.get("type")
+        if model is not None and resource_type != model._s_type:
+            if resource_type not in self.models or not issubclass(self.models[resource_type], model):
+                raise operation_error(f"Invalid type {resource_type} != {model._s_type}", pointer + "/type", 409)
+        if identifier.get("lid") is not None:
+            instance = self.lids.get((resource_type, identifier["lid"]))
+            if instance is None:
+                raise operation_error(f"Unknown lid {identifier['lid']}", pointer + "/lid")
+            return instance
+        if identifier.get("id") is None:
+            raise operation_error("The resource identifier has no id or lid", pointer)
+        target = self.models.get(resource_type, model)
+        if target is None:
+            raise operation_error(f"Invalid type {resource_type}", pointer + "/type", 404)
+        instance = target.get_instance(identifier["id"], failsafe=True)
+        if instance is None:
+            raise operation_error(f'Invalid "{target.__name__}" ID "{identifier["id"]}"', pointer + "/id", 404)
+        return instance
+
+    @staticmethod
+    def _jsonapi_id(instance: Any) -> Any:
+        if sqlalchemy.inspect(instance).pending:
+            # the primary key of a new instance is known after the flush
+            safrs.DB.session.flush()
+        return instance.jsonapi_id
+
+    def _set_relationship(self: Any, instance: Any, rel_name: str, rel_data: Any, pointer: str, op: str = "update") -> None:
+        """
+        Update a relationship of `instance` with the resource linkage `rel_data`
+        """
+        rel = instance._s_relationships[rel_name]
+        target = rel.mapper.class_
+        if rel.direction == MANYTOONE:
+            if op != "update":
+                raise operation_error(f"{op} isn't allowed for to-one relationships", pointer)
+            setattr(instance, rel_name, None if rel_data is None else self._resolve(rel_data, pointer, target))
+        else:
+            if not isinstance(rel_data, list):
+                raise operation_error("The linkage of a to-many relationship must be a list", pointer)
+            members = [self._resolve(item, f"{pointer}/{i}", target) for i, item in enumerate(rel_data)]
+            relation = getattr(instance, rel_name)
+            if op == "update":
+                setattr(instance, rel_name, members)
+            elif op == "add":
+                for member in members:
+                    if member not in relation:
+                        relation.append(member)
+            else:
+                for member in members:
+                    if member in relation:
+                        relation.remove(member)
+        self.modified.update((type(instance), target))
+
+    def _set_relationships(self: Any, index: int, instance: Any, data: dict[str, Any]) -> None:
+        relationships = data.get("relationships") or {}
+        for rel_name, rel_value in relationships.items():
+            pointer = self._pointer(index, f"/data/relationships/{rel_name}")
+            if rel_name not in instance._s_relationships:
+                raise operation_error(f"Invalid relationship {rel_name}", pointer, 404)
+            if not isinstance(rel_value, dict) or "data" not in rel_value:
+                raise operation_error("Invalid relationship payload", pointer)
+            self._set_relationship(instance, rel_name, rel_value["data"], pointer + "/data")
+
+    def _add(self: Any, start: int, model: Any, operations: list[dict[str, Any]]) -> list[Optional[tuple[Any, Any]]]:
+        """
+        Create the resources of consecutive "add" operations
+        """
+        params = []
+        for i, operation in enumerate(operations, start):
+            data = operation["data"]
+            attributes = data.get("attributes") or {}
+            if not isinstance(attributes, dict):
+                raise operation_error("Invalid attributes", self._pointer(i, "/data/attributes"))
+            params.append({"jsonapi_id": data.get("id"), **self.parse_attributes(model, attributes)})
+        try:
+            rows = bulk_rows(model, params) if model._s_bulk_create else None
+            instances = bulk_insert(model, rows) if rows else None
+            if instances is None:
+                instances = [model._s_new(**item) for item in params]
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            safrs.log.warning(str(exc))
+            raise operation_error(str(exc), self._pointer(start), 409)
+        except JsonapiError as exc:
+            exc.source = {"pointer": self._pointer(start)}  # type: ignore[attr-defined]
+            raise
+        self.modified.add(model)
+        for i, (operation, instance) in enumerate(zip(operations, instances), start):
+            data = operation["data"]
+            if data.get("lid") is not None:
+                self.lids[(model._s_type, data["lid"])] = instance
+            self._set_relationships(i, instance, data)
+        return [(model, instance) for instance in instances]
+
+    def _update(self: Any, start: int, model: Any, operations: list[dict[str, Any]]) -> list[Optional[tuple[Any, Any]]]:
+        """
+        Update the resources of consecutive "update" operations
+        """
+        items = []
+        for i, operation in enumerate(operations, start):
+            data = operation["data"]
+            identifier = operation.get("ref") or data
+            pointer = self._pointer(i, "/ref" if "ref" in operation else "/data")
+            if identifier.get("lid") is not None:
+                jsonapi_id = self._jsonapi_id(self._resolve(identifier, pointer, model))
+            elif identifier.get("id") is not None:
+                jsonapi_id = model.id_type.validate_id(identifier["id"])
+            else:
+                raise operation_error("The resource has no id or lid", pointer)
+            attributes = data.get("attributes") or {}
+            if not isinstance(attributes, dict):
+                raise operation_error("Invalid attributes", self._pointer(i, "/data/attributes"))
+            items.append((jsonapi_id, self.parse_attributes(model, attributes)))
+        results = model._s_bulk_patch(items)
+        for i, (operation, result) in enumerate(zip(operations, results), start):
+            if isinstance(result, Exception):
+                member = "/data" + getattr(result, "source", {}).get("pointer", "")
+                if isinstance(result, NotFoundError):
+                    member = "/ref/id" if "ref" in operation else "/data/id"
+                result.source = {"pointer": self._pointer(i, member)}  # type: ignore[attr-defined]
+                raise result
+            self._set_relationships(i, result, operation["data"])
+        self.modified.add(model)
+        return [(model, instance) for instance in results]
+
+    def _remove(self: Any, start: int, model: Any, operations: list[dict[str, Any]]) -> None:
+        """
+        Delete the resources of consecutive "remove" operations
+        """
+        instances = []
+        jsonapi_ids = [operation["ref"].get("id") for operation in operations]
+        fetched = fetch_instances(model, [jsonapi_id for jsonapi_id in jsonapi_ids if jsonapi_id is not None])
+        for i, (operation, jsonapi_id) in enumerate(zip(operations, jsonapi_ids), start):
+            if jsonapi_id is None:
+                instances.append(self._resolve(operation["ref"], self._pointer(i, "/ref"), model))
+            elif jsonapi_id in fetched:
+                instances.append(fetched[jsonapi_id])
+            else:
+                raise operation_error(f'Invalid "{model.__name__}" ID "{jsonapi_id}"', self._pointer(i, "/ref/id"), 404)
+        for instance in instances:
+            instance._s_delete()
+        self.modified.add(model)
+
+    def _relationship_operation(self: Any, index: int, operation: dict[str, Any]) -> None:
+        """
+        Execute an operation on a relationship ("ref" with a "relationship" member)
+        """
+        ref = operation["ref"]
+        model = self.models[ref["type"]]
+        instance = self._resolve(ref, self._pointer(index, "/ref"), model)
+        if "data" not in operation:
+            raise operation_error("Relationship operations require data", self._pointer(index))
+        self._set_relationship(instance, ref["relationship"], operation["data"], self._pointer(index, "/data"), operation["op"])
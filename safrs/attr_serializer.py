@@ -0,0 +1,145 @@
+"""
+Attribute serialization: create the jsonapi "attributes" dictionary of an instance
+
+`parse_attr` (attr_parse.py) converts jsonapi attribute values so they can be stored in the db,
+the `AttributeSerializer` implemented here does the reverse.
+
+Previously every attribute value of every row was sent through a
+`json.loads(json.dumps(value, cls=current_app.json_encoder))` round trip.
+An `AttributeSerializer` is built once per model, sparse fieldset and json encoder.
+It holds the attribute getters and the type-specific converters so that a row
+is converted to a json-ready dict in a single pass.
+"""
+from typing import Any, Callable, Optional
+import datetime
+import decimal
+import inspect
+import json
+from functools import lru_cache
+from operator import attrgetter
+from uuid import UUID
+import safrs
+
+
+# Values of these types are json-ready and returned as-is
+JSON_NATIVE_TYPES = frozenset((str, int, float, bool, type(None)))
+
+# Type-specific converters, these produce the same output as SAFRSJSONEncoder.default
+NATIVE_CONVERTERS: dict[type, Callable[[Any], Any]] = {
+    datetime.datetime: lambda value: value.isoformat(" "),
+    datetime.date: lambda value: value.isoformat(),
+    datetime.time: lambda value: value.isoformat(),
+    datetime.timedelta: str,
+    decimal.Decimal: float,
+    UUID: str,
+    bytes: lambda value: value.hex(),
+}
+
+
+def _is_safrs_encoder(encoder: Any) -> bool:
+    """
+    :param encoder: json encoder class
+    :return: True if encoder serializes values like the SAFRSJSONEncoder does (i.e. `default` isn't overridden)
+    """
+    from .json_encoder import _SAFRSJSONEncoder
+
+    return getattr(encoder, "default", None) is _SAFRSJSONEncoder.default
+
+
+def _defined_on_class(cls: Any, attr_name: str) -> bool:
+    """
+    Check if `attr_name` is defined on `cls` without triggering descriptors
+    (getattr on the class would execute the jsonapi_attr/hybrid_property expressions)
+    """
+    return any(attr_name in getattr(klass, "__dict__", {}) for klass in inspect.getmro(cls))
+
+
+class AttributeSerializer:
+    """
+    Serializer for the jsonapi attributes of a SAFRSBase subclass
+
+    Use `get_attr_serializer` to retrieve a (cached) serializer instead of instantiating this class
+    """
+
+    def __init__(self: Any, model: Any, fields: Optional[tuple[str, ...]] = None, encoder: Any = None) -> None:
+        """
+        :param model: SAFRSBase subclass
+        :param fields: the attribute names to serialize (sparse fieldset), all jsonapi attributes if None
+        :param encoder: json encoder class used to serialize values, values are returned as-is if None
+        """
+        self.model = model
+        self.encoder = encoder
+        ja_attrs = model._s_jsonapi_attrs
+        if fields is None:
+            fields = tuple(ja_attrs.keys())
+        self.fields = fields
+        # If _s_check_perm has been overridden, the permissions may depend on the instance
+        self.instance_perms = inspect.getattr_static(model, "_s_check_perm", None) is not inspect.getattr_static(
+            safrs.SAFRSBase, "_s_check_perm"
+        )
+        self.getters: list[tuple[str, Optional[Callable[[Any], Any]]]] = []
+        relationships = model._s_relationships
+        for attr_name in fields:
+            if attr_name in relationships and attr_name not in ja_attrs:
+                # relationship names in the sparse fieldset are handled by `_s_get_related`
+                continue
+            getter = None
+            if attr_name in ja_attrs and (self.instance_perms or model._s_check_perm(attr_name)):
+                if _defined_on_class(model, attr_name):
+                    getter = attrgetter(attr_name)
+                else:
+                    getter = attrgetter(model.colname_to_attrname(attr_name))
+            # attributes that are not permitted or unknown are serialized as an empty string
+            self.getters.append((attr_name, getter))
+
+        self.converters: dict[type, Callable[[Any], Any]] = {}
+        if encoder is not None and _is_safrs_encoder(encoder):
+            self.converters = NATIVE_CONVERTERS
+
+    def encode_value(self: Any, value: Any) -> Any:
+        """
+        Convert a value that is not a json native type
+        :param value: attribute value
+        :return: json-ready value
+        """
+        converter = self.converters.get(type(value))
+        if converter is not None:
+            return converter(value)
+        # containers, subclasses and custom types: let the json encoder handle it
+        return json.loads(json.dumps(value, cls=self.encoder))
+
+    def __call__(self: Any, instance: Any) -> dict[str, Any]:
+        """
+        :param instance: SAFRSBase instance
+        :return: dictionary of json-ready attribute values
+        """
+        result = {}
+        encode = self.encoder is not None
+        for attr_name, getter in self.getters:
+            if getter is None or (self.instance_perms and not instance._s_check_perm(attr_name)):
+                attr_val = ""
+            else:
+                attr_val = getter(instance)
+            try:
+                if not encode or type(attr_val) in JSON_NATIVE_TYPES:
+                    result[attr_name] = attr_val
+                else:
+                    result[attr_name] = self.encode_value(attr_val)
+            except UnicodeDecodeError:  # pragma: no cover
+                safrs.log.warning(f"UnicodeDecodeError fetching {instance}.{attr_name}")
+                result[attr_name] = ""
+            except Exception as exc:
+                safrs.log.warning(f"Failed to fetch {instance}.{attr_name}: {exc}")
+
+        return result
+
+
+@lru_cache(maxsize=1024)
+def get_attr_serializer(model: Any, fields: Optional[tuple[str, ...]] = None, encoder: Any = None) -> AttributeSerializer:
+    """
+    :param model: SAFRSBase subclass
+    :param fields: requested fields (sparse fieldset) or None
+    :param encoder: json encoder class
+    :return: cached AttributeSerializer for the model, fieldset and encoder
+    """
+    return AttributeSerializer(model, fields, encoder)
@@ -58,6 +58,31 @@
 Description: URL prefix shown in the "links" field. If not set, request.url_root will be used.
 
 
+_s_stream:
+Type: bool
+Description: Stream the GET collection responses (serialize the rows while they're fetched from the database).
+
+
+_s_count_strategy:
+Type: str
+Description: How the collection count is computed: "exact", "cached", "estimated" or "none" (cfr. count_strategy.py).
+
+
+_s_conditional_get:
+Type: bool
+Description: Add ETag and Last-Modified headers to GET responses and answer matching conditional requests with "304 Not Modified".
+
+
+_s_response_cache:
+Type: bool
+Description: Cache the serialized GET responses in memory, writes invalidate the responses that depend on the model (cfr. response_cache.py).
+
+
+_s_bulk_create:
+Type: bool
+Description: Create the items of a bulk POST with batched INSERT statements in a single transaction (cfr. bulk.py).
+
+
 _s_columns:
 Type: classproperty
 Description: List of columns that are exposed by the API.
@@ -125,7 +150,7 @@
 
 _s_url:
 Type: hybrid_property
-Description: Returns the endpoint URL of this instance.
+Description: Returns the endpoint URL of this instance. The URL is built from a template that is compiled once per model and app.
 
 
 _s_meta:
@@ -181,14 +206,13 @@
 import inspect
 import datetime
 import sqlalchemy
-import json
-import operator
+import re
 from http import HTTPStatus
 from urllib.parse import urljoin
 from flask import request, url_for, has_request_context, current_app, g
 from flask_sqlalchemy.model import Model
 from sqlalchemy.orm.session import make_transient
-from sqlalchemy import inspect as sqla_inspect, or_
+from sqlalchemy import inspect as sqla_inspect
 from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOONE, MANYTOMANY
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
 from sqlalchemy.sql.schema import Column
@@ -197,15 +221,23 @@
 # safrs dependencies:
 import safrs
 import safrs.jsonapi
-from .errors import GenericError, NotFoundError, ValidationError, SystemValidationError
+from .errors import GenericError, JsonapiError, NotFoundError, ValidationError, SystemValidationError
 from .safrs_types import get_id_type
 from .attr_parse import parse_attr
+from .attr_serializer import get_attr_serializer
 from .config import get_config
-from .jsonapi_filters import jsonapi_filter
+from .conditional import bump_generation, mark_modified
+from .bulk import bulk_insert, bulk_insert_supported, bulk_rows, fetch_instances
+from .count_strategy import COUNT_STRATEGIES
+from .identity_cache import get_identity, identity_attrs, memoized_instance
+from .filter_compiler import compile_filter, filter_template
+from .jsonapi_filters import jsonapi_filter, sparse_fieldset_query
+from .relationship_loader import get_linkage, get_prefetched
 from .jsonapi_attr import is_jsonapi_attr
 from .swagger_doc import get_doc
 from .util import ClassPropertyDescriptor, classproperty
 from .model_config import SAFRSModelConfig
+from .timing import timed
 
 
 # Mapping of legacy "_s_" class attributes to SAFRSModelConfig field names.
@@ -216,6 +248,11 @@
     "_s_pk_delimiter": "pk_delimiter",
     "_s_url_root": "url_root",
     "_s_stateless": "stateless",
+    "_s_stream": "stream",
+    "_s_count_strategy": "count_strategy",
+    "_s_conditional_get": "conditional_get",
+    "_s_response_cache": "response_cache",
+    "_s_bulk_create": "bulk_create",
 }
 
 
@@ -273,6 +310,29 @@ def _resolve_safrs_model_config(model_cls: type) -> SAFRSModelConfig:
 
     return cfg
 
+
+# jsonapi_id placeholder used to compile the instance url templates
+_URL_ID_PLACEHOLDER = "_s_jsonapi_id_"
+# ids consisting of these characters are never escaped by the url converters
+_URL_SAFE_ID_RE = re.compile(r"[A-Za-z0-9._~-]+")
+
+
+@lru_cache(maxsize=1024)
+def _instance_url_template(model_cls: Any, app: Any, script_root: str) -> tuple[str, str]:
+    """
+    Build the instance url once per model, app and script root, the jsonapi_id
+    of an instance is filled in between the returned prefix and suffix.
+
+    :param model_cls: SAFRSBase subclass
+    :param app: flask app, the url map belongs to the app
+    :param script_root: request script root, prepended by url_for
+    :return: (prefix, suffix) of the instance url
+    """
+    params = {model_cls._s_object_id: _URL_ID_PLACEHOLDER}
+    instance_url = urljoin(model_cls._s_url_root, url_for(model_cls.get_endpoint(type="instance"), **params))
+    prefix, _, suffix = instance_url.partition(_URL_ID_PLACEHOLDER)
+    return prefix, suffix
+
 #
 # Map SQLA types to swagger2 json types
 # json supports only a couple of basic data types, which makes our job pretty easy :)
@@ -365,6 +425,9 @@ def _s_clear_config_cache(cls: Any) -> None:
         Use this if you mutate configuration overrides at runtime.
         """
         _resolve_safrs_model_config.cache_clear()
+        _instance_url_template.cache_clear()
+        identity_attrs.cache_clear()
+        filter_template.cache_clear()
 
     @classproperty
     def _s_expose(cls: Any) -> bool:
@@ -391,6 +454,38 @@ def _s_url_root(cls: Any) -> Any:
         """URL prefix shown in the JSON:API "links" field."""
         return cls.safrs_config.url_root
 
+    @classproperty
+    def _s_stream(cls: Any) -> bool:
+        """Indicates whether GET collection responses should be streamed."""
+        return bool(cls.safrs_config.stream or get_config("STREAM_COLLECTIONS"))
+
+    @classproperty
+    def _s_conditional_get(cls: Any) -> bool:
+        """Indicates whether GET responses contain ETag and Last-Modified headers, cfr. conditional.py."""
+        return bool(cls.safrs_config.conditional_get or get_config("CONDITIONAL_GET"))
+
+    @classproperty
+    def _s_response_cache(cls: Any) -> bool:
+        """Indicates whether GET responses are cached, cfr. response_cache.py."""
+        return bool(cls.safrs_config.response_cache or get_config("RESPONSE_CACHE"))
+
+    @classproperty
+    def _s_bulk_create(cls: Any) -> bool:
+        """Indicates whether bulk POST items are inserted in batches, cfr. bulk.py."""
+        enabled = cls.safrs_config.bulk_create
+        if enabled is None:
+            enabled = get_config("BULK_CREATE")
+        # models with a custom _s_post or __init__, validators or insert listeners are created per row
+        return bool(enabled) and bulk_insert_supported(cls)
+
+    @classproperty
+    def _s_count_strategy(cls: Any) -> str:
+        """Strategy used to compute the collection count, cfr. count_strategy.py."""
+        strategy = cls.safrs_config.count_strategy or get_config("COUNT_STRATEGY") or "exact"
+        if strategy not in COUNT_STRATEGIES:
+            raise SystemValidationError(f"Invalid count strategy {strategy} for {cls}, valid values: {', '.join(COUNT_STRATEGIES)}")
+        return str(strategy)
+
     # ---------------------------------------------------------------------
     # Phase 2: Hook infrastructure (no behavior changes yet)
     # ---------------------------------------------------------------------
@@ -555,6 +650,33 @@ def _s_post(cls: Any, jsonapi_id: Any=None, **params: Any) -> SAFRSBase:
         `_s_post` performs attribute sanitization and calls `cls.__init__`
         The attributes may contain an "id" if `cls.allow_client_generated_ids` is True
         """
+        instance = cls._s_new(jsonapi_id, **params)
+
+        if not instance._s_auto_commit or sqla_inspect(instance).pending:
+            #
+            # The item has not yet been added/commited by the SAFRSBase,
+            # in that case we have to do it ourselves
+            #
+            safrs.DB.session.add(instance)
+            try:
+                safrs.DB.session.commit()
+            except sqlalchemy.exc.SQLAlchemyError as exc:  # pragma: no cover
+                # Exception may arise when a db constraint has been violated
+                # (e.g. duplicate key)
+                safrs.log.warning(str(exc))
+                raise GenericError(str(exc))
+
+        bump_generation(cls)
+        return instance
+
+    @classmethod
+    def _s_new(cls: Any, jsonapi_id: Any=None, **params: Any) -> SAFRSBase:
+        """
+        Create an instance and add it to the session without committing, cfr. `_s_post`
+
+        :param attributes: the jsonapi "data" attributes and relationships
+        :return: new `cls` instance
+        """
         # remove attributes that are not declared in _s_jsonapi_attrs
         attributes = {attr_name: params[attr_name] for attr_name in params if attr_name in cls._s_jsonapi_attrs}
 
@@ -579,22 +701,77 @@ def _s_post(cls: Any, jsonapi_id: Any=None, **params: Any) -> SAFRSBase:
 
         if not instance in safrs.DB.session:
             safrs.DB.session.add(instance)
-        if not instance._s_auto_commit or sqla_inspect(instance).pending:
-            #
-            # The item has not yet been added/commited by the SAFRSBase,
-            # in that case we have to do it ourselves
-            #
-            safrs.DB.session.add(instance)
-            try:
-                safrs.DB.session.commit()
-            except sqlalchemy.exc.SQLAlchemyError as exc:  # pragma: no cover
-                # Exception may arise when a db constraint has been violated
-                # (e.g. duplicate key)
-                safrs.log.warning(str(exc))
-                raise GenericError(str(exc))
-
         return instance
 
+    @classmethod
+    def _s_bulk_post(cls: Any, items: list[dict[str, Any]]) -> list[SAFRSBase]:
+        """
+        This method is called when multiple items are created with a bulk POST to the json api
+
+        :param items: list of `_s_post` keyword arguments (attributes and relationships)
+        :return: list of new `cls` instances
+
+        The items are inserted in batches and flushed but not committed, the caller commits once.
+        If the items can't be inserted in bulk, they're created with `_s_post`, cfr. bulk.py
+        """
+        rows = bulk_rows(cls, items) if cls._s_bulk_create else None
+        if rows is None:
+            return [cls._s_post(**params) for params in items]
+        try:
+            instances = bulk_insert(cls, rows)
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            # Exception may arise when a db constraint has been violated
+            safrs.log.warning(str(exc))
+            safrs.DB.session.rollback()
+            raise GenericError(str(exc))
+        if instances is None:
+            return [cls._s_post(**params) for params in items]
+        mark_modified(cls)
+        return instances
+
+    @classmethod
+    def _s_bulk_patch(cls: Any, items: list[tuple[Any, dict[str, Any]]]) -> list[Any]:
+        """
+        This method is called when multiple items are updated with a bulk PATCH to the json api
+
+        :param items: list of (jsonapi_id, attributes) tuples
+        :return: the updated instance or the exception that occurred, for every item
+
+        The instances are retrieved at once and the changes are flushed but not committed, the caller commits once.
+        The `source` attribute of an exception contains the JSON pointer (relative to the item) of the invalid attribute.
+        Models that override `_s_patch` can't be patched in bulk: `_s_patch` may commit every row, so a failing item
+        couldn't be rolled back.
+        """
+        if cls._s_patch is not SAFRSBase._s_patch:
+            raise ValidationError(f"{cls.__name__} doesn't support bulk PATCH", HTTPStatus.METHOD_NOT_ALLOWED)
+        instances = fetch_instances(cls, [jsonapi_id for jsonapi_id, _ in items])
+        results: list[Any] = []
+        for jsonapi_id, attributes in items:
+            instance = instances.get(jsonapi_id)
+            if instance is None:
+                results.append(NotFoundError(f'Invalid "{cls.__name__}" ID "{jsonapi_id}"'))
+                continue
+            result = instance
+            for attr_name, attr_val in attributes.items():
+                if attr_name not in cls._s_jsonapi_attrs or not instance._s_check_perm(attr_name, "w"):
+                    continue
+                try:
+                    setattr(instance, attr_name, instance._s_parse_attr_value(attr_name, attr_val))
+                except (JsonapiError, ValueError, TypeError) as exc:
+                    if not isinstance(exc, JsonapiError):
+                        exc = ValidationError(f"Invalid value for {attr_name}: {exc}")
+                    exc.source = {"pointer": f"/attributes/{attr_name}"}
+                    result = exc
+            results.append(result)
+        try:
+            safrs.DB.session.flush()
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            safrs.log.warning(str(exc))
+            safrs.DB.session.rollback()
+            raise GenericError(str(exc))
+        mark_modified(cls)
+        return results
+
     def _s_patch(self: Any, **attributes: Any) -> SAFRSBase:
         """
         Update the object attributes
@@ -610,6 +787,7 @@ def _s_patch(self: Any, **attributes: Any) -> SAFRSBase:
             setattr(self, attr_name, attr_val)
 
         safrs.DB.session.commit()
+        bump_generation(self.__class__)
         # query ourself, this will also execute sqla hooks
         return self.get_instance(self.jsonapi_id)
 
@@ -618,6 +796,7 @@ def _s_delete(self: Any) -> None:
         Delete the instance from the database
         """
         safrs.DB.session.delete(self)
+        mark_modified(self.__class__)
 
     def _add_rels(self: Any, **params: Any) -> None:
         """
@@ -825,35 +1004,16 @@ def _s_jsonapi_attrs(self: Any) -> Any:
             of that type in its response.
         Therefore we extract the required fieldnames from the request args, eg. Users/?Users[name] => [name]
         """
-        fields = self.__class__._s_jsonapi_attrs.keys()
+        fields = None
         if has_request_context():
-            fields = request.fields.get(self._s_class_name, fields)
-
-        result = {}
-        ja_attr_names = [name for name in self.__class__._s_jsonapi_attrs.keys() if self._s_check_perm(name)]
-
-        for attr in fields:
-            attr_val = ""
-            attr_name = attr
-            if attr in ja_attr_names:
-                if hasattr(self, attr):
-                    attr_val = getattr(self, attr)
-                else:
-                    col_name = self.colname_to_attrname(attr)
-                    attr_val = getattr(self, col_name)
-            try:
-                # use the current_app json_encoder
-                if current_app:
-                    result[attr_name] = json.loads(json.dumps(attr_val, cls=current_app.json_encoder))
-                else:
-                    result[attr_name] = attr_val
-            except UnicodeDecodeError:  # pragma: no cover
-                safrs.log.warning(f"UnicodeDecodeError fetching {self}.{attr}")
-                result[attr] = ""
-            except Exception as exc:
-                safrs.log.warning(f"Failed to fetch {self}.{attr}: {exc}")
-
-        return result
+            fields = request.fields.get(self._s_class_name, None)
+        if fields is not None:
+            fields = tuple(fields)
+        # use the current_app json_encoder
+        encoder = getattr(current_app, "json_encoder", None) if current_app else None
+        serializer = get_attr_serializer(self.__class__, fields, encoder)
+        with timed("attributes"):
+            return serializer(self)
 
     @_s_jsonapi_attrs.expression  # type: ignore[no-redef]
     @lru_cache(maxsize=32)
@@ -957,7 +1117,13 @@ def get_instance(cls: Any, item: Any=None, failsafe: Any=False) -> Any:
 
         if id is not None or not failsafe:
             try:
-                instance = cls._s_query.filter_by(**primary_keys).first()
+                # the instance may have been retrieved earlier during this request
+                instance = memoized_instance(cls, id)
+                if instance is None:
+                    # identity map lookup, this doesn't query the db if the instance is already in the session
+                    instance = get_identity(cls, id, primary_keys)
+                if instance is NotImplemented:
+                    instance = cls._s_query.filter_by(**primary_keys).first()
             except Exception as exc:  # pragma: no cover
                 safrs.log.error(f"Failed to get instance with keys {primary_keys}")
                 raise GenericError(f"get_instance : {exc}")
@@ -1067,15 +1233,9 @@ def _s_jsonapi_encode(self: Any) -> Any:
                 "type": "..."
                 }`
         """
-        # params = { self.object_id : self.id }
-        # obj_url = url_for(self.get_endpoint(), **params) # Doesn't work :(, todo : why?
-        obj_url = url_for(self.get_endpoint())
-        if obj_url.endswith("/"):
-            obj_url = obj_url[:-1]
-
         self_link = self._s_url
         attributes = self.to_dict()
-        relationships = self._s_get_related()
+        relationships = self._s_get_related(self_link)
         g.ja_data.add(self)
         data = dict(attributes=attributes, id=self.jsonapi_id, links={"self": self_link}, type=self._s_type, relationships=relationships)
 
@@ -1111,25 +1271,33 @@ def _s_relationship_result(rel_url: str, data: Any, meta: dict[str, Any]) -> dic
     def _s_related_collection_data(self: Any, rel_name: str, next_included_list: list[list[str]]) -> tuple[list[Any], dict[str, Any]]:
         data: list[Any] = []
         meta: dict[str, Any] = {}
-        rel_query = getattr(self, rel_name)
         limit = cast(Any, request).get_page_limit(rel_name)
+        offset = cast(Any, request).get_page_offset(rel_name)
         if not get_config("ENABLE_RELATIONSHIPS"):
             meta["warning"] = "ENABLE_RELATIONSHIPS set to false in config.py"
             return data, meta
-        if not rel_query:
-            return data, meta
 
-        if getattr(rel_query, "limit", False):
-            count = rel_query.count()
-            rel_query = rel_query.limit(limit)
-            if rel_query.count() >= get_config("BIG_QUERY_THRESHOLD"):
-                warning = f'Truncated result for relationship "{rel_name}",consider paginating this request'
-                safrs.log.warning(warning)
-                meta["warning"] = warning
-            items = rel_query.all()
-        else:  # rel_query is an 'InstrumentedList'
-            items = list(rel_query)[:limit]
-            count = len(items)
+        prefetched = get_prefetched(self, rel_name)
+        if prefetched is not None:
+            # loaded for the whole response page by prefetch_included
+            items, count = prefetched
+            if not count and self._s_relationships[rel_name].lazy != "dynamic":
+                return data, meta
+        else:
+            rel_query = getattr(self, rel_name)
+            if not rel_query:
+                return data, meta
+            if getattr(rel_query, "limit", False):
+                count = rel_query.count()
+                items = rel_query.offset(offset).limit(limit).all()
+            else:  # rel_query is an 'InstrumentedList'
+                count = len(rel_query)
+                items = list(rel_query)[offset : offset + limit]
+
+        if len(items) >= get_config("BIG_QUERY_THRESHOLD"):
+            warning = f'Truncated result for relationship "{rel_name}",consider paginating this request'
+            safrs.log.warning(warning)
+            meta["warning"] = warning
 
         meta["count"] = meta["total"] = count
         meta["limit"] = limit
@@ -1137,8 +1305,39 @@ def _s_related_collection_data(self: Any, rel_name: str, next_included_list: lis
             data.append(Included(rel_item, next_included_list))
         return data, meta
 
-    def _s_get_related(self: Any) -> Any:
+    def _s_related_linkage(self: Any, rel_name: str) -> tuple[Any, dict[str, Any]]:
         """
+        :return: resource linkage ({"id", "type"}) of the related instances, without loading these instances
+        """
+        meta: dict[str, Any] = {}
+        relationship = self._s_relationships[rel_name]
+        if not get_config("ENABLE_RELATIONSHIPS"):
+            meta["warning"] = "ENABLE_RELATIONSHIPS set to false in config.py"
+            return ([] if relationship.direction != MANYTOONE else None), meta
+
+        offset = cast(Any, request).get_page_offset(rel_name)
+        limit = cast(Any, request).get_page_limit(rel_name)
+        linkage = get_linkage(self, rel_name, offset, limit)
+        if linkage is None:
+            # the linkage can't be derived from the PKs, load the instances
+            rel_items = getattr(self, rel_name)
+            rel_items = [rel_items] if relationship.direction == MANYTOONE else list(rel_items)
+            identifiers = [{"id": str(item.jsonapi_id), "type": item._s_type} for item in rel_items if item is not None]
+            count = len(identifiers)
+            if relationship.direction != MANYTOONE:
+                identifiers = identifiers[offset : offset + limit]
+        else:
+            identifiers, count = linkage
+        if relationship.direction == MANYTOONE:
+            return (identifiers[0] if identifiers else None), meta
+
+        meta["count"] = meta["total"] = count
+        meta["limit"] = limit
+        return identifiers, meta
+
+    def _s_get_related(self: Any, instance_url: Optional[str] = None) -> Any:
+        """
+        :param instance_url: the url of this instance (self._s_url), used to create the relationship links
         :return: dict of relationship names -> [related instances]
 
         http://jsonapi.org/format/#fetching-includes
@@ -1164,6 +1363,10 @@ def _s_get_related(self: Any) -> Any:
         included_list, included_rels, excluded_list = self._s_get_include_settings()
         relationships = {}
         self._s_validate_included_relationships(included_rels, included_list)
+        # relationships requested in the sparse fieldset (fields[Type]=rel_name) contain the resource linkage
+        linkage_rels = getattr(request, "fields", {}).get(self._s_class_name, [])
+        if instance_url is None:
+            instance_url = self._s_url
 
         for rel_name, relationship in self._s_relationships.items():
             """
@@ -1200,7 +1403,11 @@ def _s_get_related(self: Any) -> Any:
                 next_included_list = self._s_nested_included_list(included_list, rel_name)
                 if relationship.direction == MANYTOONE:
                     # manytoone relationship contains a single instance
-                    rel_item = getattr(self, rel_name)
+                    prefetched = get_prefetched(self, rel_name)
+                    if prefetched is None:
+                        rel_item = getattr(self, rel_name)
+                    else:
+                        rel_item = prefetched[0][0] if prefetched[0] else None
                     if rel_item:
                         # create an Included instance that will be used for serialization eventually
                         data = Included(rel_item, next_included_list)
@@ -1209,8 +1416,14 @@ def _s_get_related(self: Any) -> Any:
                 else:  # pragma: no cover
                     # should never happen
                     safrs.log.error(f"Unknown relationship direction for relationship {rel_name}: {relationship.direction}")
+            elif rel_name in linkage_rels:
+                data, meta = self._s_related_linkage(rel_name)
 
-            rel_link = urljoin(self._s_url, rel_name)
+            if instance_url.endswith("/"):
+                # same as urljoin for relationship names
+                rel_link = instance_url + rel_name
+            else:
+                rel_link = urljoin(instance_url, rel_name)
             relationships[rel_name] = self._s_relationship_result(rel_link, data, meta)
 
         return relationships
@@ -1392,6 +1605,11 @@ def _s_url(self: Any, url_prefix: Any='') -> Any:
         :return: endpoint url of this instance
         """
         try:
+            jsonapi_id = str(self.jsonapi_id)
+            if has_request_context() and _URL_SAFE_ID_RE.fullmatch(jsonapi_id) and jsonapi_id not in (".", ".."):
+                # url_for is relatively slow, fill in the id in the precompiled url
+                prefix, suffix = _instance_url_template(self.__class__, current_app._get_current_object(), request.script_root)
+                return prefix + jsonapi_id + suffix
             params = {self._s_object_id: self.jsonapi_id}
             instance_url = url_for(self.get_endpoint(type="instance"), **params)
             result = urljoin(self._s_url_root, instance_url)
@@ -1454,45 +1672,16 @@ def _s_filter(cls: Any, *filter_args: Any, **filter_kwargs: Any) -> Any:
             - is_not: check if field is not a value
             - le: check if field is less than or equal to something
             - lt: check if field is less than to something
+            - in, notin: check if field is (not) in a list of values
         - val: The value that you want to compare.
+        Filters can be combined with {"and": [...]}, {"or": [...]} and {"not": {...}}, cfr. filter_compiler.py
         :return: sqla query object
         """
-        try:
-            filters = json.loads(filter_args[0])
-        except json.decoder.JSONDecodeError:
-            raise ValidationError("Invalid filter format (see https://github.com/thomaxxl/safrs/wiki)")
-
-        if not isinstance(filters, list):
-            filters = [filters]
-
-        expressions = []
-        query = cls._s_query
-
-        for filt in filters:
-            if not isinstance(filt, dict):
-                safrs.log.warning(f"Invalid filter '{filt}'")
-                continue
-            attr_name = filt.get("name")
-            attr_val = filt.get("val")
-            if attr_name != "id" and attr_name not in cls._s_jsonapi_attrs:
-                raise ValidationError(f'Invalid filter "{filt}", unknown attribute "{attr_name}"')
-
-            op_name = filt.get("op", "").strip("_")
-            attr = cls._s_jsonapi_attrs[attr_name] if attr_name != "id" else cls.id
-            if op_name in ["in", "notin"]:
-                op = getattr(attr, op_name + "_")
-                query = query.filter(op(attr_val))
-            elif op_name in ["like", "ilike", "match", "notilike"] and hasattr(attr, "like"):
-                # => attr is Column or InstrumentedAttribute
-                like = getattr(attr, op_name)
-                expressions.append(like(attr_val))
-            elif not hasattr(operator, op_name):
-                raise ValidationError(f'Invalid filter "{filt}", unknown operator "{op_name}"')
-            else:
-                op = getattr(operator, op_name)
-                expressions.append(op(attr, attr_val))
-
-        return query.filter(or_(*expressions))
+        expression = compile_filter(cls, filter_args[0])
+        query = sparse_fieldset_query(cls, cls._s_query)
+        if expression is None:
+            return query
+        return query.filter(expression)
 
 
 class Included:
@@ -1524,16 +1713,19 @@ def encode(cls: Any) -> Any:  # type: ignore[no-redef]
         """
         encoding of all included instances (in the included[] part of the jsonapi response)
         """
-        already_included = set()
-        result = []
+        return list(cls.iter_encoded())
+
+    @classmethod
+    def iter_encoded(cls: Any) -> Any:
+        """
+        generate the encoded included instances one by one (used when streaming the response)
+        instances that are added to `g.ja_included` while encoding will be generated as well
+        """
         while True:
             instances = getattr(g, "ja_included", None)
             if not instances:
                 break
             instance = instances.pop()
-            if instance in already_included or instance in g.ja_data:
+            if instance in g.ja_data:
                 continue
-            included = instance._s_jsonapi_encode()
-            result.append(included)
-
-        return result
+            yield instance._s_jsonapi_encode()
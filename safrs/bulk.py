@@ -0,0 +1,235 @@
+# Bulk creation, update and deletion of instances
+#
+# Creating the instances one by one with `_s_post` commits every instance (twice).
+# SAFRSBase._s_bulk_post parses and validates all items first, then inserts the rows
+# in batches of BULK_CREATE_BATCH_SIZE with an ORM bulk "INSERT ... RETURNING" (executemany)
+# statement in a single transaction. The transaction is committed by the caller
+# (the http_method_decorator for flask requests), i.e. only once.
+#
+# The bulk INSERT doesn't call the model __init__, the @validates validators and the attribute
+# and mapper insert events, so (cfr. `bulk_insert_supported`)
+# - models that override `_s_post`, `__init__`, `_s_parse_attr_value` or `__setattr__` are created per row
+# - models with validators, attribute set listeners or before_insert/after_insert listeners are created per row
+# - bulk creation can be disabled with SAFRSConfig.bulk_create or the BULK_CREATE setting
+# The items are also created per row when they contain relationships, non-column attributes
+# or client-generated ids that may have to be upserted, and when the database doesn't
+# support INSERT ... RETURNING for executemany.
+#
+# SAFRSBase._s_bulk_patch retrieves all the instances of a bulk PATCH with one "IN" query
+# per batch, sets the attributes in memory and flushes the updates at once (the unit of work
+# groups the UPDATEs with the same columns in an executemany). Again, the caller commits.
+# Models that override `_s_patch` can't be patched in bulk (their `_s_patch` may commit every row).
+#
+# A DELETE to a collection deletes the instances that match the filter query arguments
+# (a filter is required). When the ORM doesn't have to take care of anything when an instance
+# is deleted (cfr. `core_delete_supported`), this is a single "DELETE ... WHERE" statement (on mysql,
+# the primary keys are selected first and deleted in batches) and
+# single instances are deleted by primary key without loading them first.
+# Otherwise the instances are loaded and deleted one by one with `_s_delete`.
+#
+from functools import lru_cache
+from typing import Any, Optional
+import sqlalchemy
+from sqlalchemy.orm.interfaces import MANYTOMANY, ONETOMANY
+from flask import has_request_context
+import safrs
+from .attr_parse import parse_attr
+from .config import get_config
+from .identity_cache import identity_key
+
+
+def bulk_rows(model: Any, items: list[dict[str, Any]]) -> Optional[list[dict[str, Any]]]:
+    """
+    Convert the `_s_post` parameters of the items to rows for a bulk INSERT
+
+    :param model: SAFRSBase subclass
+    :param items: `_s_post` keyword arguments for every item
+    :return: list of {attribute name: value} rows or None if the items can't be bulk inserted
+    """
+    mapper = sqlalchemy.inspect(model)
+    column_keys = {prop.key for prop in mapper.column_attrs}
+    rows = []
+    for params in items:
+        if any(name in model._s_relationships for name in params):
+            return None
+        attributes = {name: params[name] for name in params if name in model._s_jsonapi_attrs}
+        if model.allow_client_generated_ids:
+            jsonapi_id = params.get("jsonapi_id", None)
+            jsonapi_id = jsonapi_id if jsonapi_id is not None else params.get("id", None)
+            if jsonapi_id is not None and model._s_upsert:
+                # the instance may exist already and has to be updated
+                return None
+            attributes["id"] = jsonapi_id
+        else:
+            for name in list(attributes):
+                if name in model.id_type.column_names:
+                    safrs.log.warning(f"Client generated IDs are not allowed ('allow_client_generated_ids' not set for {model})")
+                    del attributes[name]
+        row = {}
+        if "id" in column_keys:
+            # same as in SAFRSBase.__init__: generate an id if none was provided (unless it's autoincremented)
+            jsonapi_id = model.id_type(attributes.pop("id", None))
+            if jsonapi_id is not None:
+                row["id"] = jsonapi_id
+        for name, value in attributes.items():
+            if name not in column_keys:
+                # eg. jsonapi_attr setters
+                return None
+            column = model._s_jsonapi_attrs[name]
+            row[name] = parse_attr(column, value) if has_request_context() else value
+        rows.append(row)
+    return rows
+
+
+def bulk_insert(model: Any, rows: list[dict[str, Any]]) -> Optional[list[Any]]:
+    """
+    Insert the rows in batches, without committing
+
+    :param model: SAFRSBase subclass
+    :param rows: rows created by `bulk_rows`
+    :return: the created instances, in the order of the rows, None if the database doesn't support bulk INSERT ... RETURNING
+    """
+    session = safrs.DB.session
+    dialect = session.get_bind(mapper=sqlalchemy.inspect(model)).dialect
+    if not dialect.insert_executemany_returning_sort_by_parameter_order:
+        return None
+    batch_size = max(int(get_config("BULK_CREATE_BATCH_SIZE")), 1)
+    stmt = sqlalchemy.insert(model).returning(model, sort_by_parameter_order=True)
+    instances: list[Any] = []
+    for start in range(0, len(rows), batch_size):
+        instances += session.scalars(stmt, rows[start : start + batch_size]).all()
+    return instances
+
+
+def fetch_instances(model: Any, jsonapi_ids: list[Any]) -> dict[Any, Any]:
+    """
+    Retrieve the instances with the given ids in batches of BULK_CREATE_BATCH_SIZE
+
+    :param model: SAFRSBase subclass
+    :param jsonapi_ids: jsonapi ids
+    :return: {jsonapi_id: instance} for the instances that exist
+        (the ids are matched by identity, eg. "01" and "1" refer to the same instance with an integer key)
+    """
+    result = {}
+    identities: dict[tuple[Any, ...], list[Any]] = {}
+    for jsonapi_id in jsonapi_ids:
+        identity = identity_key(model, model.id_type.get_pks(jsonapi_id))
+        if identity is None:
+            # eg. a custom _s_query, look up the instance by itself
+            instance = model.get_instance(jsonapi_id, failsafe=True)
+            if instance is not None:
+                result[jsonapi_id] = instance
+        else:
+            identities.setdefault(identity, []).append(jsonapi_id)
+    mapper = sqlalchemy.inspect(model)
+    key = sqlalchemy.tuple_(*mapper.primary_key) if len(mapper.primary_key) > 1 else mapper.primary_key[0]
+    batch_size = max(int(get_config("BULK_CREATE_BATCH_SIZE")), 1)
+    pending = list(identities)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        values = batch if len(mapper.primary_key) > 1 else [identity[0] for identity in batch]
+        for instance in model._s_query.filter(key.in_(values)):
+            for jsonapi_id in identities.get(tuple(sqlalchemy.inspect(instance).identity), []):
+                result[jsonapi_id] = instance
+    return result
+
+
+@lru_cache(maxsize=1024)
+def bulk_insert_supported(model: Any) -> bool:
+    """
+    :param model: SAFRSBase subclass
+    :return: True if instances of `model` can be created with a bulk INSERT instead of `_s_post`, i.e.
+        - `_s_post`, `__init__`, `_s_parse_attr_value` and `__setattr__` aren't overridden
+          (the attribute values are parsed with `parse_attr` and set in the rows)
+        - there are no @validates validators and no attribute "set" event listeners
+        - there are no before_insert/after_insert mapper event listeners
+    """
+    # sqlalchemy instruments __init__, the original is kept in _sa_original_init
+    init = getattr(model.__init__, "_sa_original_init", model.__init__)
+    if model._s_post.__func__ is not safrs.SAFRSBase._s_post.__func__ or init is not safrs.SAFRSBase.__init__:
+        return False
+    if model._s_parse_attr_value is not safrs.SAFRSBase._s_parse_attr_value or model.__setattr__ is not safrs.SAFRSBase.__setattr__:
+        return False
+    mapper = sqlalchemy.inspect(model)
+    if mapper.validators or mapper.dispatch.before_insert or mapper.dispatch.after_insert:
+        return False
+    for prop in mapper.column_attrs:
+        if mapper.class_manager[prop.key].dispatch.set:
+            return False
+    return True
+
+
+@lru_cache(maxsize=1024)
+def core_delete_supported(model: Any) -> bool:
+    """
+    :param model: SAFRSBase subclass
+    :return: True if instances of `model` can be deleted with a DELETE statement instead of `session.delete()`, i.e.
+        - `_s_delete` isn't overridden
+        - there are no before_delete/after_delete mapper event listeners
+        - the model doesn't inherit from another mapped class and isn't polymorphic
+        - deleting an instance doesn't cascade, nullify foreign keys or remove association rows
+          in the ORM (unless the relationship is declared with passive_deletes)
+    """
+    if model._s_delete is not safrs.SAFRSBase._s_delete:
+        return False
+    mapper = sqlalchemy.inspect(model)
+    if mapper.dispatch.before_delete or mapper.dispatch.after_delete:
+        return False
+    if mapper.inherits is not None or mapper.polymorphic_on is not None:
+        return False
+    for rel in mapper.relationships:
+        if rel.viewonly or rel.passive_deletes:
+            continue
+        if rel.cascade.delete or rel.direction in (ONETOMANY, MANYTOMANY):
+            return False
+    return True
+
+
+def bulk_delete(model: Any, query: Any) -> int:
+    """
+    Delete the instances selected by `query` with one DELETE statement, without committing
+
+    :param model: SAFRSBase subclass, `core_delete_supported(model)` must be True
+    :param query: filtered query (or list of instances)
+    :return: number of deleted rows
+    """
+    if isinstance(query, list):
+        # eg. an invalid filter
+        for instance in query:
+            instance._s_delete()
+        return len(query)
+    session = safrs.DB.session
+    mapper = sqlalchemy.inspect(model)
+    key = sqlalchemy.tuple_(*mapper.primary_key) if len(mapper.primary_key) > 1 else mapper.primary_key[0]
+    selected = query.enable_eagerloads(False).with_entities(*mapper.primary_key).order_by(None)
+    if session.get_bind(mapper=mapper).dialect.name not in ("mysql", "mariadb"):
+        stmt = sqlalchemy.delete(model).where(key.in_(sqlalchemy.select(*selected.subquery().c)))
+        result = session.execute(stmt, execution_options={"synchronize_session": "fetch"})
+        return int(result.rowcount)
+    # mysql doesn't allow a subquery on the table a DELETE is deleting from (error 1093):
+    # select the primary keys first and delete them in batches
+    keys = [tuple(row) if len(mapper.primary_key) > 1 else row[0] for row in selected]
+    batch_size = max(int(get_config("BULK_CREATE_BATCH_SIZE")), 1)
+    count = 0
+    for start in range(0, len(keys), batch_size):
+        stmt = sqlalchemy.delete(model).where(key.in_(keys[start : start + batch_size]))
+        result = session.execute(stmt, execution_options={"synchronize_session": "fetch"})
+        count += int(result.rowcount)
+    return count
+
+
+def delete_by_id(model: Any, jsonapi_id: Any) -> Optional[int]:
+    """
+    Delete an instance with a "DELETE ... WHERE pk = :id" statement, without loading it
+
+    :param model: SAFRSBase subclass
+    :param jsonapi_id: jsonapi id
+    :return: number of deleted rows (0 if the instance doesn't exist), None if the instance has to be deleted by the ORM
+    """
+    primary_keys = model.id_type.get_pks(jsonapi_id)
+    # identity_key also checks that _s_query isn't customized
+    if not core_delete_supported(model) or identity_key(model, primary_keys) is None:
+        return None
+    stmt = sqlalchemy.delete(model).filter_by(**primary_keys)
+    result = safrs.DB.session.execute(stmt, execution_options={"synchronize_session": "evaluate"})
+    return int(result.rowcount)
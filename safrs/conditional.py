@@ -0,0 +1,201 @@
+# HTTP conditional GET (https://httpwg.org/specs/rfc9110.html#conditional.requests)
+#
+# When SAFRSConfig.conditional_get (or the CONDITIONAL_GET setting) is enabled, GET responses
+# contain an ETag and a Last-Modified header. A request with a matching If-None-Match
+# (or If-Modified-Since) header is answered with "304 Not Modified" before the
+# database is queried and the response is serialized.
+#
+# The ETags are derived from
+# - a per-model generation counter, incremented when instances of the model are flushed.
+#   The counters are kept in memory, so they only see the changes made by this process.
+#   For a multi-process deployment, use a version column instead (or disable conditional GET).
+# - the version column of an instance (SAFRSConfig.version_column), this is used for
+#   instance requests without include= (the representation of the included resources depends on other tables)
+#
+# SAFRSConfig.cache_control sets the Cache-Control header of the GET responses.
+#
+import datetime
+import hashlib
+import os
+import threading
+from typing import Any, Optional
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.http import http_date, parse_date, parse_etags
+import safrs
+
+# changes when the process restarts, so ETags of a previous process don't match
+_BOOT_ID = os.urandom(8).hex()
+_BOOT_TIME = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+_generations: dict[Any, int] = {}
+_modified: dict[Any, datetime.datetime] = {}
+_generation_lock = threading.Lock()
+
+
+def bump_generation(model: Any) -> None:
+    """
+    Invalidate the ETags of `model` (and its superclasses, for polymorphic models)
+
+    :param model: SAFRSBase subclass whose instances were modified
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    with _generation_lock:
+        for cls in model.__mro__:
+            if isinstance(cls, type) and issubclass(cls, safrs.SAFRSBase) and cls is not safrs.SAFRSBase:
+                _generations[cls] = _generations.get(cls, 0) + 1
+                _modified[cls] = now
+
+
+def mark_modified(model: Any, session: Any = None) -> None:
+    """
+    Invalidate the ETags of `model` now and again when the changes are committed, for modifications that
+    aren't flushed by the unit of work (bulk statements, deletes, relationship updates)
+
+    :param model: SAFRSBase subclass whose instances were modified
+    :param session: the session that will commit the changes, safrs.DB.session by default
+    """
+    bump_generation(model)
+    session = safrs.DB.session if session is None else session
+    session.info.setdefault("safrs_flushed_models", set()).add(model)
+
+
+def get_generation(model: Any) -> int:
+    """
+    :param model: SAFRSBase subclass
+    :return: number of times instances of `model` were flushed by this process
+    """
+    return _generations.get(model, 0)
+
+
+def get_last_modified(models: list[Any]) -> datetime.datetime:
+    """
+    :param models: SAFRSBase subclasses
+    :return: the time of the last modification of these models (the process start time if they weren't modified)
+    """
+    return max([_modified.get(model, _BOOT_TIME) for model in models])
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Any, flush_context: Any) -> None:
+    """
+    Increment the generations of the models of the flushed instances
+    """
+    models = {type(instance) for instance in (*session.new, *session.dirty, *session.deleted)}
+    for model in models:
+        if isinstance(model, type) and issubclass(model, safrs.SAFRSBase):
+            bump_generation(model)
+            session.info.setdefault("safrs_flushed_models", set()).add(model)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Any) -> None:
+    """
+    Increment the generations again when the changes are committed:
+    a response that was generated between the flush and the commit contains the old data
+    """
+    for model in session.info.pop("safrs_flushed_models", ()):
+        bump_generation(model)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session: Any, previous_transaction: Any) -> None:
+    session.info.pop("safrs_flushed_models", None)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(orm_execute_state: Any) -> None:
+    """
+    Increment the generation for ORM-enabled bulk INSERT, UPDATE and DELETE statements
+    """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, safrs.SAFRSBase):
+            mark_modified(mapper.class_, orm_execute_state.session)
+
+
+def dependent_models(model: Any, include_csv: str) -> list[Any]:
+    """
+    :param model: SAFRSBase subclass
+    :param include_csv: include= query argument
+    :return: `model` and the models whose instances can appear in its response (related and included models)
+    """
+    models = [model] + [rel.mapper.class_ for rel in model._s_relationships.values()]
+    for path in [path for path in include_csv.split(",") if path]:
+        cls = model
+        for rel_name in path.split("."):
+            relationship = cls._s_relationships.get(rel_name) if hasattr(cls, "_s_relationships") else None
+            if relationship is None:
+                break
+            cls = relationship.mapper.class_
+            models += [cls] + [rel.mapper.class_ for rel in cls._s_relationships.values()]
+    return list(dict.fromkeys(models))
+
+
+def instance_version(model: Any, jsonapi_id: Any) -> Any:
+    """
+    :param model: SAFRSBase subclass
+    :param jsonapi_id: jsonapi id of the instance
+    :return: the value of the version column of the instance, None if not found
+    """
+    version_column = getattr(model, model.safrs_config.version_column)
+    pks = model.id_type.get_pks(jsonapi_id)
+    try:
+        return safrs.DB.session.execute(sqlalchemy.select(version_column).filter_by(**pks)).scalar()
+    except sqlalchemy.exc.SQLAlchemyError as exc:
+        safrs.log.warning(f"Failed to retrieve the version of {model} {jsonapi_id}: {exc}")
+        return None
+
+
+def compute_validators(model: Any, jsonapi_id: Any = None, query_string: str = "", include_csv: str = "") -> tuple[str, Optional[datetime.datetime]]:
+    """
+    :param model: SAFRSBase subclass
+    :param jsonapi_id: id of the requested instance, None for collections
+    :param query_string: the request query string, different query arguments lead to different representations
+    :param include_csv: include= query argument
+    :return: (strong ETag, Last-Modified)
+    """
+    version = None
+    if jsonapi_id is not None and model.safrs_config.version_column and not include_csv:
+        version = instance_version(model, jsonapi_id)
+    if version is not None:
+        parts: tuple[Any, ...] = (model._s_type, jsonapi_id, version, query_string)
+        last_modified = version if isinstance(version, datetime.datetime) else None
+        if last_modified is not None and last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    else:
+        models = dependent_models(model, include_csv)
+        generations = tuple(get_generation(cls) for cls in models)
+        parts = (_BOOT_ID, model._s_type, jsonapi_id, generations, query_string)
+        last_modified = get_last_modified(models)
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"', last_modified
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime.datetime], if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """
+    :param etag: current ETag
+    :param last_modified: current Last-Modified
+    :param if_none_match: If-None-Match request header
+    :param if_modified_since: If-Modified-Since request header, ignored when If-None-Match is present
+    :return: True if the client representation is still valid (i.e. the response is "304 Not Modified")
+    """
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag.strip('"'))
+    if if_modified_since and last_modified is not None:
+        since = parse_date(if_modified_since)
+        return since is not None and last_modified <= since
+    return False
+
+
+def validator_headers(model: Any, etag: str, last_modified: Optional[datetime.datetime]) -> dict[str, str]:
+    """
+    :return: the ETag, Last-Modified and Cache-Control response headers
+    """
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if model.safrs_config.cache_control:
+        headers["Cache-Control"] = model.safrs_config.cache_control
+    return headers
@@ -0,0 +1,114 @@
+# Collection count strategies
+#
+# The total number of resources in a collection response ("meta": {"count": ...}) is computed
+# according to the count strategy of the model (SAFRSConfig.count_strategy or the COUNT_STRATEGY setting):
+#   "exact"     : SAFRSObject._s_count(), i.e. a count() query for every request (default)
+#   "cached"    : the exact count, cached for count_ttl seconds per model and filter
+#   "estimated" : the row count from the database statistics (sqlite_stat1, PostgreSQL pg_class.reltuples),
+#                 filtered collections and databases without statistics fall back to "exact"
+#   "none"      : the count is omitted
+#
+import threading
+import time
+from typing import Any, Optional
+import sqlalchemy
+from flask import has_request_context, request
+import safrs
+
+COUNT_STRATEGIES = ("exact", "cached", "estimated", "none")
+# max. number of cached counts
+COUNT_CACHE_SIZE = 1024
+
+_count_cache: dict[tuple[Any, ...], tuple[float, int]] = {}
+_count_cache_lock = threading.Lock()
+
+
+def filter_signature() -> tuple[tuple[str, str], ...]:
+    """
+    :return: the filter query arguments of the current request, these determine the collection count
+    """
+    if not has_request_context():
+        return ()
+    return tuple(sorted((key, value) for key, value in request.args.items() if key.startswith("filter")))
+
+
+def _cached_count(safrs_object: Any, ttl: float) -> int:
+    """
+    :param safrs_object: SAFRSBase subclass
+    :param ttl: number of seconds a count remains valid
+    :return: the cached count for the filter arguments of the current request
+    """
+    key = (safrs_object, filter_signature())
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    count = safrs_object._s_count()
+    with _count_cache_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            # drop the entry that expires first
+            del _count_cache[min(_count_cache, key=lambda k: _count_cache[k][0])]
+        _count_cache[key] = (now + ttl, count)
+    return count
+
+
+def clear_count_cache(safrs_object: Any = None) -> None:
+    """
+    :param safrs_object: SAFRSBase subclass whose cached counts are removed, all counts are removed if None
+    """
+    with _count_cache_lock:
+        for key in [key for key in _count_cache if safrs_object is None or key[0] is safrs_object]:
+            del _count_cache[key]
+
+
+def estimated_count(safrs_object: Any) -> Optional[int]:
+    """
+    Retrieve the table row count from the database statistics
+
+    :param safrs_object: SAFRSBase subclass
+    :return: estimated number of rows or None if no statistics are available
+    """
+    table = getattr(safrs_object, "__table__", None)
+    if not isinstance(table, sqlalchemy.Table):
+        return None
+    bind = safrs.DB.session.get_bind(mapper=sqlalchemy.inspect(safrs_object))
+    try:
+        # use a separate connection, a failed statement shouldn't affect the session transaction
+        with bind.connect() as connection:
+            if bind.dialect.name == "sqlite":
+                # the first number of the stat column is the number of rows, cfr. https://www.sqlite.org/fileformat2.html#stat1tab
+                stat = connection.execute(
+                    sqlalchemy.text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"), {"table": table.name}
+                ).scalar()
+                return int(stat.split()[0]) if stat else None
+            if bind.dialect.name == "postgresql":
+                table_name = f"{table.schema}.{table.name}" if table.schema else table.name
+                reltuples = connection.execute(
+                    sqlalchemy.text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table_name}
+                ).scalar()
+                # reltuples is -1 if the table has never been analyzed
+                return int(reltuples) if reltuples is not None and reltuples >= 0 else None
+    except sqlalchemy.exc.SQLAlchemyError as exc:
+        # eg. sqlite_stat1 doesn't exist because ANALYZE never ran
+        safrs.log.debug(f"No count estimate for {safrs_object}: {exc}")
+    return None
+
+
+def collection_count(safrs_object: Any) -> tuple[Optional[int], bool]:
+    """
+    Count the instances of a collection according to the count strategy of `safrs_object`
+
+    :param safrs_object: SAFRSBase subclass
+    :return: (count, estimated), count is None when the strategy is "none"
+    """
+    strategy = safrs_object._s_count_strategy
+    if strategy == "none":
+        return None, False
+    if strategy == "estimated" and not filter_signature():
+        count = estimated_count(safrs_object)
+        if count is not None:
+            return count, True
+    if strategy == "cached":
+        return _cached_count(safrs_object, safrs_object.safrs_config.count_ttl), False
+    return safrs_object._s_count(), False
@@ -2,25 +2,42 @@
 
 import base64
 import datetime as dt
+import functools
 import inspect
+import itertools
 from http import HTTPStatus
 from typing import Any, Dict, Iterable, List, NoReturn, Optional, Sequence, Set, Tuple, Type, Union, cast
+from urllib.parse import urlencode
 
 import safrs
 from safrs.attr_parse import parse_attr
-from safrs.errors import GenericError, JsonapiError, SystemValidationError, ValidationError
+from safrs.errors import GenericError, JsonapiError, NotFoundError, SystemValidationError, ValidationError
 from safrs.json_encoder import SAFRSFormattedResponse
 from safrs.swagger_doc import get_doc, get_http_methods
 
-from fastapi import APIRouter, Body, Depends as FastAPIDepends, FastAPI, HTTPException, Request, Response
+from fastapi import APIRouter, Body, Depends as FastAPIDepends, FastAPI, HTTPException, Request, Response, __version__ as fastapi_version
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.params import Depends as DependsParam
+from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from sqlalchemy.orm import load_only
 from sqlalchemy.orm.interfaces import MANYTOMANY, ONETOMANY
 
 from .schemas import SchemaRegistry
-from .responses import JSONAPIResponse
+from .responses import JSONAPIResponse, render_json
+from .async_session import async_endpoint, install_session_proxy
+from safrs.json_backend import iter_json_array
+from safrs.jsonapi_filters import relationship_query, sparse_fieldset_columns
+from safrs.relationship_loader import load_included
+from safrs.jsonapi_attr import is_jsonapi_attr, query_attr
+from safrs.related_sort import related_sort_keys, related_value
+from safrs.keyset import keyset_paginate
+from safrs.conditional import compute_validators, is_not_modified, validator_headers
+from safrs.spec_cache import SpecSnapshot, load_snapshot, save_snapshot, schema_fingerprint
+from safrs.timing import finish_request_timing, start_request_timing, timed, timing_enabled
+from safrs.bulk import delete_by_id
+from safrs.atomic import ATOMIC_EXT, ATOMIC_MEDIA_TYPE, AtomicOperations
 
 JSONAPI_MEDIA_TYPE = "application/vnd.api+json"
 
@@ -135,10 +152,40 @@ async def _jsonapi_starlette_http_error_handler(_request: Request, exc: Starlett
         return JSONAPIResponse(status_code=int(exc.status_code), content=payload)
 
 
+def timed_endpoint(handler: Any) -> Any:
+    """
+    :param handler: sync route handler
+    :return: handler that times the request phases when timing is enabled (cfr. safrs/timing.py)
+    """
+
+    @functools.wraps(handler)
+    def endpoint(*args: Any, **kwargs: Any) -> Any:
+        if not timing_enabled():
+            return handler(*args, **kwargs)
+        request = next((arg for arg in kwargs.values() if isinstance(arg, Request)), None)
+        token = start_request_timing(request.method if request else "", request.url.path if request else "")
+        response = None
+        try:
+            response = handler(*args, **kwargs)
+            return response
+        finally:
+            if token is not None:
+                finish_request_timing(token, response.headers if isinstance(response, Response) else None)
+
+    return endpoint
+
+
 class SafrsFastAPI:
-    def __init__(self, app: FastAPI, prefix: str = "", dependencies: Optional[List[Any]] = None) -> None:
+    def __init__(self, app: FastAPI, prefix: str = "", dependencies: Optional[List[Any]] = None, async_session: Optional[Any] = None) -> None:
+        """
+        :param async_session: AsyncSession factory (sqlalchemy.ext.asyncio.async_sessionmaker),
+                              the route handlers run as coroutines with this session (cfr. async_session.py)
+        """
         self.app = app
         self.prefix = prefix
+        self.async_session = async_session
+        if async_session is not None:
+            install_session_proxy()
         self.max_union_included_types = int(getattr(safrs.SAFRS, "MAX_UNION_INCLUDED_TYPES", 0))
         self.document_relationships = bool(getattr(safrs.SAFRS, "DOCUMENT_RELATIONSHIPS", True))
         self.validate_requests = bool(getattr(safrs.SAFRS, "VALIDATE_REQUESTS", False))
@@ -149,7 +196,17 @@ def __init__(self, app: FastAPI, prefix: str = "", dependencies: Optional[List[A
         )
         self.default_dependencies = self._normalize_dependencies(dependencies)
         install_jsonapi_exception_handlers(app)
+        # exposed models, used to compute the fingerprint of the spec snapshot (cfr. safrs/spec_cache.py)
+        self._spec_models: List[Type[Any]] = []
+        self._spec_dependencies: List[List[str]] = []
+        self._spec_snapshot: Optional[Tuple[int, int, SpecSnapshot]] = None
+        self._generate_openapi = app.openapi
+        app.openapi = self.openapi  # type: ignore[method-assign]
         self._install_swagger_alias()
+        # exposed models by jsonapi type, for the atomic operations endpoint
+        self.models: Dict[str, Type[Any]] = {}
+        if getattr(safrs.SAFRS, "ATOMIC_OPERATIONS", False):
+            self._register_atomic_route(str(getattr(safrs.SAFRS, "ATOMIC_URL", "/operations")))
 
     def _install_swagger_alias(self) -> None:
         for route in self.app.routes:
@@ -157,8 +214,62 @@ def _install_swagger_alias(self) -> None:
                 return
 
         @self.app.get("/swagger.json", include_in_schema=False)
-        def swagger_json() -> Dict[str, Any]:
-            return self.app.openapi()
+        def swagger_json(request: Request) -> Any:
+            cache_dir = getattr(safrs.SAFRS, "SPEC_CACHE_DIR", None)
+            if not cache_dir:
+                return self.app.openapi()
+            snapshot = self.spec_snapshot(str(cache_dir))
+            if is_not_modified(snapshot.etag, None, request.headers.get("if-none-match"), None):
+                return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": snapshot.etag})
+            return Response(content=snapshot.body, media_type="application/json", headers={"ETag": snapshot.etag})
+
+    def openapi(self) -> Dict[str, Any]:
+        """
+        Replaces app.openapi: when SPEC_CACHE_DIR is set, the openapi schema is loaded from the spec snapshot
+        """
+        cache_dir = getattr(safrs.SAFRS, "SPEC_CACHE_DIR", None)
+        if not cache_dir or self.app.openapi_schema:
+            return self._generate_openapi()
+        self.app.openapi_schema = self.spec_snapshot(str(cache_dir)).spec
+        return self.app.openapi_schema
+
+    def _spec_settings(self) -> Dict[str, Any]:
+        """
+        :return: the app properties, settings and routes that affect the openapi schema
+        """
+        # top level routes, the routes of the exposed models are described by the model signatures and their dependencies
+        routes = [[getattr(route, "path", None), sorted(getattr(route, "methods", None) or [])] for route in self.app.routes]
+        app = self.app
+        return {
+            "fastapi": fastapi_version,
+            "app": [app.title, app.version, app.openapi_version, app.summary, app.description, app.servers, app.openapi_tags],
+            "prefix": self.prefix,
+            "document_relationships": self.document_relationships,
+            "max_union_included_types": self.max_union_included_types,
+            "routes": routes,
+            "dependencies": self._spec_dependencies,
+        }
+
+    def spec_snapshot(self, cache_dir: str) -> SpecSnapshot:
+        """
+        Load the openapi schema snapshot of the exposed models from `cache_dir`,
+        or generate and save it when no snapshot matches the current fingerprint.
+
+        :param cache_dir: SPEC_CACHE_DIR
+        :return: snapshot
+        """
+        state = (len(self._spec_models), len(self.app.routes))
+        if self._spec_snapshot is not None and self._spec_snapshot[:2] == state:
+            return self._spec_snapshot[2]
+        fingerprint = schema_fingerprint(self._spec_models, self._spec_settings())
+        snapshot = load_snapshot(cache_dir, "openapi", fingerprint)
+        if snapshot is None:
+            self.app.openapi_schema = None
+            body = JSONResponse(self._generate_openapi()).body
+            snapshot = save_snapshot(cache_dir, "openapi", fingerprint, bytes(body))
+            safrs.log.info(f"Saved the openapi spec snapshot {fingerprint} in {cache_dir}")
+        self._spec_snapshot = (*state, snapshot)
+        return snapshot
 
     @staticmethod
     def _with_slash_parity(path: str) -> List[str]:
@@ -237,6 +348,15 @@ def _discover_rpc_methods(self, Model: Type[Any]) -> List[Tuple[str, bool, List[
                 rpc_methods.append((method_name, class_level, http_methods))
         return rpc_methods
 
+    def _endpoint(self, handler: Any) -> Any:
+        """
+        :return: the route endpoint for `handler`, a coroutine in async mode
+        """
+        handler = timed_endpoint(handler)
+        if self.async_session is None:
+            return handler
+        return async_endpoint(self.async_session, handler)
+
     def _add_route_with_slash_parity(
         self,
         router: APIRouter,
@@ -251,6 +371,7 @@ def _add_route_with_slash_parity(
         responses: Optional[Dict[Union[int, str], Dict[str, Any]]] = None,
         openapi_extra: Optional[Dict[str, Any]] = None,
     ) -> None:
+        endpoint = self._endpoint(endpoint)
         for method in methods:
             method_name = str(method).upper()
             method_operation_id = f"{operation_id}_{method_name.lower()}"
@@ -657,7 +778,8 @@ def _model_filter_query_parameters(self, Model: Type[Any]) -> List[Dict[str, Any
         params: List[Dict[str, Any]] = [
             self._query_parameter("filter", description=f"{Model._s_type} filter expression"),
         ]
-        attrs = set(getattr(Model, "_s_jsonapi_attrs", {}).keys())
+        # jsonapi_attr attributes without sql expression can't be filtered
+        attrs = {attr_name for attr_name in getattr(Model, "_s_jsonapi_attrs", {}).keys() if query_attr(Model, attr_name) is not None}
         attrs.add("id")
         for attr_name in sorted(attrs):
             params.append(
@@ -697,6 +819,8 @@ def _jsonapi_query_parameters(
         if include_pagination:
             params.append(self._query_parameter("page[offset]", "integer", "Pagination offset"))
             params.append(self._query_parameter("page[limit]", "integer", "Pagination limit"))
+            params.append(self._query_parameter("page[after]", description="Page cursor from the next link (keyset pagination)"))
+            params.append(self._query_parameter("page[before]", description="Page cursor from the previous link (keyset pagination)"))
         if include_sort:
             params.append(self._query_parameter("sort", description="Sort field (prefix with '-' for descending)"))
         if include_filter:
@@ -844,6 +968,11 @@ def expose_object(
         self._register_relationship_routes(router, Model, tag, instance_path, route_dependencies)
 
         self.app.include_router(router)
+        self._spec_models.append(Model)
+        self._spec_dependencies.append([getattr(dep.dependency, "__qualname__", str(dep.dependency)) for dep in write_route_dependencies])
+        # models with write dependencies (eg. authentication) can't be modified with atomic operations
+        if not self._write_dependencies_for_model(Model):
+            self.models[str(Model._s_type)] = Model
 
         # If /docs was opened before exposing models, FastAPI may have cached OpenAPI already.
         self.app.openapi_schema = None
@@ -854,6 +983,7 @@ def _jsonapi_doc(
         errors: Any = None,
         included: Any = None,
         meta: Any = None,
+        links: Any = None,
     ) -> Dict[str, Any]:
         doc: Dict[str, Any] = {"jsonapi": {"version": "1.0"}}
         if errors is not None:
@@ -864,6 +994,8 @@ def _jsonapi_doc(
             doc["included"] = included
         if meta is not None:
             doc["meta"] = meta
+        if links is not None:
+            doc["links"] = links
         return doc
 
     def _jsonapi_response(
@@ -872,7 +1004,8 @@ def _jsonapi_response(
         status_code: int = 200,
         headers: Optional[Dict[str, str]] = None,
     ) -> JSONAPIResponse:
-        return JSONAPIResponse(status_code=status_code, headers=headers, content=content)
+        with timed("encode"):
+            return JSONAPIResponse(status_code=status_code, headers=headers, content=content)
 
     def _jsonapi_error(self, status_code: int, title: str, detail: str) -> NoReturn:
         payload = self._jsonapi_doc(
@@ -1201,15 +1334,21 @@ def _iter_related_items(self, rel_value: Any) -> List[Any]:
             return list(rel_value)
         return [rel_value]
 
+    @staticmethod
+    def _sort_fields(request: Request) -> List[Tuple[str, bool]]:
+        sort_arg = request.query_params.get("sort") or ""
+        return [(field.lstrip("-"), field.startswith("-")) for field in sort_arg.split(",") if field.lstrip("-")]
+
     def _apply_sort(self, items: List[Any], request: Request) -> List[Any]:
-        sort_arg = request.query_params.get("sort")
-        if not sort_arg:
+        sort_fields = self._sort_fields(request)
+        if not sort_fields:
             return items
-        attr_name = sort_arg.lstrip("-")
-        reverse = sort_arg.startswith("-")
         try:
-            sort_key = cast(Any, lambda item: getattr(item, attr_name, None))
-            return sorted(items, key=sort_key, reverse=reverse)
+            # python's sort is stable: sort by the least significant field first
+            for attr_name, reverse in reversed(sort_fields):
+                sort_key = cast(Any, lambda item: related_value(item, attr_name))
+                items = sorted(items, key=sort_key, reverse=reverse)
+            return items
         except Exception:
             return items
 
@@ -1258,25 +1397,89 @@ def _apply_pagination(self, value: Any, request: Request) -> Any:
         items = self._coerce_items(value)
         return items[offset : offset + limit]
 
-    def _apply_sort_query_or_items(self, Model: Type[Any], value: Any, request: Request) -> Any:
-        sort_arg = request.query_params.get("sort")
-        if not sort_arg:
+    @staticmethod
+    def _is_keyset_request(request: Request) -> bool:
+        return "page[after]" in request.query_params or "page[before]" in request.query_params
+
+    def _apply_keyset_pagination(self, Model: Type[Any], value: Any, request: Request) -> Tuple[List[Any], Dict[str, str]]:
+        """
+        page[after]/page[before] cursor pagination (cfr. safrs.keyset)
+        :return: (page items, links containing the cursors of the adjacent pages)
+        """
+        max_limit = int(getattr(safrs.SAFRS, "MAX_PAGE_LIMIT", 100000))
+        limit = self._parse_page_param(request.query_params.get("page[limit]"), int(getattr(safrs.SAFRS, "DEFAULT_PAGE_LIMIT", 250)))
+        limit = min(max(limit, 1), max_limit)
+        after = request.query_params.get("page[after]")
+        before = request.query_params.get("page[before]")
+        items, next_cursor, prev_cursor = keyset_paginate(
+            value if self._is_query_like(value) else self._coerce_items(value),
+            Model,
+            request.query_params.get("sort", ""),
+            after,
+            before,
+            limit,
+        )
+
+        ignore_args = ("page[offset]", "page[limit]", "page[after]", "page[before]")
+        params = [(key, val) for key, val in request.query_params.multi_items() if key not in ignore_args]
+
+        def cursor_link(cursor_arg: str, cursor: str) -> str:
+            query = urlencode(params + [(cursor_arg, cursor), ("page[limit]", str(limit))], safe="[]")
+            return f"{request.url.path}?{query}"
+
+        links = {"first": cursor_link("page[after]", "")}
+        links["self"] = cursor_link("page[before]", before) if before is not None else cursor_link("page[after]", after or "")
+        if next_cursor is not None:
+            links["next"] = cursor_link("page[after]", next_cursor)
+        if prev_cursor is not None:
+            links["prev"] = cursor_link("page[before]", prev_cursor)
+        return items, links
+
+    def _apply_sparse_fieldset(self, Model: Type[Any], value: Any, wanted_fields: Optional[Set[str]]) -> Any:
+        # only select the requested columns (+ primary and foreign keys)
+        if not self._is_query_like(value):
             return value
+        columns = sparse_fieldset_columns(Model, sorted(wanted_fields) if wanted_fields is not None else None)
+        if not columns:
+            return value
+        return value.options(load_only(*columns))
 
-        attr_name = sort_arg.lstrip("-")
-        reverse = sort_arg.startswith("-")
+    def _apply_sort_query_or_items(self, Model: Type[Any], value: Any, request: Request) -> Any:
+        sort_fields = self._sort_fields(request)
+        if not sort_fields:
+            return value
 
         if self._is_query_like(value):
-            model_attr = getattr(Model, attr_name, None)
-            if model_attr is None:
+            order_by: List[Any] = []
+            joins: Dict[Any, Any] = {}
+            for attr_name, reverse in sort_fields:
+                if "." in attr_name:
+                    # related attribute, eg. "author.name"
+                    value, keys = related_sort_keys(value, Model, attr_name, reverse, joins)
+                    order_by += keys
+                    continue
+                model_attr = self._query_attr(Model, attr_name)
+                if model_attr is None:
+                    continue
+                order_by.append(model_attr.desc() if reverse else model_attr.asc())
+            if not order_by:
                 return value
             try:
-                return value.order_by(model_attr.desc() if reverse else model_attr.asc())
+                return value.order_by(*order_by)
             except Exception:
                 return value
 
         return self._apply_sort(self._coerce_items(value), request)
 
+    @staticmethod
+    def _query_attr(Model: Type[Any], attr_name: str) -> Any:
+        """
+        :return: the attribute to use in queries, None for jsonapi_attr attributes without sql expression
+        """
+        if is_jsonapi_attr(getattr(Model, "_s_jsonapi_attrs", {}).get(attr_name)):
+            return query_attr(Model, attr_name)
+        return getattr(Model, attr_name, None)
+
     def _apply_filter(self, Model: Type[Any], request: Request, base_query: Any) -> Any:
         raw_filter = request.query_params.get("filter")
         bracket_filters: Dict[str, str] = {}
@@ -1288,10 +1491,13 @@ def _apply_filter(self, Model: Type[Any], request: Request, base_query: Any) ->
             if bracket_filters:
                 filtered_query = base_query
                 for attr_name, attr_value in bracket_filters.items():
-                    model_attr = getattr(Model, attr_name, None)
-                    if model_attr is None:
+                    if attr_name not in getattr(Model, "_s_jsonapi_attrs", {}) and not hasattr(Model, attr_name):
                         return []
                     if self._is_query_like(filtered_query):
+                        model_attr = self._query_attr(Model, attr_name)
+                        if model_attr is None:
+                            safrs.log.debug(f"Filtering not implemented for {Model}.{attr_name}")
+                            continue
                         filtered_query = filtered_query.filter(model_attr == attr_value)
                     else:
                         items = self._coerce_items(filtered_query)
@@ -1312,6 +1518,23 @@ def _apply_filter(self, Model: Type[Any], request: Request, base_query: Any) ->
             self._handle_safrs_exception(exc)
         return filtered
 
+    def _relationship_items(self, parent: Any, rel: Any, request: Request) -> Any:
+        """
+        Filter a to-many relationship: the filter query of the target is restricted to the parent's relationship,
+        so the relationship doesn't have to be loaded. Falls back to filtering the loaded relationship.
+        """
+        target_model = rel.mapper.class_
+        query = relationship_query(self._apply_filter(target_model, request, target_model._s_query), parent, rel)
+        if query is not None:
+            return query
+        rel_value = getattr(parent, rel.key, None)
+        filtered = self._apply_filter(target_model, request, rel_value)
+        if filtered is rel_value or not request.query_params.get("filter"):
+            return self._coerce_items(filtered)
+        # the filter= query doesn't take the relationship into account
+        members = {id(item) for item in self._iter_related_items(rel_value)}
+        return [item for item in self._coerce_items(filtered) if id(item) in members]
+
     def _lookup_related_instance(self, target_model: Type[Any], payload: Dict[str, Any], strict: bool = True) -> Any:
         if not isinstance(payload, dict):
             self._jsonapi_error(400, "ValidationError", "Invalid data payload")
@@ -1401,6 +1624,11 @@ def _encode_resource(
         Don’t call obj.to_dict() (Flask current_app dependency).
         Build attributes from Model._s_jsonapi_attrs instead and json-encode them.
         """
+        with timed("attributes"):
+            return self._encode_attributes(Model, obj, wanted_fields)
+
+    @staticmethod
+    def _encode_attributes(Model: Type[Any], obj: Any, wanted_fields: Optional[Set[str]]) -> Dict[str, Any]:
         attrs: Dict[str, Any] = {}
         for attr_name in Model._s_jsonapi_attrs.keys():
             if wanted_fields is not None and attr_name not in wanted_fields:
@@ -1425,47 +1653,139 @@ def _encode_resource(
     def _get_collection(self, Model: Type[Any]):
         def handler(request: Request):
             try:
+                headers, not_modified = self._conditional_get_headers(Model, request)
+                if not_modified:
+                    return Response(status_code=HTTPStatus.NOT_MODIFIED.value, headers=headers)
                 fields_map = self._parse_sparse_fields_map(request)
                 wanted_fields = fields_map.get(str(Model._s_type)) or self._parse_sparse_fields(Model, request)
                 include_paths = self._parse_include_paths(Model, request)
-                query_or_items = self._apply_filter(Model, request, Model._s_query)
-                query_or_items = self._apply_sort_query_or_items(Model, query_or_items, request)
-                query_or_items = self._apply_pagination(query_or_items, request)
-                objs = self._coerce_items(query_or_items)
+                with timed("filter"):
+                    query_or_items = self._apply_filter(Model, request, Model._s_query)
+                    query_or_items = self._apply_sparse_fieldset(Model, query_or_items, wanted_fields)
+                with timed("sort"):
+                    query_or_items = self._apply_sort_query_or_items(Model, query_or_items, request)
+                links: Optional[Dict[str, str]] = None
+                with timed("paginate"):
+                    if self._is_keyset_request(request):
+                        query_or_items, links = self._apply_keyset_pagination(Model, query_or_items, request)
+                    else:
+                        query_or_items = self._apply_pagination(query_or_items, request)
+                if Model._s_stream and self.async_session is None and self._is_query_like(query_or_items):
+                    # the response generator runs after the handler returns, ie. outside the async session
+                    response = self._stream_collection(Model, query_or_items, wanted_fields, include_paths, fields_map)
+                    response.headers.update(headers)
+                    return response
+                with timed("paginate"):
+                    objs = self._coerce_items(query_or_items)
                 data = [self._encode_resource(Model, o, wanted_fields=wanted_fields) for o in objs]
                 included: List[Dict[str, Any]] = []
                 seen: Set[Tuple[str, str]] = set()
                 if include_paths:
-                    for obj in objs:
-                        self._collect_included(Model, obj, include_paths, fields_map, seen, included)
+                    with timed("include"):
+                        for obj in objs:
+                            self._collect_included(Model, obj, include_paths, fields_map, seen, included)
                 return self._jsonapi_response(
                     self._jsonapi_doc(
                         data=data,
                         included=included if include_paths else None,
                         meta={"count": len(data)},
-                    )
+                        links=links,
+                    ),
+                    headers=headers or None,
                 )
             except Exception as exc:
                 self._handle_safrs_exception(exc)
 
         return handler
 
+    def _conditional_get_headers(self, Model: Type[Any], request: Request, object_id: Optional[str] = None) -> Tuple[Dict[str, str], bool]:
+        """
+        Compute the ETag and Last-Modified before the resource is retrieved (cfr. safrs.conditional)
+        :return: (ETag, Last-Modified and Cache-Control response headers, True if the response is "304 Not Modified")
+        """
+        headers: Dict[str, str] = {}
+        if not Model._s_conditional_get:
+            if Model.safrs_config.cache_control:
+                headers["Cache-Control"] = Model.safrs_config.cache_control
+            return headers, False
+        include_csv = request.query_params.get("include", getattr(safrs.SAFRS, "DEFAULT_INCLUDED", ""))
+        etag, last_modified = compute_validators(Model, object_id, request.url.query, include_csv)
+        headers = validator_headers(Model, etag, last_modified)
+        not_modified = is_not_modified(etag, last_modified, request.headers.get("if-none-match"), request.headers.get("if-modified-since"))
+        return headers, not_modified
+
+    def _stream_collection(
+        self,
+        Model: Type[Any],
+        query: Any,
+        wanted_fields: Optional[Set[str]],
+        include_paths: List[List[str]],
+        fields_map: Dict[str, Set[str]],
+    ) -> StreamingResponse:
+        """
+        Stream the collection document: the data items are encoded while the rows are fetched
+        in batches of STREAM_YIELD_PER, followed by included and meta.
+        """
+        yield_per = int(getattr(safrs.SAFRS, "STREAM_YIELD_PER", 1000) or 1000)
+        # iter() executes the query, so query errors are raised before the response starts
+        objs = iter(query.yield_per(yield_per))
+        included: List[Dict[str, Any]] = []
+        seen: Set[Tuple[str, str]] = set()
+        count = 0
+
+        def chunks() -> Iterable[Any]:
+            # the included relationships of every chunk of rows are loaded at once
+            while True:
+                chunk = list(itertools.islice(objs, yield_per))
+                if not chunk:
+                    return
+                if include_paths:
+                    load_included(chunk, include_paths)
+                yield from chunk
+
+        def encode(obj: Any) -> bytes:
+            nonlocal count
+            count += 1
+            if include_paths:
+                self._collect_included(Model, obj, include_paths, fields_map, seen, included)
+            return render_json(self._encode_resource(Model, obj, wanted_fields=wanted_fields))
+
+        def generate() -> Iterable[bytes]:
+            try:
+                yield b'{"jsonapi":{"version":"1.0"},"data":['
+                yield from iter_json_array(chunks(), encode, yield_per)
+                yield b"]"
+                if include_paths:
+                    yield b',"included":[' + b",".join(render_json(item) for item in included) + b"]"
+                yield b',"meta":' + render_json({"count": count}) + b"}"
+            except Exception as exc:
+                safrs.log.exception(f"Failed to stream {Model} response: {exc}")
+                raise
+
+        return StreamingResponse(generate(), media_type=JSONAPI_MEDIA_TYPE)
+
     def _get_instance(self, Model: Type[Any]):
         def handler(object_id: str, request: Request):
             try:
-                obj = Model.get_instance(object_id)
+                headers, not_modified = self._conditional_get_headers(Model, request, object_id)
+                if not_modified:
+                    return Response(status_code=HTTPStatus.NOT_MODIFIED.value, headers=headers)
+                with timed("query"):
+                    obj = Model.get_instance(object_id)
                 fields_map = self._parse_sparse_fields_map(request)
                 wanted_fields = fields_map.get(str(Model._s_type)) or self._parse_sparse_fields(Model, request)
                 include_paths = self._parse_include_paths(Model, request)
                 included: List[Dict[str, Any]] = []
                 seen: Set[Tuple[str, str]] = set()
                 if include_paths:
-                    self._collect_included(Model, obj, include_paths, fields_map, seen, included)
+                    with timed("include"):
+                        self._collect_included(Model, obj, include_paths, fields_map, seen, included)
                 return self._jsonapi_response(
                     self._jsonapi_doc(
                         data=self._encode_resource(Model, obj, wanted_fields=wanted_fields),
                         included=included if include_paths else None,
-                    )
+                    ),
+                    headers=headers or None,
                 )
             except Exception as exc:
                 self._handle_safrs_exception(exc)
@@ -1479,14 +1799,17 @@ def _coerce_post_items(self, Model: Type[Any], payload: Dict[str, Any]) -> List[
         self._require_type(Model, payload)
         return [payload.get("data") or {}]
 
-    def _create_post_object(self, Model: Type[Any], data: Dict[str, Any]) -> Any:
+    def _post_params(self, Model: Type[Any], data: Dict[str, Any]) -> Dict[str, Any]:
         if not isinstance(data, dict):
             self._jsonapi_error(400, "ValidationError", "Invalid JSON:API payload (data item must be object)")
         if data.get("type") != Model._s_type:
             self._jsonapi_error(400, "ValidationError", "Invalid type: expected " + str(Model._s_type))
         attrs = self._parse_attributes_for_model(Model, data.get("attributes") or {})
         rels = data.get("relationships") or {}
-        return Model._s_post(jsonapi_id=data.get("id"), **attrs, **rels)
+        return {"jsonapi_id": data.get("id"), **attrs, **rels}
+
+    def _create_post_object(self, Model: Type[Any], data: Dict[str, Any]) -> Any:
+        return Model._s_post(**self._post_params(Model, data))
 
     @staticmethod
     def _append_auto_include_paths(include_paths: List[List[str]], obj: Any) -> None:
@@ -1560,13 +1883,18 @@ def handler(
                 wanted_fields = fields_map.get(str(Model._s_type)) or self._parse_sparse_fields(Model, request)
                 include_paths = self._parse_include_paths(Model, request)
                 created: List[Any] = []
-                for data in items:
-                    obj = self._create_post_object(Model, data)
-                    created.append(obj)
+                if isinstance(payload.get("data"), list):
+                    # bulk create: one transaction, committed after the response has been serialized
+                    created = Model._s_bulk_post([self._post_params(Model, data) for data in items])
+                else:
+                    created = [self._create_post_object(Model, data) for data in items]
+                for obj in created:
                     self._append_auto_include_paths(include_paths, obj)
                 deduped_include_paths = self._dedupe_include_paths(include_paths)
                 included = self._collect_included_for_created(Model, created, deduped_include_paths, fields_map)
-                return self._build_post_response(Model, created, wanted_fields, deduped_include_paths, included)
+                response = self._build_post_response(Model, created, wanted_fields, deduped_include_paths, included)
+                safrs.DB.session.commit()
+                return response
             except JSONAPIHTTPError:
                 raise
             except Exception as exc:
@@ -1620,8 +1948,12 @@ def handler(
     def _delete_instance(self, Model: Type[Any]):
         def handler(object_id: str):
             try:
-                obj = Model.get_instance(object_id)
-                obj._s_delete()
+                deleted = delete_by_id(Model, object_id)
+                if deleted is None:
+                    obj = Model.get_instance(object_id)
+                    obj._s_delete()
+                elif not deleted:
+                    raise NotFoundError(f'Invalid "{Model.__name__}" ID "{object_id}"')
                 safrs.DB.session.commit()
                 return Response(status_code=204)
             except JSONAPIHTTPError:
@@ -1631,6 +1963,50 @@ def handler(object_id: str):
 
         return handler
 
+    def _register_atomic_route(self, path: str) -> None:
+        """
+        Register the JSON:API atomic operations endpoint (https://jsonapi.org/ext/atomic/), cfr. safrs/atomic.py
+        """
+        for variant in self._with_slash_parity(path):
+            self.app.add_api_route(
+                self.prefix + variant,
+                self._endpoint(self._post_operations()),
+                methods=["POST"],
+                response_class=JSONAPIResponse,
+                dependencies=self.default_dependencies,
+                include_in_schema=False,
+            )
+
+    def _post_operations(self):
+        def handler(payload: Dict[str, Any] = Body(..., media_type=ATOMIC_MEDIA_TYPE)):
+            try:
+                operations = AtomicOperations(self.models, parse_attributes=self._parse_attributes_for_model)
+                results = operations.execute(payload.get("atomic:operations"))
+                atomic_results = [{"data": self._encode_resource(*result)} if result is not None else {} for result in results]
+                safrs.DB.session.commit()
+            except JSONAPIHTTPError:
+                safrs.DB.session.rollback()
+                raise
+            except JsonapiError as exc:
+                safrs.DB.session.rollback()
+                status = int(getattr(exc, "status_code", 400))
+                error = {
+                    "status": str(status),
+                    "title": exc.__class__.__name__,
+                    "detail": str(getattr(exc, "message", str(exc))),
+                    "source": getattr(exc, "source", {"pointer": "/atomic:operations"}),
+                }
+                raise JSONAPIHTTPError(status, self._jsonapi_doc(errors=[error]))
+            except Exception as exc:
+                safrs.DB.session.rollback()
+                self._handle_safrs_exception(exc)
+            return self._jsonapi_response(
+                {"jsonapi": {"version": "1.1", "ext": [ATOMIC_EXT]}, "atomic:results": atomic_results},
+                headers={"Content-Type": ATOMIC_MEDIA_TYPE},
+            )
+
+        return handler
+
     def _get_relationship(self, Model: Type[Any], rel_name: str):
         def handler(object_id: str, request: Request):
             try:
@@ -1642,28 +2018,35 @@ def handler(object_id: str, request: Request):
                 fields_map = self._parse_sparse_fields_map(request)
                 wanted_fields = fields_map.get(str(target_model._s_type))
                 include_paths = self._parse_include_paths(target_model, request)
-                rel_value = getattr(parent, rel_name, None)
-
                 if self._is_to_many_relationship(rel):
-                    items = self._apply_filter(target_model, request, rel_value)
-                    items = self._coerce_items(items)
-                    items = self._apply_sort_query_or_items(target_model, items, request)
-                    items = self._apply_pagination(items, request)
-                    items = self._coerce_items(items)
+                    with timed("filter"):
+                        items = self._relationship_items(parent, rel, request)
+                    with timed("sort"):
+                        items = self._apply_sort_query_or_items(target_model, items, request)
+                    links: Optional[Dict[str, str]] = None
+                    with timed("paginate"):
+                        if self._is_keyset_request(request):
+                            items, links = self._apply_keyset_pagination(target_model, items, request)
+                        else:
+                            items = self._apply_pagination(items, request)
+                        items = self._coerce_items(items)
                     data = [self._encode_resource(target_model, item, wanted_fields=wanted_fields) for item in items]
                     included: List[Dict[str, Any]] = []
                     seen: Set[Tuple[str, str]] = set()
                     if include_paths:
-                        for item in items:
-                            self._collect_included(target_model, item, include_paths, fields_map, seen, included)
+                        with timed("include"):
+                            for item in items:
+                                self._collect_included(target_model, item, include_paths, fields_map, seen, included)
                     return self._jsonapi_response(
                         self._jsonapi_doc(
                             data=data,
                             included=included if include_paths else None,
                             meta={"count": len(data)},
+                            links=links,
                         )
                     )
 
+                rel_value = getattr(parent, rel_name, None)
                 if rel_value is None:
                     self._jsonapi_error(404, "NotFound", f"Relationship '{rel_name}' is empty")
                 included_single: List[Dict[str, Any]] = []
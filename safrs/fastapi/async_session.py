@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Async mode of the FastAPI adapter: SafrsFastAPI(app, async_session=async_sessionmaker(async_engine))
+#
+# In the default (sync) mode, the route handlers are plain functions: starlette runs them in its
+# threadpool and they block a worker thread for every database roundtrip, so the number of
+# concurrent requests is limited by the number of threads.
+# In async mode, the handlers are wrapped in coroutines that run in the event loop: every request
+# opens an AsyncSession and calls the handler with AsyncSession.run_sync, ie. with the sync Session
+# wrapped by the AsyncSession. The SQL statements issued by the handler (filtering, sorting, pagination,
+# include loading, lazy loads, commit) are awaited on the async driver (aiosqlite, asyncpg, ...),
+# so the same query code serves both modes.
+#
+# While a handler runs, safrs.DB.session refers to the session of the request (cfr. RequestSessionProxy).
+#
+# Requires SQLAlchemy's asyncio extension (pip install "sqlalchemy[asyncio]") and an async driver.
+#
+import functools
+import inspect
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+import safrs
+
+# sync Session of the AsyncSession of the current request
+_request_session: ContextVar[Optional[Any]] = ContextVar("safrs_request_session", default=None)
+
+
+class RequestSessionProxy:
+    """
+    Replaces safrs.DB.session in async mode: attribute lookups are forwarded to the session of
+    the current request, or to the original (sync) session outside of requests, eg. at startup
+    """
+
+    def __init__(self, default_session: Any) -> None:
+        self.default_session = default_session
+
+    @property
+    def current(self) -> Any:
+        """
+        :return: the session of the current request or the default session
+        """
+        session = _request_session.get()
+        return self.default_session if session is None else session
+
+    def __call__(self) -> Any:
+        # scoped_session compatibility: safrs.DB.session() returns the session
+        return self.current
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.current, name)
+
+    def __contains__(self, instance: Any) -> bool:
+        return instance in self.current
+
+    def __iter__(self) -> Any:
+        return iter(self.current)
+
+
+def install_session_proxy() -> RequestSessionProxy:
+    """
+    Replace safrs.DB.session with a RequestSessionProxy (once)
+
+    :return: the proxy
+    """
+    session = safrs.DB.session
+    if not isinstance(session, RequestSessionProxy):
+        session = RequestSessionProxy(session)
+        safrs.DB.session = session
+    return session
+
+
+async def run_handler(session_factory: Callable[[], Any], handler: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a sync route handler with the sync session of a new AsyncSession
+
+    :param session_factory: AsyncSession factory, eg. sqlalchemy.ext.asyncio.async_sessionmaker
+    :param handler: sync route handler
+    :return: handler result
+    """
+
+    def run(sync_session: Any) -> Any:
+        token = _request_session.set(sync_session)
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            _request_session.reset(token)
+
+    async with session_factory() as session:
+        try:
+            return await session.run_sync(run)
+        except BaseException:
+            await session.rollback()
+            raise
+
+
+def async_endpoint(session_factory: Callable[[], Any], handler: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    :param session_factory: AsyncSession factory
+    :param handler: sync route handler
+    :return: coroutine function with the signature of `handler`, so fastapi resolves the same parameters
+    """
+    if inspect.iscoroutinefunction(handler):
+        return handler
+
+    @functools.wraps(handler)
+    async def endpoint(*args: Any, **kwargs: Any) -> Any:
+        return await run_handler(session_factory, handler, *args, **kwargs)
+
+    return endpoint
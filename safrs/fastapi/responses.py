@@ -1,7 +1,22 @@
 # -*- coding: utf-8 -*-
+import json
+from typing import Any
 
 from fastapi.responses import JSONResponse
 
+from safrs.json_backend import JSONBackend, get_json_backend
+
+
+def render_json(content: Any) -> bytes:
+    """
+    Serialize json-compatible content with the configured JSON_BACKEND (eg. orjson)
+    """
+    backend = get_json_backend()
+    if type(backend) is JSONBackend:
+        # same output as starlette's JSONResponse
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    return backend.dumpb(content, ensure_ascii=False)
+
 
 class JSONAPIResponse(JSONResponse):
     """
@@ -9,3 +24,5 @@ class JSONAPIResponse(JSONResponse):
     """
     media_type = "application/vnd.api+json"
 
+    def render(self, content: Any) -> bytes:
+        return render_json(content)
@@ -0,0 +1,249 @@
+# Compiler for the JSON filter= query argument, cfr. SAFRSBase._s_filter
+#
+# A filter is a JSON object or a list of JSON objects:
+#   {"name": "name", "op": "eq", "val": "John"}
+#   {"and": [filter, ...]}, {"or": [filter, ...]}, {"not": filter}
+#   [filter, ...] : the "in" and "notin" filters of the list are AND-ed with
+#                   the OR of the other filters (as in previous versions)
+# eg. {"or": [{"name": "age", "op": "ge", "val": 18}, {"not": {"name": "name", "op": "in", "val": ["a", "b"]}}]}
+#
+# The string values are coerced to the python type of the filtered column (eg. "2020-01-01" -> datetime.date).
+#
+# Compiling a filter happens in two cached steps:
+# - parse_filter: the filter= string is parsed into its "shape" (the tree without the values) and the values
+# - filter_template: the shape is compiled to an sqla expression with a bind parameter for every value
+# so a filter with a previously seen shape only requires the values to be bound.
+#
+import datetime
+import decimal
+import json
+import operator
+import uuid
+from functools import lru_cache
+from typing import Any, Callable, Optional
+import sqlalchemy
+from sqlalchemy import and_, bindparam, not_, or_
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.visitors import replacement_traverse
+import safrs
+from .errors import ValidationError
+from .jsonapi_attr import query_attr
+
+# operators that compare the attribute with a bound value
+_OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "like": lambda attr, val: attr.like(val),
+    "ilike": lambda attr, val: attr.ilike(val),
+    "notlike": lambda attr, val: attr.not_like(val),
+    "notilike": lambda attr, val: attr.not_ilike(val),
+    "match": lambda attr, val: attr.match(val),
+    "in": lambda attr, val: attr.in_(val),
+    "notin": lambda attr, val: attr.not_in(val),
+}
+# operators that take a literal null/true/false: "IS :param" isn't valid sql for all dialects
+_IS_OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "is": lambda attr, val: attr.is_(val),
+    "isnot": lambda attr, val: attr.is_not(val),
+}
+_ALIASES = {"is_not": "isnot", "not_in": "notin", "not_like": "notlike", "not_ilike": "notilike", "neq": "ne"}
+_LIST_OPERATORS = ("in", "notin")
+_PATTERN_OPERATORS = ("like", "ilike", "notlike", "notilike", "match")
+_BIND_PREFIX = "safrs_filter_"
+
+_PARSERS: dict[type, Callable[[str], Any]] = {
+    int: int,
+    float: float,
+    decimal.Decimal: decimal.Decimal,
+    datetime.datetime: datetime.datetime.fromisoformat,
+    datetime.date: datetime.date.fromisoformat,
+    datetime.time: datetime.time.fromisoformat,
+    uuid.UUID: uuid.UUID,
+}
+_BOOLEANS = {"true": True, "1": True, "false": False, "0": False}
+
+
+def _op_name(filt: dict[str, Any]) -> str:
+    op_name = str(filt.get("op") or "eq").strip("_").lower()
+    op_name = _ALIASES.get(op_name, op_name)
+    if op_name not in _OPERATORS and op_name not in _IS_OPERATORS:
+        raise ValidationError(f'Invalid filter "{filt}", unknown operator "{op_name}"')
+    return op_name
+
+
+def _parse_node(node: Any, values: list[Any]) -> tuple[Any, ...]:
+    """
+    :param node: filter object
+    :param values: list where the filter values are appended
+    :return: shape of `node`
+    """
+    if not isinstance(node, dict):
+        raise ValidationError(f"Invalid filter '{node}'")
+    for conjunction in ("and", "or"):
+        if conjunction in node:
+            children = node[conjunction]
+            if len(node) != 1 or not isinstance(children, list) or not children:
+                raise ValidationError(f'Invalid filter "{node}", "{conjunction}" requires a non-empty list')
+            return (conjunction, tuple(_parse_node(child, values) for child in children))
+    if "not" in node:
+        if len(node) != 1:
+            raise ValidationError(f'Invalid filter "{node}"')
+        return ("not", _parse_node(node["not"], values))
+    attr_name = node.get("name")
+    if not isinstance(attr_name, str):
+        raise ValidationError(f'Invalid filter "{node}", no attribute name')
+    op_name = _op_name(node)
+    val = node.get("val")
+    if op_name in _IS_OPERATORS:
+        if val not in (None, True, False):
+            raise ValidationError(f'Invalid filter "{node}", "{op_name}" requires null, true or false')
+        return ("attr", attr_name, op_name, val)
+    if op_name in _LIST_OPERATORS:
+        if isinstance(val, str):
+            val = val.split(",")
+        if not isinstance(val, list):
+            raise ValidationError(f'Invalid filter "{node}", "{op_name}" requires a list')
+        val = tuple(val)
+    values.append(val)
+    return ("attr", attr_name, op_name)
+
+
+@lru_cache(maxsize=1024)
+def parse_filter(filter_arg: str) -> tuple[tuple[Any, ...], tuple[Any, ...]]:
+    """
+    :param filter_arg: filter= query argument
+    :return: the shape of the filter and the values in shape order
+    """
+    try:
+        filters = json.loads(filter_arg)
+    except (json.decoder.JSONDecodeError, TypeError):
+        raise ValidationError("Invalid filter format (see https://github.com/thomaxxl/safrs/wiki)")
+
+    values: list[Any] = []
+    if not isinstance(filters, list):
+        return _parse_node(filters, values), tuple(values)
+    shapes = []
+    for filt in filters:
+        if not isinstance(filt, dict):
+            safrs.log.warning(f"Invalid filter '{filt}'")
+            continue
+        shapes.append(_parse_node(filt, values))
+    return ("list", tuple(shapes)), tuple(values)
+
+
+def _filter_attr(cls: Any, attr_name: str) -> Any:
+    """
+    :return: the sqla expression for the `attr_name` attribute of `cls`
+    """
+    if attr_name == "id":
+        attr = getattr(cls, "id", None)
+        if not hasattr(attr, "__clause_element__") and len(cls.id_type.column_names) == 1:
+            attr = getattr(cls, cls.id_type.column_names[0], None)
+        if not hasattr(attr, "__clause_element__"):
+            raise ValidationError(f'Invalid filter, "{cls._s_type}" ids can\'t be filtered')
+        return attr
+    if attr_name not in cls._s_jsonapi_attrs:
+        raise ValidationError(f'Invalid filter, unknown attribute "{attr_name}"')
+    # jsonapi_attr attributes can only be filtered if they declare an sql expression
+    attr = query_attr(cls, attr_name)
+    if not hasattr(attr, "__clause_element__"):
+        raise ValidationError(f'Invalid filter, attribute "{attr_name}" can\'t be filtered')
+    return attr
+
+
+def _coercer(attr: Any, attr_name: str, op_name: str) -> Callable[[Any], Any]:
+    """
+    :return: function that converts a filter value to the python type of `attr`
+    """
+    try:
+        python_type = attr.type.python_type
+    except (AttributeError, NotImplementedError):
+        python_type = None
+    if op_name in _PATTERN_OPERATORS or python_type is None or python_type is str:
+        return lambda val: val
+
+    def coerce(val: Any) -> Any:
+        if val is None or isinstance(val, python_type):
+            return val
+        try:
+            if python_type is bool and isinstance(val, (str, int)):
+                return _BOOLEANS[str(val).lower()]
+            if isinstance(val, str) and python_type in _PARSERS:
+                return _PARSERS[python_type](val)
+            if isinstance(val, float) and python_type is int and not val.is_integer():
+                # int() would truncate the value
+                raise ValueError(val)
+            if isinstance(val, (int, float)) and python_type in (int, float, decimal.Decimal):
+                return python_type(val)
+        except (ValueError, KeyError, ArithmeticError):
+            pass
+        raise ValidationError(f'Invalid filter value "{val}" for attribute "{attr_name}"')
+
+    if op_name in _LIST_OPERATORS:
+        return lambda vals: [coerce(val) for val in vals]
+    return coerce
+
+
+def _compile_node(cls: Any, shape: tuple[Any, ...], coercers: list[Callable[[Any], Any]]) -> Any:
+    kind = shape[0]
+    if kind in ("and", "or"):
+        conjunction = and_ if kind == "and" else or_
+        return conjunction(*[_compile_node(cls, child, coercers) for child in shape[1]])
+    if kind == "not":
+        return not_(_compile_node(cls, shape[1], coercers))
+    if kind == "list":
+        list_filters = [child for child in shape[1] if child[0] == "attr" and child[2] in _LIST_OPERATORS]
+        expressions = [_compile_node(cls, child, coercers) for child in shape[1]]
+        and_expressions = [expr for child, expr in zip(shape[1], expressions) if child in list_filters]
+        or_expressions = [expr for child, expr in zip(shape[1], expressions) if child not in list_filters]
+        if or_expressions:
+            and_expressions.append(or_(*or_expressions))
+        return and_(*and_expressions) if and_expressions else None
+    _, attr_name, op_name = shape[:3]
+    attr = _filter_attr(cls, attr_name)
+    if op_name in _IS_OPERATORS:
+        return _IS_OPERATORS[op_name](attr, shape[3])
+    param = bindparam(f"{_BIND_PREFIX}{len(coercers)}", expanding=op_name in _LIST_OPERATORS)
+    coercers.append(_coercer(attr, attr_name, op_name))
+    return _OPERATORS[op_name](attr, param)
+
+
+@lru_cache(maxsize=1024)
+def filter_template(cls: Any, shape: tuple[Any, ...]) -> tuple[Any, tuple[Callable[[Any], Any], ...]]:
+    """
+    :param cls: SAFRSBase subclass
+    :param shape: filter shape, as returned by `parse_filter`
+    :return: the sqla expression (None if there's nothing to filter) and the value coercion functions in bind parameter order
+    """
+    coercers: list[Callable[[Any], Any]] = []
+    try:
+        expression = _compile_node(cls, shape, coercers)
+    except (AttributeError, NotImplementedError, sqlalchemy.exc.ArgumentError) as exc:
+        raise ValidationError(f"Invalid filter: {exc}")
+    return expression, tuple(coercers)
+
+
+def compile_filter(cls: Any, filter_arg: str) -> Optional[Any]:
+    """
+    :param cls: SAFRSBase subclass
+    :param filter_arg: filter= query argument
+    :return: sqla filter expression or None
+    """
+    shape, values = parse_filter(filter_arg)
+    expression, coercers = filter_template(cls, shape)
+    if expression is None or not values:
+        return expression
+    params = {f"{_BIND_PREFIX}{i}": coerce(val) for i, (coerce, val) in enumerate(zip(coercers, values))}
+
+    def replace(element: Any) -> Any:
+        if isinstance(element, BindParameter) and element.key in params:
+            # anonymous parameter, so several compiled filters can be combined in a statement
+            return bindparam(None, params[element.key], type_=element.type, expanding=element.expanding)
+        return None
+
+    # the cached template is copied
+    return replacement_traverse(expression, {}, replace)
@@ -0,0 +1,106 @@
+# Identity map lookups for SAFRSBase.get_instance
+#
+# Instead of a "SELECT ... WHERE pk = :id" query for every lookup, get_instance uses session.get():
+# an instance that is already in the session identity map is returned without a query.
+# The instances retrieved during a request are also memoized in the session info
+# (Flask-SQLAlchemy sessions are scoped to the request), keyed by model and jsonapi id, so
+# repeated lookups (parse_args, relationship payload items, the GET after a PATCH ...) skip
+# the id parsing as well. The memo is cleared when the session commits or rolls back.
+#
+# The identity lookup is only used when the jsonapi id maps cleanly to the mapper primary key
+# and the model doesn't customize its query (_s_query overrides or stateless "_table" models),
+# otherwise get_instance falls back to `cls._s_query.filter_by(**primary_keys).first()`.
+#
+from functools import lru_cache
+from typing import Any, Optional
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import safrs
+
+# key of the memo dict in session.info
+_MEMO_KEY = "safrs_instances"
+
+
+@lru_cache(maxsize=1024)
+def identity_attrs(model: Any) -> Optional[tuple[tuple[str, Any], ...]]:
+    """
+    :param model: SAFRSBase subclass
+    :return: tuple of (attribute name, python type) of the primary key in mapper order
+             or None if `model` instances can't be looked up in the identity map
+    """
+    if getattr(model, "_table", None) is not None or getattr(model, "_s_stateless", False):
+        return None
+    # an overridden _s_query may filter the instances (eg. access control)
+    query_owner = next((cls for cls in model.__mro__ if "_s_query" in cls.__dict__), None)
+    if query_owner is not safrs.SAFRSBase:
+        return None
+    try:
+        mapper = sqlalchemy.inspect(model)
+        return tuple((mapper.get_property_by_column(col).key, col.type.python_type) for col in mapper.primary_key)
+    except (sqlalchemy.exc.SQLAlchemyError, NotImplementedError, AttributeError):
+        return None
+
+
+def identity_key(model: Any, primary_keys: dict[str, Any]) -> Optional[tuple[Any, ...]]:
+    """
+    :param model: SAFRSBase subclass
+    :param primary_keys: primary key dict, as returned by `model.id_type.get_pks`
+    :return: the primary key identity tuple or None if the keys don't map cleanly to the mapper primary key
+    """
+    attrs = identity_attrs(model)
+    if attrs is None or len(attrs) != len(primary_keys):
+        return None
+    identity = []
+    for attr_name, python_type in attrs:
+        value = primary_keys.get(attr_name)
+        # get_pks substitutes a default or "" when the id can't be converted
+        if value is None or not isinstance(value, python_type):
+            return None
+        identity.append(value)
+    return tuple(identity)
+
+
+def _memo(session: Any) -> dict[tuple[Any, Any], Any]:
+    return session.info.setdefault(_MEMO_KEY, {})  # type: ignore[no-any-return]
+
+
+def memoized_instance(model: Any, jsonapi_id: Any) -> Any:
+    """
+    :param model: SAFRSBase subclass
+    :param jsonapi_id: jsonapi id
+    :return: the instance retrieved earlier in this session or None
+    """
+    session = safrs.DB.session()
+    instance = _memo(session).get((model, jsonapi_id))
+    if instance is None:
+        return None
+    state = sqlalchemy.inspect(instance)
+    if state.session is not session or state.deleted or state.was_deleted or state.detached:
+        return None
+    return instance
+
+
+def get_identity(model: Any, jsonapi_id: Any, primary_keys: dict[str, Any]) -> Any:
+    """
+    Retrieve an instance from the session identity map or the database
+
+    :param model: SAFRSBase subclass
+    :param jsonapi_id: jsonapi id, used as memo key
+    :param primary_keys: primary key dict
+    :return: instance, None if it doesn't exist, NotImplemented if the identity map can't be used
+    """
+    identity = identity_key(model, primary_keys)
+    if identity is None:
+        return NotImplemented
+    session = safrs.DB.session()
+    instance = session.get(model, identity)
+    if instance is not None:
+        _memo(session)[(model, jsonapi_id)] = instance
+    return instance
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _clear_memo(session: Any, *args: Any) -> None:
+    session.info.pop(_MEMO_KEY, None)
@@ -0,0 +1,150 @@
+# JSON serialization backends
+#
+# The backend is configured with the JSON_BACKEND setting (app.config or safrs.SAFRS.JSON_BACKEND):
+#   "json"   : python stdlib json module (default)
+#   "orjson" : orjson, raises an error if orjson isn't installed
+#   "auto"   : orjson if it is installed, stdlib json otherwise
+# A JSONBackend subclass (or instance) can also be used to plug in another encoder.
+#
+# Whatever the backend, values are serialized the same way:
+# datetime as isoformat(" "), date/time as isoformat(), Decimal as float, bytes as hex, UUID as str
+# Types that aren't natively supported by the backend are serialized with the `default` callable
+# (i.e. SAFRSJSONEncoder.default)
+#
+import json
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Iterator, Optional
+import safrs
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONBackend:
+    """
+    Stdlib json backend, also the base class for other backends
+    """
+
+    name = "json"
+
+    def dumps(self: Any, obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False, indent: Optional[int] = None, **kwargs: Any) -> str:
+        """
+        :param obj: object to serialize
+        :param default: callable used to serialize objects that can't be serialized otherwise
+        :param sort_keys: sort the dictionary keys
+        :param indent: indentation, compact output if None
+        :param kwargs: additional json.dumps keyword arguments
+        :return: json string
+        """
+        if indent is None:
+            kwargs.setdefault("separators", (",", ":"))
+        return json.dumps(obj, default=default, sort_keys=sort_keys, indent=indent, **kwargs)
+
+    def dumpb(
+        self: Any, obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False, indent: Optional[int] = None, ensure_ascii: bool = True
+    ) -> bytes:
+        """
+        :param obj: object to serialize
+        :param default: callable used to serialize objects that can't be serialized otherwise
+        :param sort_keys: sort the dictionary keys
+        :param indent: indentation, compact output if None
+        :param ensure_ascii: escape non-ascii characters
+        :return: utf-8 encoded json
+        """
+        return self.dumps(obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii).encode("utf-8")
+
+
+class OrjsonBackend(JSONBackend):
+    """
+    orjson backend: https://github.com/ijl/orjson
+
+    datetime, date and time objects are passed through to `default` so they keep the safrs format,
+    orjson serializes UUIDs like str(uuid) so these are handled natively.
+    Decimal, bytes and set objects aren't supported by orjson and are passed to `default` as well.
+    """
+
+    name = "orjson"
+
+    def __init__(self: Any) -> None:
+        if orjson is None:
+            raise ImportError("The orjson JSON_BACKEND requires orjson to be installed")
+        self.base_option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+
+    def dumpb(
+        self: Any, obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False, indent: Optional[int] = None, ensure_ascii: bool = True
+    ) -> bytes:
+        option = self.base_option
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        try:
+            result = orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError as exc:
+            # eg. integers that don't fit in 64 bits or dict keys of an unsupported type
+            safrs.log.debug(f"orjson encoding failed ({exc}), falling back to stdlib json")
+            return JSONBackend.dumps(self, obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii).encode("utf-8")
+        if ensure_ascii and not result.isascii():
+            # orjson can't escape non-ascii characters
+            return JSONBackend.dumps(self, obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=True).encode("utf-8")
+        return result
+
+    def dumps(self: Any, obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False, indent: Optional[int] = None, **kwargs: Any) -> str:
+        ensure_ascii = kwargs.pop("ensure_ascii", True)
+        if kwargs:
+            # json.dumps specific arguments (eg. cls, separators)
+            return super().dumps(obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii, **kwargs)
+        return self.dumpb(obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii).decode("utf-8")
+
+
+JSON_BACKENDS: dict[str, type[JSONBackend]] = {"json": JSONBackend, "orjson": OrjsonBackend}
+
+
+def get_json_backend(backend: Any = None) -> JSONBackend:
+    """
+    :param backend: backend name, JSONBackend subclass or instance, the JSON_BACKEND setting if None
+    :return: JSONBackend instance
+    """
+    if backend is None:
+        backend = getattr(safrs.SAFRS, "JSON_BACKEND", "json")
+    if isinstance(backend, JSONBackend):
+        return backend
+    return _create_json_backend(backend)
+
+
+@lru_cache(maxsize=8)
+def _create_json_backend(backend: Any) -> JSONBackend:
+    """
+    :param backend: backend name or JSONBackend subclass
+    :return: JSONBackend instance
+    """
+    if isinstance(backend, type) and issubclass(backend, JSONBackend):
+        return backend()
+    if backend == "auto":
+        backend = "orjson" if orjson is not None else "json"
+    backend_cls = JSON_BACKENDS.get(backend)
+    if backend_cls is None:
+        raise ValueError(f"Invalid JSON_BACKEND {backend}, valid values: auto, {', '.join(JSON_BACKENDS)}")
+    return backend_cls()
+
+
+def iter_json_array(items: Iterable[Any], dumpb: Callable[[Any], bytes], chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Serialize the items of a json array incrementally, used to stream large responses
+    :param items: items to serialize
+    :param dumpb: callable that serializes an item to bytes
+    :param chunk_size: number of items to serialize before yielding
+    :return: iterator of comma separated json chunks (without the enclosing brackets)
+    """
+    chunk: list[bytes] = []
+    separator = b""
+    for item in items:
+        chunk.append(dumpb(item))
+        if len(chunk) >= chunk_size:
+            yield separator + b",".join(chunk)
+            separator = b","
+            chunk = []
+    if chunk:
+        yield separator + b",".join(chunk)
@@ -10,7 +10,12 @@
 from .config import is_debug
 from .base import SAFRSBase, Included
 from .jsonapi_formatting import jsonapi_format_response
-from typing import Any
+from .attr_serializer import NATIVE_CONVERTERS
+from .json_backend import JSONBackend, get_json_backend
+from typing import Any, Optional
+
+# exact type lookup, this avoids going through the isinstance checks for the most common types
+ENCODER_CONVERTERS = {**NATIVE_CONVERTERS, set: list}
 
 
 class SAFRSFormattedResponse:
@@ -60,6 +65,9 @@ class _SAFRSJSONEncoder:
     # pylint: disable=arguments-differ,protected-access,method-hidden
     @staticmethod
     def _encode_primitive(obj: Any) -> tuple[bool, Any]:
+        converter = ENCODER_CONVERTERS.get(type(obj))
+        if converter is not None:
+            return True, converter(obj)
         if obj is None:
             return True, None
         if obj is Included:
@@ -159,9 +167,42 @@ def sqla_encode(obj: Any) -> Any:  # pragma: no cover
 class SAFRSJSONProvider(_SAFRSJSONEncoder, DefaultJSONProvider):
     """
     Flask JSON encoding
+    The serialization is performed by the configured JSON_BACKEND (cfr. json_backend.py)
     """
 
     mimetype = "application/vnd.api+json"
+    json_backend: Optional[JSONBackend] = None
+
+    @property
+    def backend(self: Any) -> JSONBackend:
+        """
+        :return: the JSONBackend, resolved on first use so the JSON_BACKEND can be configured after the api has been created
+        """
+        if self.json_backend is None:
+            self.json_backend = get_json_backend()
+        return self.json_backend
+
+    def dumps(self: Any, obj: Any, **kwargs: Any) -> str:
+        """
+        :param obj: object to serialize
+        :param kwargs: json.dumps keyword arguments
+        :return: json string
+        """
+        kwargs.setdefault("default", self.default)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        return self.backend.dumps(obj, **kwargs)
+
+    def response(self: Any, *args: Any, **kwargs: Any) -> Any:
+        """
+        Serialize the arguments and write the encoded bytes to the response
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = None
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            indent = 2
+        data = self.backend.dumpb(obj, default=self.default, sort_keys=self.sort_keys, indent=indent, ensure_ascii=self.ensure_ascii)
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
 
 
 class SAFRSJSONEncoder(_SAFRSJSONEncoder, json.JSONEncoder):
@@ -3,6 +3,7 @@
 #  - SAFRSRestAPI for exposed database instances and collections
 #  - SAFRSRestRelationshipAPI for exposed database relationships
 #  - SAFRSRestMethodAPI for exposed jsonapi_rpc methods
+#  - SAFRSAtomicAPI for the atomic operations endpoint
 #
 # Configuration parameters:
 # - endpoint
@@ -19,15 +20,22 @@
 import sqlalchemy
 import sqlalchemy.orm.dynamic
 import sqlalchemy.orm.collections
-from flask import jsonify, make_response as flask_make_response, url_for, request
+from flask import jsonify, make_response as flask_make_response, url_for, request, current_app
 from flask_restful_swagger_2 import Resource as FRSResource
 from http import HTTPStatus
 from sqlalchemy.orm.interfaces import MANYTOONE
 from urllib.parse import urljoin
 from .swagger_doc import is_public
-from .errors import ValidationError, NotFoundError
+from .errors import JsonapiError, ValidationError, NotFoundError
 from .jsonapi_formatting import jsonapi_filter_query, jsonapi_filter_list, jsonapi_sort, jsonapi_format_response, paginate
-from .jsonapi_filters import get_swagger_filters
+from .jsonapi_formatting import jsonapi_stream_response
+from .jsonapi_filters import get_swagger_filters, relationship_query
+from .timing import timed
+from .config import get_request_param
+from .bulk import bulk_delete, core_delete_supported, delete_by_id
+from .conditional import compute_validators, is_not_modified, mark_modified, validator_headers
+from .response_cache import cached_response
+from .atomic import ATOMIC_MEDIA_TYPE, AtomicOperations
 
 
 def make_response(*args: Any, **kwargs: Any) -> Any:
@@ -255,6 +263,17 @@ def get(self: Any, **kwargs: Any) -> Any:
         - included: an array of resource objects that are related
         to the primary data and/or each other (“included resources”).
         """
+        headers, not_modified = self._conditional_get_headers(kwargs.get(self._s_object_id, None))
+        if not_modified:
+            return current_app.response_class(status=HTTPStatus.NOT_MODIFIED.value, headers=headers)
+        return cached_response(self.SAFRSObject, lambda: self._get(headers, **kwargs))
+
+    def _get(self: Any, headers: dict[str, str], **kwargs: Any) -> Any:
+        """
+        Retrieve the instance or collection
+        :param headers: response headers
+        :return: flask response
+        """
         data = None
         meta = {}
         errors = None
@@ -263,7 +282,8 @@ def get(self: Any, **kwargs: Any) -> Any:
         if self._s_object_id in kwargs:
             # Retrieve a single instance
             id = kwargs[self._s_object_id]
-            instance = self.SAFRSObject.get_instance(id)
+            with timed("query"):
+                instance = self.SAFRSObject.get_instance(id)
             data = instance
             count = 1
             if instance is not None:
@@ -273,13 +293,42 @@ def get(self: Any, **kwargs: Any) -> Any:
                 meta.update(dict(instance_meta=instance._s_meta()))
         else:
             # retrieve a collection, filter and sort
-            instances = self.SAFRSObject._s_get()
-            instances = jsonapi_sort(instances, self.SAFRSObject)
+            with timed("filter"):
+                instances = self.SAFRSObject._s_get()
+            with timed("sort"):
+                instances = jsonapi_sort(instances, self.SAFRSObject)
+            is_keyset = get_request_param("page_after") is not None or get_request_param("page_before") is not None
+            if self.SAFRSObject._s_stream and hasattr(instances, "yield_per") and not is_keyset:
+                response = jsonapi_stream_response(instances, self.SAFRSObject)
+                response.headers.update(headers)
+                return response
             links, data, count = paginate(instances, self.SAFRSObject)
 
         # format the response: add the included objects
         result = jsonapi_format_response(data, meta, links, errors, count)
-        return jsonify(result)
+        with timed("encode"):
+            response = jsonify(result)
+        response.headers.update(headers)
+        return response
+
+    def _conditional_get_headers(self: Any, jsonapi_id: Any) -> tuple[dict[str, str], bool]:
+        """
+        Compute the ETag and Last-Modified of the requested resource before it is retrieved (cfr. conditional.py)
+
+        :param jsonapi_id: id of the requested instance, None for a collection
+        :return: (ETag, Last-Modified and Cache-Control response headers, True if the response is "304 Not Modified")
+        """
+        headers: dict[str, str] = {}
+        if not self.SAFRSObject._s_conditional_get:
+            if self.SAFRSObject.safrs_config.cache_control:
+                headers["Cache-Control"] = self.SAFRSObject.safrs_config.cache_control
+            return headers, False
+        query_string = request.query_string.decode("utf-8", "replace")
+        include_csv = request.args.get("include", safrs.SAFRS.DEFAULT_INCLUDED)
+        etag, last_modified = compute_validators(self.SAFRSObject, jsonapi_id, query_string, include_csv)
+        headers = validator_headers(self.SAFRSObject, etag, last_modified)
+        not_modified = is_not_modified(etag, last_modified, request.headers.get("If-None-Match"), request.headers.get("If-Modified-Since"))
+        return headers, not_modified
 
     def patch(self: Any, **kwargs: Any) -> Any:
         """
@@ -311,11 +360,7 @@ def patch(self: Any, **kwargs: Any) -> Any:
         data = payload.get("data")
         if id is None and isinstance(data, list):
             # Bulk patch request
-            for item in data:
-                if not isinstance(item, dict):
-                    raise ValidationError("Invalid Data Object")
-                instance = self._patch_instance(item)
-            response = make_response(jsonify({}), HTTPStatus.ACCEPTED)
+            response = self._bulk_patch(data)
 
         elif not data or not isinstance(data, dict):
             raise ValidationError("Invalid Data Object")
@@ -333,6 +378,63 @@ def patch(self: Any, **kwargs: Any) -> Any:
 
         return response
 
+    def _bulk_patch(self: Any, data: list[Any]) -> Any:
+        """
+        Update multiple instances in one transaction, cfr. SAFRSBase._s_bulk_patch
+        :param data: list of jsonapi resource objects
+        :return: flask response, the errors contain a pointer to the invalid items
+        """
+        errors: dict[int, dict[str, Any]] = {}
+        items = []
+        indexes = []
+        for i, item in enumerate(data):
+            pointer = f"/data/{i}"
+            try:
+                if not isinstance(item, dict):
+                    raise ValidationError("Invalid Data Object")
+                pointer = f"/data/{i}/type"
+                if item.get("type") != self.SAFRSObject._s_type:
+                    raise ValidationError(f"Invalid type {item.get('type')} != {self.SAFRSObject._s_type}", HTTPStatus.FORBIDDEN)
+                pointer = f"/data/{i}/id"
+                if item.get("id", None) is None:
+                    raise ValidationError("No ID in body")
+                body_id = self.SAFRSObject.id_type.validate_id(item["id"])
+            except ValidationError as exc:
+                errors[i] = self._item_error(exc, pointer)
+                continue
+            items.append((body_id, item.get("attributes", {})))
+            indexes.append(i)
+
+        results = self.SAFRSObject._s_bulk_patch(items) if items else []
+        for i, result in zip(indexes, results):
+            if isinstance(result, Exception):
+                errors[i] = self._item_error(result, f"/data/{i}" + getattr(result, "source", {}).get("pointer", ""))
+
+        if errors:
+            safrs.DB.session.rollback()
+            error_list = [errors[i] for i in sorted(errors)]
+            statuses = {error["status"] for error in error_list}
+            status_code = int(statuses.pop()) if len(statuses) == 1 else HTTPStatus.BAD_REQUEST.value
+            return make_response(jsonify({"errors": error_list}), status_code)
+        return make_response(jsonify({}), HTTPStatus.ACCEPTED)
+
+    @staticmethod
+    def _item_error(exc: Exception, pointer: str) -> dict[str, Any]:
+        """
+        :param exc: exception raised for an item of a bulk request
+        :param pointer: JSON pointer to the item in the request document
+        :return: jsonapi error object
+        """
+        status_code = int(getattr(exc, "status_code", HTTPStatus.BAD_REQUEST.value))
+        title = getattr(exc, "message", str(exc))
+        return dict(
+            title=title,
+            detail=getattr(exc, "detail", title),
+            code=str(getattr(exc, "api_code", None) or status_code),
+            status=str(status_code),
+            source={"pointer": pointer},
+        )
+
     def _patch_instance(self: Any, data: Any, id: Any=None) -> Any:
         """
         Update the inst
@@ -427,10 +529,7 @@ def post(self: Any, **kwargs: Any) -> Any:
             # Accept it by default now
             if not cast(Any, request).is_bulk:
                 safrs.log.warning("Client sent a bulk POST but did not specify the bulk extension")
-            instances = []
-            for item in data:
-                instance = self._create_instance(item)
-                instances.append(instance)
+            instances = self.SAFRSObject._s_bulk_post([self._post_params(item) for item in data])
             resp_data = jsonify({"data": instances})
             location = None
         else:
@@ -458,6 +557,16 @@ def _create_instance(self: Any, data: Any) -> Any:
         :param data: dictionary with {"type": ... , "attributes": ...}
         :return: created instance
         """
+        instance = self.SAFRSObject._s_post(**self._post_params(data))
+
+        return instance
+
+    def _post_params(self: Any, data: Any) -> dict[str, Any]:
+        """
+        Validate a resource object from a POST payload
+        :param data: dictionary with {"type": ... , "attributes": ...}
+        :return: `_s_post` keyword arguments
+        """
         if not isinstance(data, dict):
             raise ValidationError("Data is not a dict object")
 
@@ -474,9 +583,7 @@ def _create_instance(self: Any, data: Any) -> Any:
 
         relationships = data.get("relationships", {})
 
-        instance = self.SAFRSObject._s_post(**attributes, **relationships)
-
-        return instance
+        return {**attributes, **relationships}
 
     def delete(self: Any, **kwargs: Any) -> Any:
         """
@@ -518,14 +625,40 @@ def delete(self: Any, **kwargs: Any) -> Any:
         id = kwargs.get(self._s_object_id, None)
 
         if not id:
-            # This endpoint shouldn't be exposed so this code is not reachable
-            raise ValidationError("", status_code=HTTPStatus.METHOD_NOT_ALLOWED)
+            return self._delete_collection()
 
-        instance = self.SAFRSObject.get_instance(id)
-        instance._s_delete()
+        deleted = delete_by_id(self.SAFRSObject, id)
+        if deleted is None:
+            instance = self.SAFRSObject.get_instance(id)
+            instance._s_delete()
+        elif not deleted:
+            raise NotFoundError(f'Invalid "{self.SAFRSObject.__name__}" ID "{id}"')
 
         return make_response(jsonify({}), HTTPStatus.NO_CONTENT)
 
+    def _delete_collection(self: Any) -> Any:
+        """
+        Delete the instances that match the filter query arguments, cfr. bulk.py
+        :return: flask response with the number of deleted instances in the meta
+        """
+        if not get_request_param("filter") and not get_request_param("filters"):
+            raise ValidationError("A filter is required to delete from a collection")
+        filtered = self.SAFRSObject.jsonapi_filter()
+        if not isinstance(filtered, list) and filtered.whereclause is None:
+            # eg. only filters on jsonapi_attr attributes, which are ignored
+            raise ValidationError("The filter doesn't select any instances")
+        # only the instances that can be retrieved with a GET can be deleted (_s_get may be overridden to restrict them)
+        query = self.SAFRSObject._s_get()
+        if core_delete_supported(self.SAFRSObject):
+            count = bulk_delete(self.SAFRSObject, query)
+        else:
+            instances = list(query)
+            for instance in instances:
+                instance._s_delete()
+            count = len(instances)
+        mark_modified(self.SAFRSObject)
+        return make_response(jsonify({"meta": {"count": count}}), HTTPStatus.OK)
+
 
 class SAFRSRestRelationshipAPI(Resource):
     """
@@ -603,13 +736,39 @@ def get(self: Any, **kwargs: Any) -> Any:
         The top-level links object MAY contain self and related links,
         as described above for relationship objects.
         """
-        _, relation = self.parse_args(**kwargs)
+        return cached_response(self.target, lambda: self._get(**kwargs), self.source_class)
+
+    def _get(self: Any, **kwargs: Any) -> Any:
+        """
+        Retrieve the relationship data
+        :return: flask response
+        """
+        parent = self.get_parent(**kwargs)
         child_id = kwargs.get(self.child_object_id)
         errors: dict[str, Any] = {}
         count = 1
         meta = {}
         data = None
 
+        if self.SAFRSObject.relationship.direction != MANYTOONE and not child_id:
+            # to-many relationship: filter, sort and paginate with a single query instead of loading the relationship
+            with timed("filter"):
+                instances = relationship_query(self.target.jsonapi_filter(), parent, self.relationship)
+                if instances is None:
+                    relation = getattr(parent, self.rel_name)
+                    if isinstance(relation, sqlalchemy.orm.collections.InstrumentedList):
+                        instances = jsonapi_filter_list(relation)
+                    else:
+                        # lazy='dynamic' relationships
+                        instances = jsonapi_filter_query(relation, self.target)
+            with timed("sort"):
+                instances = jsonapi_sort(instances, self.target)
+            links, data, count = paginate(instances, self.target, scoped=True)
+            result = jsonapi_format_response(data, meta, links, errors, count)
+            with timed("encode"):
+                return make_response(jsonify(result))
+
+        relation = getattr(parent, self.rel_name)
         if relation is None:
             # child may have been deleted
             return "Not Found", HTTPStatus.NOT_FOUND
@@ -630,19 +789,10 @@ def get(self: Any, **kwargs: Any) -> Any:
                 raise NotFoundError()
             else:
                 links = {"self": request.url, "related": child._s_url}
-        elif isinstance(relation, sqlalchemy.orm.collections.InstrumentedList):
-            instances = jsonapi_filter_list(relation)
-            instances = jsonapi_sort(instances, self.target)
-            links, data, count = paginate(instances, self.target)
-            count = len(data)
-        else:
-            # lazy='dynamic' relationships
-            instances = jsonapi_filter_query(relation, self.target)
-            instances = jsonapi_sort(instances, self.target)
-            links, data, count = paginate(instances, self.target)
 
         result = jsonapi_format_response(data, meta, links, errors, count)
-        return make_response(jsonify(result))
+        with timed("encode"):
+            return make_response(jsonify(result))
 
     # Relationship patching
     def patch(self: Any, **kwargs: Any) -> Any:
@@ -747,6 +897,7 @@ def patch(self: Any, **kwargs: Any) -> Any:
         # If an update is successful and the server doesn’t update any attributes besides those provided, the server MUST return
         # either a 200 OK status code and response document (as described above) or a 204 No Content status code with no response document.
 
+        self._bump_generations()
         if data is None:
             # item removed from relationship => 202 accepted
             data, status_code = {}, HTTPStatus.NO_CONTENT
@@ -814,6 +965,7 @@ def post(self: Any, **kwargs: Any) -> Any:
             data = {}
             status_code = HTTPStatus.NO_CONTENT
 
+        self._bump_generations()
         # we can return result too but it's not necessary per the spec
         return make_response(jsonify(data), status_code)
 
@@ -895,8 +1047,16 @@ def delete(self: Any, **kwargs: Any) -> Any:
                 else:
                     safrs.log.warning(f"Item with id {child_id} not in relation")
 
+        self._bump_generations()
         return make_response(jsonify({}), HTTPStatus.NO_CONTENT)
 
+    def _bump_generations(self: Any) -> None:
+        """
+        Invalidate the cached responses (and ETags) of the parent and the target of the relationship
+        """
+        mark_modified(self.source_class)
+        mark_modified(self.target)
+
     def parse_args(self: Any, **kwargs: Any) -> Any:
         """
         Parse relationship args
@@ -904,14 +1064,22 @@ def parse_args(self: Any, **kwargs: Any) -> Any:
 
         :return: parent, child, relation
         """
+        parent = self.get_parent(**kwargs)
+        relation = getattr(parent, self.rel_name)
+
+        return parent, relation
+
+    def get_parent(self: Any, **kwargs: Any) -> Any:
+        """
+        An error is raised if the parent doesn't exist.
+
+        :return: parent instance
+        """
         parent_id = kwargs.get(self.parent_object_id, None)
         if parent_id is None:
             raise ValidationError("Invalid Parent Id")
 
-        parent = self.source_class.get_instance(parent_id)
-        relation = getattr(parent, self.rel_name)
-
-        return parent, relation
+        return self.source_class.get_instance(parent_id)
 
 
 class SAFRSJSONRPCAPI(Resource):
@@ -1031,3 +1199,37 @@ def _create_rpc_response(self: Any, method: Any, args: Any) -> Any:
             response = {"meta": {"result": result}}
 
         return make_response(jsonify(response), HTTPStatus.OK)
+
+
+class SAFRSAtomicAPI(Resource):
+    """
+    JSON:API atomic operations endpoint (https://jsonapi.org/ext/atomic/), cfr. atomic.py
+
+    Only HTTP POST is supported
+    """
+
+    # the exposed SAFRSBase subclasses by jsonapi type, set by SAFRSAPI.expose_object
+    models: dict[str, Any] = {}
+
+    def post(self: Any, **kwargs: Any) -> Any:
+        """
+        HTTP POST: execute the "atomic:operations" of the request in one transaction
+        :return: "atomic:results" response or the error of the failing operation
+        """
+        if not cast(Any, request).is_atomic:
+            safrs.log.warning("Client sent atomic operations but did not specify the atomic extension")
+        payload = cast(Any, request).get_jsonapi_payload()
+        if not isinstance(payload, dict):
+            raise ValidationError("Invalid payload")
+        try:
+            results = AtomicOperations(self.models).execute(payload.get("atomic:operations"))
+        except JsonapiError as exc:
+            safrs.DB.session.rollback()
+            error = SAFRSRestAPI._item_error(exc, getattr(exc, "source", {}).get("pointer", "/atomic:operations"))
+            return make_response(jsonify({"errors": [error]}), int(error["status"]))
+
+        # operations that don't return a resource have an empty result
+        atomic_results = [{"data": result[1]} if result is not None else {} for result in results]
+        response = make_response(jsonify({"atomic:results": atomic_results}), HTTPStatus.OK)
+        response.headers["Content-Type"] = ATOMIC_MEDIA_TYPE
+        return response
@@ -12,17 +12,36 @@
 class jsonapi_attr(hybrid_property):
     """
     hybrid_property type: sqlalchemy.orm.attributes.create_proxied_attribute.<locals>.Proxy
+
+    A jsonapi_attr can declare an sql expression, like a hybrid_property `expression`.
+    This expression is used to filter and sort the collection in the database, eg.
+
+        @jsonapi_attr
+        def upper_name(self):
+            return self.name.upper()
+
+        @upper_name.expression
+        def upper_name(cls):
+            return func.upper(cls.name)
+
+    or `jsonapi_attr(fget, expression=lambda cls: func.upper(cls.name))`
+    Without an expression, the attribute is not used in the filter[] and sort= query arguments.
     """
 
-    def __init__(self: Any, *args: Any, **kwargs: Any) -> None:
+    _hybrid_kwargs = ("fset", "fdel", "expr", "custom_comparator", "update_expr", "bulk_dml_setter")
+
+    def __init__(self: Any, *args: Any, expression: Any = None, **kwargs: Any) -> None:
         """
         :param attr: `SAFRSBase` attribute that should be exposed by the jsonapi
+        :param expression: function that returns the class level sql expression for the attribute
         :return: jsonapi attribute decorator
 
         set `swagger_type` and `default` to customize the swagger
         """
         setattr(self, JSONAPI_ATTR_TAG, True)  # checked by is_jsonapi_attr()
 
+        if expression is not None:
+            kwargs["expr"] = expression
         if args:
             # called when the app starts
             attr = args[0]
@@ -31,9 +50,12 @@ def __init__(self: Any, *args: Any, **kwargs: Any) -> None:
                 for k, v in obj_doc.items():
                     setattr(self, k, v)
         else:
-            # the "default" kwarg may have been added by the obj_doc but we no longer
-            # need it (and it causes an exception)
-            kwargs.pop("default", None)
+            # called by hybrid_property._copy (getter, setter, expression ...):
+            # keep the attributes that were added by the obj_doc (eg. "default")
+            fget = kwargs.pop("fget")
+            for k in [k for k in kwargs if k not in self._hybrid_kwargs]:
+                setattr(self, k, kwargs.pop(k))
+            args = (fget,)
         super().__init__(*args, **kwargs)
 
     def getter(self: Any, fget: Any) -> Any:
@@ -57,3 +79,26 @@ def is_jsonapi_attr(attr: Any) -> bool:
     :return: boolean
     """
     return getattr(attr, JSONAPI_ATTR_TAG, False) is True
+
+
+def has_expression(attr: Any) -> bool:
+    """
+    :param attr: `SAFRSBase` `jsonapi_attr` decorated attribute
+    :return: True if an sql expression has been declared for the attribute, i.e. it can be used to filter and sort
+    """
+    return is_jsonapi_attr(attr) and getattr(attr, "expr", None) is not None
+
+
+def query_attr(cls: Any, attr_name: str) -> Any:
+    """
+    :param cls: SAFRSBase subclass
+    :param attr_name: jsonapi attribute name
+    :return: the column or expression to use in queries for the attribute, None if the attribute can't be queried
+    """
+    attr = cls._s_jsonapi_attrs.get(attr_name, None)
+    if not is_jsonapi_attr(attr):
+        return attr
+    if not has_expression(attr):
+        return None
+    # the class level access evaluates the expression
+    return getattr(cls, attr_name)
@@ -1,14 +1,92 @@
 """
 JSON:API filtering strategies
 """
-from typing import Any, cast
+from typing import Any, Optional, cast
+from functools import lru_cache
+import inspect
 
 from .config import get_request_param
 import sqlalchemy
 import safrs
-from .jsonapi_attr import is_jsonapi_attr
-from flask import request
-from sqlalchemy.orm import joinedload
+from .jsonapi_attr import query_attr
+from flask import request, has_request_context
+from sqlalchemy.orm import joinedload, load_only, with_parent
+
+
+@lru_cache(maxsize=256)
+def _sparse_fieldset_keys(cls: Any, fields: tuple[str, ...]) -> Optional[tuple[str, ...]]:
+    """
+    :param cls: SAFRSBase subclass
+    :param fields: requested attribute names
+    :return: names of the column attributes to load or None if all columns have to be loaded
+    """
+    if inspect.getattr_static(cls, "to_dict", None) is not inspect.getattr_static(safrs.SAFRSBase, "to_dict"):
+        # to_dict has been overridden, we don't know which attributes will be used
+        return None
+    mapper = sqlalchemy.inspect(cls)
+    column_keys = {prop.key for prop in mapper.column_attrs}
+    keys = set()
+    for attr_name in fields:
+        if attr_name not in cls._s_jsonapi_attrs:
+            # unknown attributes are not serialized
+            continue
+        if attr_name == "Type" and "type" in column_keys:
+            attr_name = "type"
+        if attr_name not in column_keys:
+            # eg. jsonapi_attr or hybrid_property: these may depend on any column
+            return None
+        keys.add(attr_name)
+
+    # primary keys, foreign keys and the columns used to load the relationships are always required
+    required_columns = list(mapper.primary_key)
+    required_columns += [col for col in mapper.columns if col.foreign_keys]
+    for rel in mapper.relationships:
+        required_columns += list(rel.local_columns)
+    if mapper.polymorphic_on is not None:
+        required_columns.append(mapper.polymorphic_on)
+    for column in required_columns:
+        try:
+            keys.add(mapper.get_property_by_column(column).key)
+        except sqlalchemy.orm.exc.UnmappedColumnError:
+            continue
+
+    return tuple(sorted(keys))
+
+
+def sparse_fieldset_columns(cls: Any, fields: Any) -> Optional[list[Any]]:
+    """
+    Sparse fieldset projection (https://jsonapi.org/format/#fetching-sparse-fieldsets):
+    only load the columns for the requested fields, and the columns required to create the relationship linkage
+
+    :param cls: SAFRSBase subclass
+    :param fields: requested attribute names (from the `fields[Type]` url query parameter) or None
+    :return: list of column attributes for `load_only`, None if all columns should be loaded
+    """
+    if fields is None or not safrs.SAFRS.OPTIMIZED_LOADING or not hasattr(cls, "_s_jsonapi_attrs"):
+        return None
+    try:
+        keys = _sparse_fieldset_keys(cls, tuple(fields))
+    except sqlalchemy.exc.NoInspectionAvailable:  # pragma: no cover
+        return None
+    if keys is None:
+        return None
+    return [getattr(cls, key) for key in keys]
+
+
+def sparse_fieldset_query(cls: Any, query: Any) -> Any:
+    """
+    Apply the sparse fieldset projection for `cls` from the request `fields[]` to `query`
+    :param cls: SAFRSBase subclass
+    :param query: sqla query
+    :return: sqla query
+    """
+    if not has_request_context():
+        return query
+    fields = get_request_param("fields") or {}
+    columns = sparse_fieldset_columns(cls, fields.get(getattr(cls, "_s_class_name", None)))
+    if columns:
+        query = query.options(load_only(*columns))
+    return query
 
 
 def create_query(cls: Any) -> Any:
@@ -16,6 +94,7 @@ def create_query(cls: Any) -> Any:
     Create a query for the target collection `cls`.
     If `include=` query parameters are given, the corresponding relationships will be joined loaded if possible
     See: https://docs.sqlalchemy.org/en/13/orm/loading_relationships.html
+    If `fields[]` query parameters are given, only the requested columns will be loaded (cfr. `sparse_fieldset_columns`)
 
     :param cls: class (collection) we want to query
     """
@@ -23,6 +102,8 @@ def create_query(cls: Any) -> Any:
 
     if not safrs.SAFRS.OPTIMIZED_LOADING:
         return query
+    query = sparse_fieldset_query(cls, query)
+    fields = get_request_param("fields") or {}
     included_csv = request.args.get("include", safrs.SAFRS.DEFAULT_INCLUDED)
     if included_csv == safrs.SAFRS.INCLUDE_ALL:
         included_list = cls._s_relationships.keys()
@@ -44,12 +125,39 @@ def create_query(cls: Any) -> Any:
                 break
             options = options.joinedload(inc_rel) if options else joinedload(inc_rel)
             current_cls = inc_rel.mapper.class_
+            inc_columns = sparse_fieldset_columns(current_cls, fields.get(getattr(current_cls, "_s_class_name", None)))
+            if inc_columns:
+                query = query.options(options.load_only(*inc_columns))
         if options:
             query = query.options(options)
 
     return query
 
 
+def relationship_query(query: Any, parent: Any, relationship: Any) -> Optional[Any]:
+    """
+    Restrict a query of the relationship target to the items of the `parent` relationship collection,
+    so a relationship can be filtered, sorted and paginated with a single query (without loading the relationship)
+
+    :param query: sqla query of the relationship target, eg. the result of `jsonapi_filter`
+    :param parent: instance that holds the relationship
+    :param relationship: to-many relationship property
+    :return: sqla query or None if `query` can't be restricted
+    """
+    if not isinstance(query, sqlalchemy.orm.Query):
+        # eg. a custom filter returned a list of instances
+        return None
+    target = relationship.mapper.class_
+    entities = [desc.get("entity") for desc in query.column_descriptions]
+    if not any(isinstance(entity, type) and issubclass(entity, target) for entity in entities):
+        return None
+    try:
+        return query.filter(with_parent(parent, relationship))
+    except (sqlalchemy.exc.InvalidRequestError, sqlalchemy.exc.ArgumentError) as exc:
+        safrs.log.debug(f"Can't query {parent}.{relationship.key}: {exc}")
+    return None
+
+
 @classmethod  # type: ignore[misc]
 def jsonapi_filter(cls: Any) -> Any:
     """
@@ -99,10 +207,10 @@ def jsonapi_filter(cls: Any) -> Any:
             safrs.log.warning(f"Invalid filter {attr_name}")
             return []
         else:
-            attr = cls._s_jsonapi_attrs[attr_name]
-        if is_jsonapi_attr(attr):
-            # to do
-            safrs.log.debug(f"Filtering not implemented for {attr}")
+            attr = query_attr(cls, attr_name)
+        if attr is None:
+            # jsonapi_attr without sql expression
+            safrs.log.debug(f"Filtering not implemented for {cls}.{attr_name}")
         else:
             expressions.append((attr, val))
 
@@ -131,8 +239,13 @@ def get_swagger_filters(cls: Any) -> Any:
     - format
     """
     attr_list = list(cls.SAFRSObject._s_jsonapi_attrs.keys()) + ["id"]
+    # relationship resources filter the target model
+    model = getattr(cls.SAFRSObject, "_target", cls.SAFRSObject)
 
     for attr_name in attr_list:
+        if attr_name != "id" and query_attr(model, attr_name) is None:
+            # jsonapi_attr without sql expression can't be filtered
+            continue
         # (Customizable swagger specs):
         default_filter = ""
         description = f"{attr_name} attribute filter (csv)"
@@ -1,4 +1,4 @@
-from typing import Any, cast
+from typing import Any, Optional, cast
 # JSON:API response formatting functions:
 # - filtering (https://jsonapi.org/format/#fetching-filtering)
 # - sorting (https://jsonapi.org/format/#fetching-sorting)
@@ -6,14 +6,22 @@
 #
 # Response formatting follows filter -> sort -> paginate
 #
+import itertools
+from urllib.parse import urljoin
 import sqlalchemy
 import sqlalchemy.orm.dynamic
 import sqlalchemy.orm.collections
 import safrs
-from flask import request
-from .jsonapi_attr import is_jsonapi_attr
+from flask import request, current_app, stream_with_context
+from .jsonapi_attr import is_jsonapi_attr, query_attr
 from .errors import ValidationError, GenericError
 from .config import get_config, get_request_param
+from .json_backend import get_json_backend, iter_json_array
+from .count_strategy import collection_count
+from .keyset import keyset_paginate
+from .relationship_loader import prefetch_included, prefetch_page_linkage
+from .related_sort import related_sort_keys, related_value
+from .timing import timed
 
 
 def jsonapi_filter_list(relation: Any) -> Any:
@@ -21,18 +29,35 @@ def jsonapi_filter_list(relation: Any) -> Any:
     :param relation: InstrumentedList
     :return: list of instances filtered using the jsonapi filters in the url query args
 
-    Called when filtering a relationship collection
+    Called when filtering a relationship collection that can't be queried (cfr. relationship_query),
+    the instances of every class are filtered with a single query
     """
-    result = set()
+    result = []
+    instances_by_class: dict[Any, list[Any]] = {}
     for instance in relation:
         if not hasattr(instance, "id_type"):
             # item is not a SAFRSBase instance
-            result.add(instance)
+            result.append(instance)
             continue
-        pks = {col.name: getattr(instance, col.name) for col in instance.id_type.columns}
-        filter_query = instance.__class__.jsonapi_filter()
-        result.update(filter_query.filter_by(**pks).all())  # this should only contain zero or one items
-    return list(result)
+        instances_by_class.setdefault(instance.__class__, []).append(instance)
+
+    for cls, instances in instances_by_class.items():
+        filtered = cls.jsonapi_filter()
+        if isinstance(filtered, sqlalchemy.orm.Query):
+            mapper = sqlalchemy.inspect(cls)
+            pk_attrs = [getattr(cls, mapper.get_property_by_column(col).key) for col in mapper.primary_key]
+            idents = [mapper.primary_key_from_instance(instance) for instance in instances]
+            if len(pk_attrs) == 1:
+                filtered = filtered.filter(pk_attrs[0].in_([ident[0] for ident in idents]))
+            else:
+                filtered = filtered.filter(sqlalchemy.tuple_(*pk_attrs).in_(idents))
+            filtered = filtered.all()
+        elif not isinstance(filtered, (list, tuple)):
+            # eg. a single instance for filter[id]
+            filtered = [filtered] if filtered is not None else []
+        members = {id(instance) for instance in instances}
+        result += [instance for instance in filtered if id(instance) in members]
+    return result
 
 
 def jsonapi_filter_query(object_query: Any, safrs_object: Any) -> Any:
@@ -51,13 +76,17 @@ def jsonapi_filter_query(object_query: Any, safrs_object: Any) -> Any:
 def jsonapi_sort(object_query: Any, safrs_object: Any) -> Any:
     """
     http://jsonapi.org/format/#fetching-sorting
-    sort by csv sort= values
+    sort by csv sort= values, the values may be dotted relationship paths, eg. "-author.name" (cfr. related_sort.py)
     :param object_query: sqla query object
     :param safrs_object: SAFRSObject
     :return: sqla query object
     """
     sort_attrs = request.args.get("sort", "") or "id"
 
+    is_list = isinstance(object_query, (list, sqlalchemy.orm.collections.InstrumentedList))
+    order_by: list[Any] = []
+    python_keys: list[tuple[str, bool]] = []
+    joins: dict[Any, Any] = {}
     for sort_attr in sort_attrs.split(","):
         reverse = sort_attr.startswith("-")
         if reverse:
@@ -65,11 +94,24 @@ def jsonapi_sort(object_query: Any, safrs_object: Any) -> Any:
             # The sort order for each sort field MUST be ascending unless it is prefixed
             # with a minus, in which case it MUST be descending.
             sort_attr = sort_attr[1:]
-            attr = getattr(safrs_object, sort_attr, None)
-            if attr is not None and hasattr(attr, "desc"):
-                attr = attr.desc()
+        if "." in sort_attr:
+            # related attribute
+            if is_list:
+                python_keys.append((sort_attr, reverse))
+            else:
+                object_query, keys = related_sort_keys(object_query, safrs_object, sort_attr, reverse, joins)
+                order_by += keys
+            continue
+        if is_jsonapi_attr(safrs_object._s_jsonapi_attrs.get(sort_attr)):
+            # jsonapi_attr attributes can be sorted in the db if they declare an sql expression
+            attr = query_attr(safrs_object, sort_attr)
+            if attr is None and not is_list:
+                safrs.log.debug(f"sorting not implemented for {safrs_object}.{sort_attr}")
+                continue
         else:
             attr = getattr(safrs_object, sort_attr, None)
+        if reverse and attr is not None and hasattr(attr, "desc"):
+            attr = attr.desc()
         if sort_attr == "id":
             if attr is None:
                 if safrs_object.id_type.primary_keys:
@@ -78,24 +120,30 @@ def jsonapi_sort(object_query: Any, safrs_object: Any) -> Any:
                         sort_attr = attr.name
                 else:
                     continue
-        elif attr is None or sort_attr not in safrs_object._s_jsonapi_attrs:
+        elif sort_attr not in safrs_object._s_jsonapi_attrs or (attr is None and not is_list):
             safrs.log.debug(f"{safrs_object} has no attribute {sort_attr} in {safrs_object._s_jsonapi_attrs}")
             continue
-        if isinstance(object_query, (list, sqlalchemy.orm.collections.InstrumentedList)):
+        if is_list:
+            python_keys.append((sort_attr, reverse))
+        else:
+            order_by.append(attr)
+
+    if is_list:
+        # python's sort is stable: sort by the least significant key first
+        for sort_attr, reverse in reversed(python_keys):
             object_query = sorted(
-                list(object_query), key=lambda obj: (getattr(obj, sort_attr, None) is None, getattr(obj, sort_attr, None)), reverse=reverse
+                list(object_query),
+                key=lambda obj: (related_value(obj, sort_attr) is None, related_value(obj, sort_attr)),
+                reverse=reverse,
             )
-        elif is_jsonapi_attr(attr):
-            # to do: implement sorting for jsonapi_attr
-            safrs.log.debug(f"sorting not implemented for {attr}")
-        elif hasattr(object_query, "order_by"):
-            try:
-                # This may fail on non-sqla objects, eg. properties
-                object_query = object_query.order_by(attr)
-            except sqlalchemy.exc.ArgumentError as exc:
-                safrs.log.warning(f"Sort failed for {safrs_object}.{sort_attr}: {exc}")
-            except Exception as exc:
-                safrs.log.warning(f"Sort failed for {safrs_object}.{sort_attr}: {exc}")
+    elif order_by and hasattr(object_query, "order_by"):
+        try:
+            # This may fail on non-sqla objects, eg. properties
+            object_query = object_query.order_by(*order_by)
+        except sqlalchemy.exc.ArgumentError as exc:
+            safrs.log.warning(f"Sort failed for {safrs_object} {sort_attrs}: {exc}")
+        except Exception as exc:
+            safrs.log.warning(f"Sort failed for {safrs_object} {sort_attrs}: {exc}")
 
     return object_query
 
@@ -107,6 +155,13 @@ def _paginate_link(base_url: str, count: int, limit: int) -> str:
     return base_url + "?" + "&".join(params)
 
 
+def _cursor_link(base_url: str, limit: int, cursor_arg: str = "page[after]", cursor: str = "") -> str:
+    ignore_args = "page[offset]", "page[limit]", "page[after]", "page[before]"
+    params = [f"{k}={v}" for k, v in request.args.items() if k not in ignore_args]
+    params.append(f"{cursor_arg}={cursor}&page[limit]={limit}")
+    return base_url + "?" + "&".join(params)
+
+
 def _pagination_args() -> tuple[int, int]:
     try:
         page_offset = int(get_request_param("page_offset"))
@@ -127,15 +182,36 @@ def _pagination_args() -> tuple[int, int]:
     return page_offset, limit
 
 
-def _pagination_count(object_query: Any, safrs_object: Any) -> int:
+class EstimatedCount(int):
+    """
+    Collection count estimated from the database statistics (cfr. count_strategy.py)
+    """
+
+
+def _pagination_count(object_query: Any, safrs_object: Any, scoped: bool = False) -> Optional[int]:
+    """
+    :param scoped: `object_query` selects a subset of the `safrs_object` collection (eg. a relationship)
+    :return: collection count, None if unknown
+    """
     if isinstance(object_query, (list, sqlalchemy.orm.collections.InstrumentedList)):
         return len(object_query)
     if safrs_object is None:
         return object_query.count()
-    return safrs_object._s_count()
+    if scoped:
+        return None if safrs_object._s_count_strategy == "none" else object_query.count()
+    count, estimated = collection_count(safrs_object)
+    if estimated:
+        return EstimatedCount(count)
+    return count
 
 
-def _pagination_links(page_offset: int, limit: int, count: int, base_url: str) -> dict[str, str]:
+def _pagination_links(page_offset: int, limit: int, count: Optional[int], base_url: str, has_next: bool = False) -> dict[str, str]:
+    """
+    :param count: collection count, None if unknown
+    :param has_next: whether there are instances after the current page, used when the count is unknown
+    """
+    if count is None:
+        return _unbounded_pagination_links(page_offset, limit, base_url, has_next)
     page_base = int(page_offset / limit) * limit
     first_args = (0, limit)
     last_args = (int(int(count / limit) * limit), limit)
@@ -160,6 +236,20 @@ def _pagination_links(page_offset: int, limit: int, count: int, base_url: str) -
     return links
 
 
+def _unbounded_pagination_links(page_offset: int, limit: int, base_url: str, has_next: bool) -> dict[str, str]:
+    """
+    Pagination links when the collection count is unknown: there's no "last" link
+    """
+    links = {"self": _paginate_link(base_url, page_offset, limit)}
+    if page_offset >= limit:
+        links["first"] = _paginate_link(base_url, 0, limit)
+    if page_offset > limit:
+        links["prev"] = _paginate_link(base_url, page_offset - limit, limit)
+    if has_next:
+        links["next"] = _paginate_link(base_url, page_offset + limit, limit)
+    return links
+
+
 def _paginate_instances(object_query: Any, page_offset: int, limit: int, safrs_object: Any) -> Any:
     if isinstance(object_query, (list, sqlalchemy.orm.collections.InstrumentedList)):
         return object_query[page_offset : page_offset + limit]
@@ -182,7 +272,7 @@ def _paginate_instances(object_query: Any, page_offset: int, limit: int, safrs_o
         raise GenericError(f"{exc}") from exc
 
 
-def paginate(object_query: Any, SAFRSObject: Any=None) -> Any:
+def paginate(object_query: Any, SAFRSObject: Any=None, scoped: bool = False) -> Any:
     """
     this is where the query is executed, hence it's the bottleneck of the queries
 
@@ -206,17 +296,64 @@ def paginate(object_query: Any, SAFRSObject: Any=None) -> Any:
 
     We use page[offset] and page[limit], where
     offset is the number of records to offset by prior to returning resources
+    or the page[after] and page[before] cursors (cfr. keyset_paginate_response)
 
     :param object_query: SQLAalchemy query object
     :param SAFRSObject: optional
+    :param scoped: `object_query` selects a subset of the SAFRSObject collection (eg. a relationship),
+                   so it's counted instead of applying the SAFRSObject count strategy
     :return: links, instances, count
     """
 
+    if SAFRSObject is not None and (get_request_param("page_after") is not None or get_request_param("page_before") is not None):
+        return keyset_paginate_response(object_query, SAFRSObject, scoped)
+
     page_offset, limit = _pagination_args()
-    count = _pagination_count(object_query, SAFRSObject)
+    with timed("count"):
+        count = _pagination_count(object_query, SAFRSObject, scoped)
     base_url = SAFRSObject._s_url if SAFRSObject else ""
+    if count is None:
+        # fetch one more instance to find out whether there's a next page
+        with timed("paginate"):
+            instances = _paginate_instances(object_query, page_offset, limit + 1, SAFRSObject)
+        links = _pagination_links(page_offset, limit, count, base_url, has_next=len(instances) > limit)
+        return links, instances[:limit], count
     links = _pagination_links(page_offset, limit, count, base_url)
-    instances = _paginate_instances(object_query, page_offset, limit, SAFRSObject)
+    with timed("paginate"):
+        instances = _paginate_instances(object_query, page_offset, limit, SAFRSObject)
+    return links, instances, count
+
+
+def keyset_paginate_response(object_query: Any, SAFRSObject: Any, scoped: bool = False) -> Any:
+    """
+    Paginate with the page[after] or page[before] cursor instead of page[offset] (cfr. keyset.py),
+    the "next" and "prev" links contain the cursors of the adjacent pages
+
+    :param object_query: SQLAalchemy query object or list of instances
+    :param SAFRSObject: SAFRSBase subclass
+    :param scoped: `object_query` selects a subset of the SAFRSObject collection, cfr. paginate
+    :return: links, instances, count
+    """
+    after, before = get_request_param("page_after"), get_request_param("page_before")
+    _, limit = _pagination_args()
+    try:
+        with timed("paginate"):
+            instances, next_cursor, prev_cursor = keyset_paginate(object_query, SAFRSObject, request.args.get("sort", ""), after, before, limit)
+    except sqlalchemy.exc.SQLAlchemyError as exc:
+        raise GenericError(f"{exc}") from exc
+    with timed("count"):
+        count = _pagination_count(object_query, SAFRSObject, scoped)
+    # the url of the requested endpoint: for relationships, this isn't the SAFRSObject collection url
+    base_url = urljoin(SAFRSObject._s_url_root, request.script_root + request.path)
+    links = {"first": _cursor_link(base_url, limit)}
+    if before is not None:
+        links["self"] = _cursor_link(base_url, limit, "page[before]", before)
+    else:
+        links["self"] = _cursor_link(base_url, limit, "page[after]", after)
+    if next_cursor is not None:
+        links["next"] = _cursor_link(base_url, limit, "page[after]", next_cursor)
+    if prev_cursor is not None:
+        links["prev"] = _cursor_link(base_url, limit, "page[before]", prev_cursor)
     return links, instances, count
 
 
@@ -235,8 +372,16 @@ def jsonapi_format_response(data: Any=None, meta: Any=None, links: Any=None, err
         meta = {}
 
     meta["limit"] = limit
+    if isinstance(count, EstimatedCount):
+        meta["count_estimated"] = True
+        count = int(count)
     meta["count"] = meta["total"] = count
 
+    # fetch the included instances and the linkage of the requested relationships for all instances at once
+    with timed("include"):
+        prefetch_included(data)
+        prefetch_page_linkage(data)
+
     jsonapi = dict(version="1.0")
     result = dict(data=data)
 
@@ -252,3 +397,88 @@ def jsonapi_format_response(data: Any=None, meta: Any=None, links: Any=None, err
     result["included"] = safrs.base.Included
 
     return result
+
+
+def _stream_instances(object_query: Any, page_offset: int, limit: int) -> Any:
+    """
+    :return: iterator over the paginated query results, fetched in batches of STREAM_YIELD_PER rows
+    """
+    page_query = object_query.offset(page_offset).limit(limit)
+    yield_per = int(get_config("STREAM_YIELD_PER") or 1000)
+    try:
+        # iter() executes the query, so errors are raised before the response is streamed
+        return iter(page_query.yield_per(yield_per))
+    except sqlalchemy.exc.InvalidRequestError as exc:
+        # yield_per can't be combined with joined eager loading of collections (include=...)
+        safrs.log.debug(f"Can't use yield_per: {exc}")
+        return iter(page_query.all())
+    except OverflowError as exc:
+        raise ValidationError("Pagination Overflow Error") from exc
+    except Exception as exc:
+        raise GenericError(f"{exc}") from exc
+
+
+def _prefetched_chunks(instances: Any, chunk_size: int) -> Any:
+    """
+    :param instances: iterator over the streamed instances
+    :param chunk_size: number of instances to prefetch at once
+    :return: iterator over `instances`, the relationships of every chunk are prefetched before its instances are serialized
+    """
+    while True:
+        chunk = list(itertools.islice(instances, chunk_size))
+        if not chunk:
+            return
+        prefetch_included(chunk)
+        prefetch_page_linkage(chunk)
+        yield from chunk
+
+
+def jsonapi_stream_response(object_query: Any, SAFRSObject: Any) -> Any:
+    """
+    Paginate `object_query` and stream the jsonapi document:
+    the `data` items are serialized while they are fetched from the db, followed by `included`, `jsonapi`, `links` and `meta`
+    (this is the same key order as the sorted non-streamed response).
+    This keeps the memory usage low for large pages.
+
+    Errors that occur after the response has started can't be returned to the client,
+    these are logged and the document will be incomplete.
+
+    :param object_query: SQLAlchemy query object
+    :param SAFRSObject: the SAFRSBase subclass of the collection
+    :return: streamed flask response
+    """
+    page_offset, limit = _pagination_args()
+    count = _pagination_count(object_query, SAFRSObject)
+    # if the count is unknown, one more instance is fetched to find out whether there's a next page
+    rows = _stream_instances(object_query, page_offset, limit if count is not None else limit + 1)
+    instances = itertools.islice(rows, limit)
+
+    def trailer() -> dict[str, Any]:
+        """
+        :return: the top level members that follow data and included
+        """
+        has_next = count is None and next(rows, None) is not None
+        links = _pagination_links(page_offset, limit, count, SAFRSObject._s_url, has_next)
+        result = jsonapi_format_response(None, {}, links, None, count)
+        del result["data"], result["included"]
+        return result
+
+    provider = current_app.json
+    backend = get_json_backend()
+    chunk_size = int(get_config("STREAM_YIELD_PER") or 1000)
+
+    def dumpb(obj: Any) -> bytes:
+        return backend.dumpb(obj, default=provider.default, sort_keys=provider.sort_keys, ensure_ascii=provider.ensure_ascii)
+
+    def generate() -> Any:
+        try:
+            yield b'{"data":['
+            yield from iter_json_array(_prefetched_chunks(instances, chunk_size), dumpb, chunk_size)
+            yield b'],"included":['
+            yield from iter_json_array(safrs.base.Included.iter_encoded(), dumpb, chunk_size)
+            yield b"]," + dumpb(trailer())[1:] + b"\n"
+        except Exception as exc:
+            safrs.log.exception(f"Failed to stream {SAFRSObject} response: {exc}")
+            raise
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=provider.mimetype)
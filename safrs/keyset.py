@@ -0,0 +1,195 @@
+# Keyset (cursor) pagination
+#
+# Instead of page[offset], a client can page through a collection with the
+# page[after] and page[before] cursors: the cursor contains the values of the sort keys
+# of the last (resp. first) instance of a page. The next page is selected with a range
+# predicate on the sort keys (eg. "WHERE (name, id) > (:name, :id)"), so the database can
+# use an index instead of scanning and discarding the offset rows.
+#
+# The sort keys are the column attributes in the sort= query argument followed by the primary keys,
+# which make the order deterministic. An empty page[after]= cursor returns the first page.
+#
+import base64
+import datetime
+import decimal
+import json
+import uuid
+from functools import cmp_to_key, lru_cache
+from typing import Any, Optional
+import sqlalchemy
+from sqlalchemy import and_, or_
+from .errors import ValidationError
+from .attr_serializer import NATIVE_CONVERTERS
+
+# python types of the column values that are serialized to a string in the cursor
+_CURSOR_PARSERS: dict[type, Any] = {
+    datetime.datetime: datetime.datetime.fromisoformat,
+    datetime.date: datetime.date.fromisoformat,
+    datetime.time: datetime.time.fromisoformat,
+    decimal.Decimal: decimal.Decimal,
+    uuid.UUID: uuid.UUID,
+    bytes: bytes.fromhex,
+}
+
+
+@lru_cache(maxsize=1024)
+def keyset_keys(model: Any, sort_arg: str) -> tuple[tuple[str, bool], ...]:
+    """
+    :param model: SAFRSBase subclass
+    :param sort_arg: sort= query argument, eg. "-name,id"
+    :return: tuple of (attribute name, descending) sort keys, ending with the primary keys
+    """
+    mapper = sqlalchemy.inspect(model)
+    column_keys = {prop.key for prop in mapper.column_attrs}
+    pk_keys = [mapper.get_property_by_column(col).key for col in mapper.primary_key]
+    keys: list[tuple[str, bool]] = []
+    for sort_attr in (sort_arg or "id").split(","):
+        descending = sort_attr.startswith("-")
+        attr_name = sort_attr.lstrip("-")
+        if attr_name == "id" and "id" not in column_keys:
+            keys += [(pk, descending) for pk in pk_keys]
+        elif (attr_name in column_keys and attr_name in model._s_jsonapi_attrs) or attr_name in pk_keys:
+            keys.append((attr_name, descending))
+        # other attributes (relationships, jsonapi_attr) are ignored, like in jsonapi_sort
+    names = [name for name, _ in keys]
+    keys += [(pk, False) for pk in pk_keys if pk not in names]
+    return tuple(dict.fromkeys(keys))
+
+
+def encode_cursor(instance: Any, keys: tuple[tuple[str, bool], ...]) -> str:
+    """
+    :param instance: the first or last instance of a page
+    :param keys: sort keys
+    :return: opaque cursor
+    """
+    values = []
+    for name, _ in keys:
+        value = getattr(instance, name)
+        converter = NATIVE_CONVERTERS.get(type(value))
+        values.append(converter(value) if converter and not isinstance(value, decimal.Decimal) else value)
+    payload = json.dumps(values, default=str, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(model: Any, keys: tuple[tuple[str, bool], ...], cursor: str) -> list[Any]:
+    """
+    :param model: SAFRSBase subclass
+    :param keys: sort keys
+    :param cursor: page[after] or page[before] value
+    :return: the sort key values contained in the cursor
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(payload)
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor doesn't match the sort keys")
+        result = []
+        for (name, _), value in zip(keys, values):
+            if value is None:
+                raise ValueError("NULL sort values can't be used with a page cursor, use page[offset]")
+            parser = _CURSOR_PARSERS.get(_python_type(model, name))
+            result.append(parser(value) if parser and isinstance(value, str) else value)
+        return result
+    except (ValueError, TypeError) as exc:
+        raise ValidationError(f"Invalid page cursor: {exc}") from exc
+
+
+def _python_type(model: Any, name: str) -> Optional[type]:
+    """
+    :return: python type of the column attribute `name`, None if unknown
+    """
+    try:
+        return getattr(model, name).type.python_type  # type: ignore[no-any-return]
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+def keyset_filter(model: Any, keys: tuple[tuple[str, bool], ...], values: list[Any], before: bool = False) -> Any:
+    """
+    Create the range predicate that selects the instances after (or before) the cursor values:
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..., where ">" becomes "<" for descending keys (and when paging backwards).
+    The predicate starts with "k1 >= v1" so the database can use an index on the first sort key.
+
+    :param model: SAFRSBase subclass
+    :param keys: sort keys
+    :param values: cursor values
+    :param before: select the instances before the cursor
+    :return: sqlalchemy expression
+    """
+    clauses = []
+    for i, (name, descending) in enumerate(keys):
+        column = getattr(model, name)
+        equal = [getattr(model, prev_name) == values[j] for j, (prev_name, _) in enumerate(keys[:i])]
+        clauses.append(and_(*equal, column > values[i] if descending == before else column < values[i]))
+    first_column = getattr(model, keys[0][0])
+    first_range = first_column >= values[0] if keys[0][1] == before else first_column <= values[0]
+    return and_(first_range, or_(*clauses))
+
+
+def keyset_order(model: Any, keys: tuple[tuple[str, bool], ...], before: bool = False) -> list[Any]:
+    """
+    :return: order_by clauses for the sort keys, reversed when paging backwards
+    """
+    return [getattr(model, name).desc() if descending != before else getattr(model, name).asc() for name, descending in keys]
+
+
+def _compare(a_values: list[Any], b_values: list[Any], keys: tuple[tuple[str, bool], ...]) -> int:
+    """
+    Compare sort key values like the keyset order
+    """
+    for a_value, b_value, (_, descending) in zip(a_values, b_values, keys):
+        if a_value is None or b_value is None:
+            raise ValidationError("NULL sort values can't be used with a page cursor, use page[offset]")
+        if a_value != b_value:
+            result = -1 if a_value < b_value else 1
+            return -result if descending else result
+    return 0
+
+
+def keyset_paginate(
+    object_query: Any, model: Any, sort_arg: str, after: Optional[str], before: Optional[str], limit: int
+) -> tuple[list[Any], Optional[str], Optional[str]]:
+    """
+    Select a page of instances with the page[after] or page[before] cursor
+
+    :param object_query: sqlalchemy query or list of instances
+    :param model: SAFRSBase subclass
+    :param sort_arg: sort= query argument
+    :param after: page[after] cursor (empty for the first page)
+    :param before: page[before] cursor
+    :param limit: page size
+    :return: (instances, cursor of the next page, cursor of the previous page), cursors are None if there is no such page
+    """
+    if after is not None and before is not None:
+        raise ValidationError("page[after] and page[before] can't be combined")
+    keys = keyset_keys(model, sort_arg or "")
+    backwards = before is not None
+    cursor = before if backwards else after
+    values = decode_cursor(model, keys, cursor) if cursor else None
+
+    if isinstance(object_query, list) or not hasattr(object_query, "order_by"):
+        items = sorted(object_query, key=cmp_to_key(lambda a, b: _compare(_values(a, keys), _values(b, keys), keys)))
+        if values is not None:
+            items = [item for item in items if _compare(_values(item, keys), values, keys) * (-1 if backwards else 1) > 0]
+        if backwards:
+            items.reverse()
+        rows = items[: limit + 1]
+    else:
+        query = object_query.order_by(None).order_by(*keyset_order(model, keys, backwards))
+        if values is not None:
+            query = query.filter(keyset_filter(model, keys, values, backwards))
+        rows = query.limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+    next_cursor = encode_cursor(rows[-1], keys) if backwards or has_more else None
+    prev_cursor = encode_cursor(rows[0], keys) if (has_more if backwards else bool(cursor)) else None
+    return rows, next_cursor, prev_cursor
+
+
+def _values(instance: Any, keys: tuple[tuple[str, bool], ...]) -> list[Any]:
+    return [getattr(instance, name) for name, _ in keys]
@@ -31,6 +31,26 @@ class SAFRSModelConfig:
     url_root: Optional[str] = None
     # Optional knob: referenced in SAFRSBase._s_query
     stateless: bool = False
+    # Stream GET collection responses (cfr. jsonapi_formatting.jsonapi_stream_response)
+    stream: bool = False
+    # Collection count strategy: "exact", "cached", "estimated" or "none" (cfr. count_strategy.py),
+    # the COUNT_STRATEGY setting is used if None
+    count_strategy: Optional[str] = None
+    # Number of seconds a "cached" count remains valid
+    count_ttl: float = 60
+    # Conditional GET: ETag/Last-Modified response headers and "304 Not Modified" responses (cfr. conditional.py),
+    # the CONDITIONAL_GET setting is used if False
+    conditional_get: bool = False
+    # Column attribute that changes when an instance is updated (eg. a version_id_col or an "updated" timestamp),
+    # used to compute the ETag of an instance
+    version_column: Optional[str] = None
+    # Cache-Control header of the GET responses, eg. "private, max-age=10"
+    cache_control: Optional[str] = None
+    # Cache the serialized GET responses in memory (cfr. response_cache.py),
+    # the RESPONSE_CACHE setting is used if False
+    response_cache: bool = False
+    # Insert the items of a bulk POST in batches (cfr. bulk.py), the BULK_CREATE setting is used if None
+    bulk_create: Optional[bool] = None
     # Hook registry for class-level behavior overrides.
     # Phase 2: infrastructure only; no core behavior uses hooks yet.
     hooks: Mapping[str, Hook] = field(default_factory=dict)
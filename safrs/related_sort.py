@@ -0,0 +1,119 @@
+# Sorting by the attributes of related instances (https://jsonapi.org/format/#fetching-sorting)
+#
+# A sort field can be a dot-separated path of relationship names followed by an attribute name,
+# eg. sort=-author.name,id sorts Books by the name of their author.
+# - when all relationships of the path are to-one, the related tables are outer joined
+#   (instances without related instance are sorted as NULL)
+# - when the path contains a to-many relationship, the sort key is a correlated subquery
+#   that selects the min. (ascending) or max. (descending) value of the related attribute
+#
+from functools import lru_cache
+from typing import Any, Optional
+import sqlalchemy
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.interfaces import MANYTOONE
+import safrs
+from .jsonapi_attr import is_jsonapi_attr, query_attr
+
+
+@lru_cache(maxsize=1024)
+def sort_path(model: Any, sort_attr: str) -> Optional[tuple[tuple[Any, ...], str, bool]]:
+    """
+    :param model: SAFRSBase subclass
+    :param sort_attr: dotted sort field without "-", eg. "author.name"
+    :return: (relationships, attribute name, to_many) or None if the path is invalid
+    """
+    *rel_names, attr_name = sort_attr.split(".")
+    relationships = []
+    to_many = False
+    cls = model
+    for rel_name in rel_names:
+        rel = getattr(cls, "_s_relationships", {}).get(rel_name)
+        if rel is None:
+            return None
+        relationships.append(rel)
+        to_many = to_many or (rel.direction != MANYTOONE and rel.uselist)
+        cls = rel.mapper.class_
+    if attr_name != "id" and query_attr(cls, attr_name) is None:
+        return None
+    return tuple(relationships), attr_name, to_many
+
+
+def _target_attrs(target: Any, alias: Any, attr_name: str) -> list[Any]:
+    """
+    :return: the attributes of the `target` alias to sort on
+    """
+    mapper = sqlalchemy.inspect(target)
+    if attr_name == "id":
+        return [getattr(alias, mapper.get_property_by_column(col).key) for col in mapper.primary_key]
+    attr = target._s_jsonapi_attrs[attr_name]
+    if is_jsonapi_attr(attr):
+        return [getattr(alias, attr_name)]
+    return [getattr(alias, mapper.get_property_by_column(attr).key)]
+
+
+def related_sort_keys(query: Any, model: Any, sort_attr: str, reverse: bool, joins: dict[Any, Any]) -> tuple[Any, list[Any]]:
+    """
+    :param query: sqla query of `model` instances
+    :param model: SAFRSBase subclass
+    :param sort_attr: dotted sort field without "-"
+    :param reverse: descending sort
+    :param joins: the aliases of the relationship paths joined to `query` by previous sort fields
+    :return: the query (with joins for to-one paths) and the order_by clauses
+    """
+    path = sort_path(model, sort_attr)
+    if path is None:
+        safrs.log.debug(f"Invalid sort field {model}.{sort_attr}")
+        return query, []
+    relationships, attr_name, to_many = path
+    target = relationships[-1].mapper.class_
+    if not to_many:
+        alias = joins.get(relationships)
+        if alias is None:
+            cls = model
+            for i, rel in enumerate(relationships):
+                alias = joins.get(relationships[: i + 1])
+                if alias is None:
+                    alias = aliased(rel.mapper.class_)
+                    query = query.outerjoin(getattr(cls, rel.key).of_type(alias))
+                    joins[relationships[: i + 1]] = alias
+                cls = alias
+        keys = _target_attrs(target, alias, attr_name)
+        return query, [key.desc() if reverse else key.asc() for key in keys]
+
+    # correlated subquery, joined from an alias of `model`
+    parent = aliased(model)
+    mapper = sqlalchemy.inspect(model)
+    cls = parent
+    joined = []
+    for rel in relationships:
+        alias = aliased(rel.mapper.class_)
+        joined.append(getattr(cls, rel.key).of_type(alias))
+        cls = alias
+    keys = []
+    for key in _target_attrs(target, cls, attr_name):
+        aggregate = func.max(key) if reverse else func.min(key)
+        subquery = select(aggregate).select_from(parent)
+        for onclause in joined:
+            subquery = subquery.join(onclause)
+        pk_attrs = [mapper.get_property_by_column(col).key for col in mapper.primary_key]
+        subquery = subquery.where(and_(*[getattr(parent, pk) == getattr(model, pk) for pk in pk_attrs]))
+        scalar = subquery.scalar_subquery()
+        keys.append(scalar.desc() if reverse else scalar.asc())
+    return query, keys
+
+
+def related_value(instance: Any, sort_attr: str) -> Any:
+    """
+    :param instance: SAFRSBase instance
+    :param sort_attr: dotted sort field without "-"
+    :return: the value of the related attribute, used to sort lists in python
+    """
+    value = instance
+    for attr_name in sort_attr.split("."):
+        value = getattr(value, attr_name, None)
+        if value is None or isinstance(value, list):
+            # to-many relationships can't be sorted in python
+            return None
+    return value
@@ -0,0 +1,459 @@
+"""
+Batched relationship loading
+
+Instead of loading the relationships of every instance separately, the relationships are loaded
+for all instances of a response page at once:
+
+- Resource linkage (https://jsonapi.org/format/#document-resource-object-linkage) contains
+  only the "type" and "id" of the related resources, so only the primary keys of the parents and
+  the related objects are selected (`prefetch_page_linkage`)
+- Included resources (https://jsonapi.org/format/#fetching-includes) are loaded per include level,
+  with a window query to page to-many relationships (`prefetch_included`)
+"""
+from typing import Any, Callable, Optional, cast
+import inspect
+from flask import g, has_request_context, request
+import sqlalchemy
+from sqlalchemy import and_, func, literal, select, tuple_
+from sqlalchemy.orm import aliased, load_only, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
+import safrs
+from .safrs_types import SAFRSID
+from .config import get_config, get_request_param
+from .jsonapi_filters import sparse_fieldset_columns
+
+# max. number of parent keys in a single IN clause
+IN_CHUNK_SIZE = 500
+
+
+def supports_pk_linkage(target: Any) -> bool:
+    """
+    The linkage can only be created from the primary key values if the jsonapi_id
+    of the target is derived from the PKs in the default way and the target isn't polymorphic
+    (the "type" of a polymorphic instance depends on its subclass)
+
+    :param target: related SAFRSBase subclass
+    :return: True if the linkage of `target` instances can be created from the target PKs
+    """
+    if not hasattr(target, "id_type") or not hasattr(target, "_s_type"):
+        return False
+    if inspect.getattr_static(target, "jsonapi_id", None) is not inspect.getattr_static(safrs.SAFRSBase, "jsonapi_id"):
+        return False
+    if inspect.getattr_static(target.id_type, "get_id", None) is not inspect.getattr_static(SAFRSID, "get_id"):
+        return False
+    mapper = sqlalchemy.inspect(target)
+    return len(mapper.self_and_descendants) == 1
+
+
+def _session(instances: list[Any]) -> Any:
+    """
+    :param instances: persistent instances
+    :return: the session of the instances, the relationships are loaded in the same session
+             (eg. a streamed response is generated in another app context, i.e. with another scoped session)
+    """
+    for instance in instances:
+        session = object_session(instance)
+        if session is not None:
+            return session
+    return safrs.DB.session
+
+
+def _format_id(id_type: Any, pk_values: tuple[Any, ...]) -> str:
+    """
+    :return: the jsonapi id for the pk values, cfr. SAFRSID.get_id
+    """
+    if len(pk_values) == 1:
+        return str(pk_values[0])
+    return id_type.delimiter.join(str(value) for value in pk_values)
+
+
+def _linkage_select(parent_cls: Any, rel_name: str) -> tuple[Any, list[Any], list[Any], list[Any]]:
+    """
+    :param parent_cls: SAFRSBase subclass
+    :param rel_name: relationship name
+    :return: (select of the parent and target pks, parent pk columns, target pk columns, target order by)
+    """
+    relationship = parent_cls._s_relationships[rel_name]
+    target = relationship.mapper.class_
+    parent_mapper = sqlalchemy.inspect(parent_cls)
+    parent_pks = [getattr(parent_cls, parent_mapper.get_property_by_column(col).key) for col in parent_mapper.primary_key]
+    # alias the target for self-referential relationships
+    target_alias = aliased(target) if target is parent_cls else target
+    target_pks = [getattr(target_alias, target.colname_to_attrname(col.name)) for col in target.id_type.columns]
+    order_by = list(relationship.order_by) if relationship.order_by and target_alias is target else target_pks
+    stmt = select(*parent_pks, *target_pks).select_from(parent_cls).join(getattr(parent_cls, rel_name).of_type(target_alias))
+    return stmt, parent_pks, target_pks, order_by
+
+
+def fetch_linkage(
+    parent_cls: Any, rel_name: str, parents: list[Any], offset: int = 0, limit: Optional[int] = None
+) -> dict[tuple[Any, ...], tuple[list[dict[str, str]], int]]:
+    """
+    Fetch the resource linkage of relationship `rel_name` for all `parents`, only the primary key columns are selected.
+    For to-many relationships a ROW_NUMBER() window partitioned by parent is used to select a page (offset, limit)
+    of the linkage of every parent
+
+    :param parent_cls: SAFRSBase subclass
+    :param rel_name: relationship name
+    :param parents: persistent `parent_cls` instances
+    :param offset: to-many page offset (page[rel_name][offset])
+    :param limit: to-many page limit (page[rel_name][limit])
+    :return: dict of parent identity => (list of resource identifiers ({"id", "type"}), total number of related instances)
+    """
+    target = parent_cls._s_relationships[rel_name].mapper.class_
+    to_many = parent_cls._s_relationships[rel_name].direction != MANYTOONE
+    stmt, parent_pks, target_pks, order_by = _linkage_select(parent_cls, rel_name)
+    if to_many:
+        stmt = stmt.add_columns(
+            func.row_number().over(partition_by=parent_pks, order_by=order_by).label("_s_row"),
+            func.count().over(partition_by=parent_pks).label("_s_total"),
+        )
+    else:
+        stmt = stmt.add_columns(literal(1))
+
+    result: dict[tuple[Any, ...], tuple[list[dict[str, str]], int]] = {}
+    identities = [sqlalchemy.inspect(parent).identity for parent in parents]
+    identities = list(dict.fromkeys(identity for identity in identities if identity is not None))
+    for identity in identities:
+        result[identity] = ([], 0)
+    target_type = target._s_type
+    n_pks = len(parent_pks)
+    session = _session(parents)
+    for i in range(0, len(identities), IN_CHUNK_SIZE):
+        chunk = identities[i : i + IN_CHUNK_SIZE]
+        if n_pks == 1:
+            where = parent_pks[0].in_([identity[0] for identity in chunk])
+        else:
+            where = tuple_(*parent_pks).in_(chunk)
+        chunk_stmt = stmt.where(where)
+        if to_many:
+            # the row number can only be filtered in an enclosing query
+            rows = chunk_stmt.subquery()
+            page_stmt = select(rows).where(rows.c._s_row > offset).order_by(*list(rows.c)[:n_pks], rows.c._s_row)
+            if limit is not None:
+                page_stmt = page_stmt.where(rows.c._s_row <= offset + limit)
+            chunk_stmt = page_stmt
+        for row in session.execute(chunk_stmt):
+            parent_key = tuple(row[:n_pks])
+            target_id = _format_id(target.id_type, tuple(row[n_pks : n_pks + len(target_pks)]))
+            identifiers, _ = result.setdefault(parent_key, ([], 0))
+            identifiers.append({"id": target_id, "type": target_type})
+            result[parent_key] = (identifiers, row[-1])
+    return result
+
+
+def fetch_instance_linkage(instance: Any, rel_name: str, offset: int = 0, limit: Optional[int] = None) -> tuple[list[dict[str, str]], int]:
+    """
+    Fetch a page of the resource linkage of relationship `rel_name` of a single instance
+    (used when the linkage hasn't been prefetched), the offset and limit are applied in the query
+
+    :param instance: persistent SAFRSBase instance
+    :param rel_name: relationship name
+    :param offset: to-many page offset
+    :param limit: to-many page limit
+    :return: (list of resource identifiers ({"id", "type"}), total number of related instances)
+    """
+    parent_cls = type(instance)
+    target = parent_cls._s_relationships[rel_name].mapper.class_
+    stmt, parent_pks, target_pks, order_by = _linkage_select(parent_cls, rel_name)
+    identity = sqlalchemy.inspect(instance).identity
+    stmt = stmt.where(*[pk == value for pk, value in zip(parent_pks, identity)])
+    session = _session([instance])
+    if parent_cls._s_relationships[rel_name].direction == MANYTOONE:
+        rows = session.execute(stmt.limit(1)).all()
+        total = len(rows)
+    else:
+        rows = session.execute(stmt.order_by(*order_by).offset(offset).limit(limit)).all()
+        total = len(rows) + offset
+        if limit is None or len(rows) >= limit or (offset and not rows):
+            total = session.execute(select(func.count()).select_from(stmt.subquery())).scalar_one()
+    n_pks = len(parent_pks)
+    identifiers = [{"id": _format_id(target.id_type, tuple(row[n_pks:])), "type": target._s_type} for row in rows]
+    return identifiers, total
+
+
+def _prefetch(description: str, instances: list[Any], fetch: Callable[[], Any]) -> Any:
+    """
+    Prefetching is an optimization: when it fails, the relationships are loaded per instance.
+    A failed statement aborts the transaction (eg. on postgres), so the queries are executed in a savepoint
+    and only the savepoint is rolled back (the instances of the page and pending changes are kept).
+
+    :param description: description of the prefetched relationship, for the log
+    :param instances: the instances for which the relationships are prefetched
+    :param fetch: callable that executes the queries
+    :return: the result of `fetch`, None if it failed
+    """
+    try:
+        with _session(instances).begin_nested():
+            return fetch()
+    except Exception as exc:
+        safrs.log.warning(f"Failed to prefetch {description}: {exc}")
+        return None
+
+
+def prefetch_linkage(instances: Any, rel_names: Any) -> None:
+    """
+    Fetch the linkage of the `rel_names` relationships for all instances (of the same class)
+    and store it in `g.ja_linkage` so it can be used when the instances are serialized.
+
+    :param instances: list of SAFRSBase instances
+    :param rel_names: relationship names
+    """
+    if not instances or not has_request_context():
+        return
+    parent_cls = type(instances[0])
+    linkage = g.setdefault("ja_linkage", {})
+    for rel_name in rel_names:
+        relationship = parent_cls._s_relationships.get(rel_name)
+        if relationship is None or not supports_pk_linkage(relationship.mapper.class_):
+            continue
+        offset = cast(Any, request).get_page_offset(rel_name)
+        limit = cast(Any, request).get_page_limit(rel_name)
+        fetched = _prefetch(f"{parent_cls}.{rel_name} linkage", instances, lambda: fetch_linkage(parent_cls, rel_name, instances, offset, limit))
+        if fetched is not None:
+            linkage.setdefault((parent_cls, rel_name), {}).update(fetched)
+
+
+def get_linkage(instance: Any, rel_name: str, offset: int = 0, limit: Optional[int] = None) -> Optional[tuple[list[dict[str, str]], int]]:
+    """
+    :param instance: SAFRSBase instance
+    :param rel_name: relationship name
+    :param offset: to-many page offset
+    :param limit: to-many page limit
+    :return: (page of resource identifiers of the related instances, total number of related instances),
+             None if the linkage can't be fetched without loading the instances
+    """
+    if rel_name in instance.__dict__:
+        # the relationship has already been loaded
+        loaded = instance.__dict__[rel_name]
+        if not isinstance(loaded, list):
+            return ([{"id": str(loaded.jsonapi_id), "type": loaded._s_type}] if loaded is not None else []), int(loaded is not None)
+        identifiers = [{"id": str(item.jsonapi_id), "type": item._s_type} for item in loaded]
+        end = None if limit is None else offset + limit
+        return identifiers[offset:end], len(identifiers)
+    parent_cls = type(instance)
+    identity = sqlalchemy.inspect(instance).identity
+    if identity is None:
+        return None
+    linkage = getattr(g, "ja_linkage", {}) if has_request_context() else {}
+    prefetched = linkage.get((parent_cls, rel_name))
+    if prefetched is not None and identity in prefetched:
+        # fetched with the same page offset and limit by prefetch_linkage
+        return prefetched[identity]
+    relationship = parent_cls._s_relationships.get(rel_name)
+    if relationship is None or not supports_pk_linkage(relationship.mapper.class_):
+        return None
+    return fetch_instance_linkage(instance, rel_name, offset, limit)
+
+
+def prefetch_page_linkage(instances: Any) -> None:
+    """
+    Prefetch the linkage of the relationships that have been requested with a sparse fieldset (`fields[Type]=rel_name`)
+    and that are not included (the included relationship instances have to be loaded anyway)
+
+    :param instances: the instances in the response data
+    """
+    if isinstance(instances, safrs.SAFRSBase):
+        instances = [instances]
+    if not isinstance(instances, list) or not has_request_context():
+        return
+    fields = get_request_param("fields") or {}
+    if not fields:
+        return
+    included_csv = request.args.get("include", safrs.SAFRS.DEFAULT_INCLUDED)
+    included_rels = {inc.split(".")[0] for inc in included_csv.split(",") if inc}
+    if safrs.SAFRS.INCLUDE_ALL in included_rels:
+        return
+
+    by_class: dict[Any, list[Any]] = {}
+    for instance in instances:
+        if isinstance(instance, safrs.SAFRSBase):
+            by_class.setdefault(type(instance), []).append(instance)
+    for parent_cls, parents in by_class.items():
+        rel_names = [name for name in fields.get(parent_cls._s_class_name, []) if name in parent_cls._s_relationships and name not in included_rels]
+        prefetch_linkage(parents, rel_names)
+
+
+def fetch_related(parent_cls: Any, rel_name: str, parents: list[Any], offset: int = 0, limit: Optional[int] = None) -> dict[tuple[Any, ...], tuple[list[Any], int]]:
+    """
+    Load the related instances of relationship `rel_name` for all `parents` with a single query:
+    - to-one relationships: the targets of all parents are selected with an IN clause
+    - to-many relationships: a ROW_NUMBER() window partitioned by parent is used to select
+      a page (offset, limit) of related instances for every parent
+
+    :param parent_cls: SAFRSBase subclass
+    :param rel_name: relationship name
+    :param parents: persistent `parent_cls` instances
+    :param offset: to-many page offset (page[rel_name][offset])
+    :param limit: to-many page limit (page[rel_name][limit])
+    :return: dict of parent identity => (list of related instances, total number of related instances)
+    """
+    relationship = parent_cls._s_relationships[rel_name]
+    target = relationship.mapper.class_
+    parent_mapper = sqlalchemy.inspect(parent_cls)
+    target_mapper = sqlalchemy.inspect(target)
+    parent_pks = [getattr(parent_cls, parent_mapper.get_property_by_column(col).key) for col in parent_mapper.primary_key]
+    # alias the target for self-referential relationships
+    target_alias = aliased(target) if target is parent_cls else target
+    target_pk_keys = [target_mapper.get_property_by_column(col).key for col in target_mapper.primary_key]
+    alias_pks = [getattr(target_alias, key) for key in target_pk_keys]
+
+    # the keys of the related instances are selected in a subquery, the instances are joined with the subquery
+    key_columns = [pk.label(f"_s_parent_{i}") for i, pk in enumerate(parent_pks)]
+    key_columns += [pk.label(f"_s_target_{i}") for i, pk in enumerate(alias_pks)]
+    to_many = relationship.direction != MANYTOONE
+    if to_many:
+        order_by = list(relationship.order_by) if relationship.order_by and target_alias is target else alias_pks
+        key_columns.append(func.row_number().over(partition_by=parent_pks, order_by=order_by).label("_s_row"))
+        key_columns.append(func.count().over(partition_by=parent_pks).label("_s_total"))
+    key_stmt = select(*key_columns).select_from(parent_cls).join(getattr(parent_cls, rel_name).of_type(target_alias))
+
+    result: dict[tuple[Any, ...], tuple[list[Any], int]] = {}
+    identities = [sqlalchemy.inspect(parent).identity for parent in parents]
+    identities = list(dict.fromkeys(identity for identity in identities if identity is not None))
+    for identity in identities:
+        result[identity] = ([], 0)
+
+    fields = (get_request_param("fields") or {}) if has_request_context() else {}
+    columns = sparse_fieldset_columns(target, fields.get(getattr(target, "_s_class_name", None)))
+    session = _session(parents)
+    for i in range(0, len(identities), IN_CHUNK_SIZE):
+        chunk = identities[i : i + IN_CHUNK_SIZE]
+        if len(parent_pks) == 1:
+            where = parent_pks[0].in_([identity[0] for identity in chunk])
+        else:
+            where = tuple_(*parent_pks).in_(chunk)
+        keys = key_stmt.where(where).subquery()
+        parent_keys = [keys.c[f"_s_parent_{i}"] for i in range(len(parent_pks))]
+        on_clause = and_(*[getattr(target, key) == keys.c[f"_s_target_{i}"] for i, key in enumerate(target_pk_keys)])
+        if to_many:
+            stmt = select(*parent_keys, target, keys.c._s_total).join(keys, on_clause).order_by(*parent_keys, keys.c._s_row)
+            stmt = stmt.where(keys.c._s_row > offset)
+            if limit is not None:
+                stmt = stmt.where(keys.c._s_row <= offset + limit)
+        else:
+            stmt = select(*parent_keys, target, literal(1)).join(keys, on_clause)
+        if columns:
+            stmt = stmt.options(load_only(*columns))
+        for row in session.execute(stmt):
+            parent_key = tuple(row[: len(parent_pks)])
+            items, _ = result.setdefault(parent_key, ([], 0))
+            items.append(row[len(parent_pks)])
+            result[parent_key] = (items, row[-1])
+    return result
+
+
+def _include_tree(included_list: list[str]) -> dict[str, Any]:
+    """
+    :param included_list: include= paths, eg. ["books.author", "friends"]
+    :return: nested dict, eg. {"books": {"author": {}}, "friends": {}}
+    """
+    tree: dict[str, Any] = {}
+    for path in included_list:
+        node = tree
+        for rel_name in path.split("."):
+            node = node.setdefault(rel_name, {})
+    return tree
+
+
+def prefetch_included(instances: Any) -> None:
+    """
+    Batched include loader: load the related instances of the include= paths level by level
+    for all instances in the response data, the results are stored in `g.ja_related`.
+    This way the number of queries depends on the include depth instead of the number of rows.
+
+    :param instances: the instances in the response data
+    """
+    if isinstance(instances, safrs.SAFRSBase):
+        instances = [instances]
+    if not isinstance(instances, list) or not instances or not has_request_context() or not get_config("ENABLE_RELATIONSHIPS"):
+        return
+    included_csv = request.args.get("include", safrs.SAFRS.DEFAULT_INCLUDED)
+    tree = _include_tree([inc for inc in included_csv.split(",") if inc])
+    if not tree:
+        return
+    related = g.setdefault("ja_related", {})
+    level: list[tuple[list[Any], dict[str, Any]]] = [([inst for inst in instances if isinstance(inst, safrs.SAFRSBase)], tree)]
+    while level:
+        next_level = []
+        for parents, subtree in level:
+            by_class: dict[Any, list[Any]] = {}
+            for parent in parents:
+                by_class.setdefault(type(parent), []).append(parent)
+            for parent_cls, cls_parents in by_class.items():
+                rel_names = list(subtree)
+                if safrs.SAFRS.INCLUDE_ALL in subtree:
+                    rel_names = list(parent_cls._s_relationships.keys())
+                for rel_name in rel_names:
+                    relationship = parent_cls._s_relationships.get(rel_name)
+                    if relationship is None:
+                        continue
+                    offset = cast(Any, request).get_page_offset(rel_name)
+                    limit = cast(Any, request).get_page_limit(rel_name)
+                    # eg. the db doesn't support window functions: the relationships will be loaded per instance
+                    fetched = _prefetch(f"{parent_cls}.{rel_name}", cls_parents, lambda: fetch_related(parent_cls, rel_name, cls_parents, offset, limit))
+                    if fetched is None:
+                        continue
+                    # merged per parent identity: a self-referential relationship may be included at several levels
+                    related.setdefault((parent_cls, rel_name), {}).update(fetched)
+                    children = [child for items, _ in fetched.values() for child in items]
+                    if subtree.get(rel_name) and children:
+                        next_level.append((children, subtree[rel_name]))
+        level = next_level
+
+
+def load_included(instances: list[Any], include_paths: list[list[str]]) -> None:
+    """
+    Load the related instances of the include paths level by level for all `instances` and set them as the
+    (committed) relationship values, so they aren't loaded per instance when the relationships are accessed.
+    Unlike `prefetch_included` this doesn't depend on the flask request (it's used by the FastAPI adapter).
+
+    :param instances: SAFRSBase instances
+    :param include_paths: include paths, eg. [["books", "author"], ["friends"]]
+    """
+    tree = _include_tree([".".join(path) for path in include_paths if path])
+    level: list[tuple[list[Any], dict[str, Any]]] = [([inst for inst in instances if isinstance(inst, safrs.SAFRSBase)], tree)]
+    while level:
+        next_level = []
+        for parents, subtree in level:
+            by_class: dict[Any, list[Any]] = {}
+            for parent in parents:
+                by_class.setdefault(type(parent), []).append(parent)
+            for parent_cls, cls_parents in by_class.items():
+                for rel_name in subtree:
+                    relationship = parent_cls._s_relationships.get(rel_name)
+                    if relationship is None or relationship.lazy == "dynamic":
+                        continue
+                    unloaded = [parent for parent in cls_parents if rel_name not in parent.__dict__]
+                    fetched = _prefetch(f"{parent_cls}.{rel_name}", unloaded, lambda: fetch_related(parent_cls, rel_name, unloaded)) if unloaded else {}
+                    if fetched is None:
+                        continue
+                    for parent in unloaded:
+                        items, _ = fetched.get(sqlalchemy.inspect(parent).identity, ([], 0))
+                        set_committed_value(parent, rel_name, items if relationship.uselist else (items[0] if items else None))
+                    if subtree[rel_name]:
+                        children = []
+                        for parent in cls_parents:
+                            value = parent.__dict__.get(rel_name)
+                            children += list(value) if relationship.uselist else [value]
+                        next_level.append(([child for child in children if child is not None], subtree[rel_name]))
+        level = next_level
+
+
+def get_prefetched(instance: Any, rel_name: str) -> Optional[tuple[list[Any], int]]:
+    """
+    :param instance: SAFRSBase instance
+    :param rel_name: relationship name
+    :return: (related instances, total count) loaded by `prefetch_included` or None
+    """
+    if not has_request_context():
+        return None
+    related = getattr(g, "ja_related", None)
+    if not related:
+        return None
+    prefetched = related.get((type(instance), rel_name))
+    if prefetched is None:
+        return None
+    identity = sqlalchemy.inspect(instance).identity
+    return prefetched.get(identity)
@@ -59,12 +59,15 @@ def parse_content_type(self: Any) -> Any:
         self.is_jsonapi = True
         self.parameter_storage_class = TypeConversionDict
 
+        # the extensions of this request, the class attribute is shared by all requests
+        self._extensions = set()
         extensions = self.content_type.split(";")[1:]
         for ext in extensions:
-            parsed_ext = ext.strip().split("=")
+            parsed_ext = ext.strip().split("=", 1)
             if parsed_ext[0] == "ext" and parsed_ext[1:]:
-                ext_name = parsed_ext[1]
-                self._extensions.add(ext_name)
+                # the ext parameter is a (quoted) space-separated list of extension URIs
+                for ext_name in parsed_ext[1].strip('"').split():
+                    self._extensions.add(ext_name)
 
     @property
     def page_offset(self: Any) -> Any:
@@ -91,9 +94,9 @@ def get_page_offset(self: Any, rel_name: Any) -> Any:
         :return: page offset for included resources
         """
         page_offset = self.args.get(f"page[{rel_name}][offset]", 0, type=int)
-        if page_offset == 0 and "page[{rel_name}][number]" in self.args and "page[{rel_name}][size]" in self.args:
-            page_size = self.args.get("page[{rel_name}][size]", type=int)
-            page_number = self.args.get("page[{rel_name}][number]", type=int) - 1
+        if page_offset == 0 and f"page[{rel_name}][number]" in self.args and f"page[{rel_name}][size]" in self.args:
+            page_size = self.args.get(f"page[{rel_name}][size]", type=int)
+            page_number = self.args.get(f"page[{rel_name}][number]", type=int) - 1
             page_offset = page_number * page_size
         return page_offset
 
@@ -109,10 +112,24 @@ def page_limit(self: Any) -> Any:
             return self.args.get("page[size]", type=int)
         return page_limit
 
+    @property
+    def page_after(self: Any) -> Any:
+        """
+        :return: page[after] cursor for keyset pagination (cfr. keyset.py), None if not requested
+        """
+        return self.args.get("page[after]", None)
+
+    @property
+    def page_before(self: Any) -> Any:
+        """
+        :return: page[before] cursor for keyset pagination (cfr. keyset.py), None if not requested
+        """
+        return self.args.get("page[before]", None)
+
     def get_page_limit(self: Any, rel_name: Any) -> Any:
         page_limit = self.args.get(f"page[{rel_name}][limit]", self.page_limit, type=int)
-        if "page[{rel_name}][number]" in self.args and "page[{rel_name}][size]" in self.args:
-            return self.args.get("page[{rel_name}][size]", type=int)
+        if f"page[{rel_name}][number]" in self.args and f"page[{rel_name}][size]" in self.args:
+            return self.args.get(f"page[{rel_name}][size]", type=int)
         return page_limit
 
     @property
@@ -122,6 +139,13 @@ def is_bulk(self: Any) -> Any:
         """
         return "bulk" in self._extensions
 
+    @property
+    def is_atomic(self: Any) -> Any:
+        """
+        jsonapi atomic operations extension, https://jsonapi.org/ext/atomic/
+        """
+        return "atomic" in self._extensions or "https://jsonapi.org/ext/atomic" in self._extensions
+
     def get_jsonapi_payload(self: Any) -> Any:
         """
         :return: jsonapi request payload
@@ -0,0 +1,170 @@
+# In-process GET response cache
+#
+# When SAFRSConfig.response_cache (or the RESPONSE_CACHE setting) is enabled, the serialized
+# GET responses of SAFRSRestAPI and SAFRSRestRelationshipAPI are cached in memory.
+# The cache key consists of the normalized path and the sorted query arguments
+# (and the Authorization and Cookie headers, responses may depend on the user, eg. with session cookies).
+#
+# Every entry records the generations (cfr. conditional.py) of the models whose instances may
+# appear in the response: the requested model, its related models and the models reached through include=.
+# Writes (_s_post, _s_patch, _s_delete, relationship updates and flushes) bump the generation of the
+# modified models, so the affected entries are invalidated when they're looked up.
+#
+# The least recently used entries are evicted when the total size exceeds RESPONSE_CACHE_BYTES.
+# The hit and miss counters are available with `get_response_cache().stats()`
+#
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+from flask import current_app, request
+from werkzeug.datastructures import MultiDict
+import safrs
+from .config import get_config
+from .conditional import dependent_models, get_generation
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses with a byte budget
+    """
+
+    def __init__(self: Any, max_bytes: int) -> None:
+        """
+        :param max_bytes: max. total size of the cached response bodies
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Any, tuple[tuple[int, ...], tuple[Any, ...], bytes, int, dict[str, str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self: Any, key: Any, models: tuple[Any, ...]) -> Optional[tuple[bytes, int, dict[str, str]]]:
+        """
+        :param key: cache key
+        :param models: the models the response depends on
+        :return: (body, status, headers) or None if not cached or if the entry is stale
+        """
+        generations = tuple(get_generation(model) for model in models)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[:2] == (generations, models):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2], entry[3], entry[4]
+            if entry is not None:
+                # one of the models was modified
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def put(self: Any, key: Any, models: tuple[Any, ...], generations: tuple[int, ...], body: bytes, status: int, headers: dict[str, str]) -> None:
+        """
+        :param key: cache key
+        :param models: the models the response depends on
+        :param generations: the generations of `models` before the response was generated
+        :param body: response body
+        :param status: response status code
+        :param headers: response headers
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generations, models, body, status, headers)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self: Any, key: Any) -> None:
+        entry = self._entries.pop(key)
+        self.size -= len(entry[2])
+
+    def clear(self: Any) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self: Any) -> dict[str, Any]:
+        """
+        :return: cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "miss_ratio": self.misses / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    :return: the process-wide ResponseCache
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(int(get_config("RESPONSE_CACHE_BYTES")))
+    return _response_cache
+
+
+def cache_key(request: Any) -> tuple[Any, ...]:
+    """
+    :param request: the current request
+    :return: path, sorted query arguments and the Authorization and Cookie headers
+    """
+    # all the values of repeated arguments, jsonapi requests parse the arguments into a TypeConversionDict instead of a MultiDict
+    items = request.args.items(multi=True) if isinstance(request.args, MultiDict) else request.args.items()
+    args = tuple(sorted(items))
+    return request.path, args, request.headers.get("Authorization"), request.headers.get("Cookie")
+
+
+def response_models(model: Any, request: Any, *related: Any) -> tuple[Any, ...]:
+    """
+    :param model: the requested SAFRSBase subclass
+    :param request: the current request
+    :param related: other models the response depends on (eg. the parent of a relationship)
+    :return: the models whose instances may appear in the response
+    """
+    include_csv = request.args.get("include", safrs.SAFRS.DEFAULT_INCLUDED)
+    return tuple(dict.fromkeys(dependent_models(model, include_csv) + list(related)))
+
+
+def cached_response(model: Any, generate: Any, *related: Any) -> Any:
+    """
+    Return the cached GET response or generate (and cache) it
+
+    :param model: the requested SAFRSBase subclass
+    :param generate: callable that creates the flask response
+    :param related: other models the response depends on
+    :return: flask response
+    """
+    if not model._s_response_cache:
+        return generate()
+    cache = get_response_cache()
+    key = cache_key(request)
+    models = response_models(model, request, *related)
+    cached = cache.get(key, models)
+    if cached is not None:
+        body, status, headers = cached
+        return current_app.response_class(body, status=status, headers=headers)
+    # the generations before the response is generated: the entry is stale if they change meanwhile
+    generations = tuple(get_generation(cls) for cls in models)
+    response = generate()
+    if response.status_code == 200 and not response.is_streamed:
+        headers = {name: value for name, value in response.headers.items() if name.lower() != "set-cookie"}
+        cache.put(key, models, generations, response.get_data(), response.status_code, headers)
+    return response
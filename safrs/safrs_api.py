@@ -2,6 +2,7 @@
 from http import HTTPStatus
 import logging
 import inspect
+import threading
 import werkzeug
 from flask_restful import abort, Resource
 from flask_restful.representations.json import output_json
@@ -11,12 +12,16 @@
 from flask_restful_swagger_2 import validate_definitions_object, parse_method_doc
 from flask_restful_swagger_2 import validate_path_item_object, Schema
 from flask_restful_swagger_2 import extract_swagger_path, Extractor, ValidationError as FRSValidationError
+from flask_restful_swagger_2.swagger import create_swagger_endpoint
 from flask import request
 from functools import wraps
 import safrs
 from .swagger_doc import swagger_doc, swagger_method_doc, default_paging_parameters
-from .swagger_doc import parse_object_doc, swagger_relationship_doc, get_http_methods
+from .swagger_doc import parse_object_doc, swagger_relationship_doc, get_http_methods, sample_id
+from .swagger_doc import _ensure_relationship_swagger_attrs
 from .errors import JsonapiError, SystemValidationError, GenericError
+from .conditional import is_not_modified
+from .spec_cache import SpecSnapshot, load_snapshot, save_snapshot, schema_fingerprint
 from .config import get_config
 from .json_encoder import SAFRSJSONProvider, SAFRSJSONEncoder
 from ._safrs_relationship import SAFRSRelationshipObject
@@ -29,6 +34,22 @@
 
 HTTP_METHODS = ["GET", "POST", "PATCH", "DELETE", "PUT"]
 DEFAULT_REPRESENTATIONS = [("application/vnd.api+json", output_json)]
+# configuration settings that affect the swagger spec, part of the spec snapshot fingerprint
+SPEC_SETTINGS = (
+    "OBJECT_ID_SUFFIX",
+    "RESOURCE_URL_FMT",
+    "INSTANCE_URL_FMT",
+    "INSTANCEMETHOD_URL_FMT",
+    "CLASSMETHOD_URL_FMT",
+    "RELATIONSHIP_URL_FMT",
+    "ENDPOINT_FMT",
+    "INSTANCE_ENDPOINT_FMT",
+    "DEFAULT_PAGE_LIMIT",
+    "MAX_PAGE_LIMIT",
+    "ENABLE_RELATIONSHIPS",
+    "ENABLE_METHODS",
+    "DEFAULT_INCLUDED",
+)
 
 
 class SAFRSAPI(FRSApiBase):
@@ -69,9 +90,19 @@ def __init__(self: Any, app: Flask, host: str='localhost', port: int=5000, prefi
         if port:
             host = f"{host}:{port}"
 
+        # the swagger documentation of the exposed resources is generated by build_spec
+        self._spec_builders: list[Callable[[], None]] = []
+        self._spec_lock = threading.Lock()
+        # exposed models and resources, used to compute the fingerprint of the spec snapshot (cfr. spec_cache.py)
+        self._spec_models: list[Any] = []
+        self._spec_resources: list[Any] = []
+        self._spec_snapshot: Optional[tuple[int, int, SpecSnapshot]] = None
+        api_spec_url = kwargs.pop("api_spec_url", "/swagger")
+        add_api_spec_resource = kwargs.pop("add_api_spec_resource", True)
         super().__init__(
             app,
-            api_spec_url=kwargs.pop("api_spec_url", "/swagger"),
+            api_spec_url=api_spec_url,
+            add_api_spec_resource=False,
             host=host,
             description=description,
             prefix=prefix,
@@ -82,15 +113,125 @@ def __init__(self: Any, app: Flask, host: str='localhost', port: int=5000, prefi
         app.json_encoder = SAFRSJSONEncoder  # type: ignore[attr-defined]  # deprecated, but used by the swaggerui blueprint
         self.init_app(app)
         self.representations = OrderedDict(DEFAULT_REPRESENTATIONS)
+        if add_api_spec_resource:
+            self.add_resource(self._swagger_endpoint(), f"{api_spec_url}.json", f"{api_spec_url}.html", endpoint="swagger")
         self.update_spec()
         SAFRSAPI.client_uri = host
+        self._atomic_models: Optional[dict[str, Any]] = None
+        if get_config("ATOMIC_OPERATIONS"):
+            self.expose_atomic_operations()
+
+    def expose_atomic_operations(self: Any, url: Optional[str] = None) -> None:
+        """
+        Expose the JSON:API atomic operations endpoint, the exposed objects can be modified with atomic operations
+        :param url: endpoint url, ATOMIC_URL by default
+        """
+        from .jsonapi import SAFRSAtomicAPI
+
+        url = url or cast(str, get_config("ATOMIC_URL"))
+        # every api has its own models
+        api_class = api_decorator(type("SAFRSAtomicAPI", (SAFRSAtomicAPI,), {"models": {}}), lambda x: x)
+        self._atomic_models = api_class.models
+        # the objects that have been exposed before the endpoint
+        for safrs_object in self._spec_models:
+            self._register_atomic_model(safrs_object)
+        safrs.log.info(f"Exposing atomic operations on {url}")
+        # the endpoint isn't documented in the swagger
+        # pylint: disable=bad-super-call
+        super(FRSApiBase, self).add_resource(api_class, url, endpoint="safrs_atomic_operations", methods=["POST"])
+
+    def _swagger_endpoint(self: Any) -> Any:
+        """
+        :return: the swagger.json resource, the spec is built when it's first requested
+        """
+        api = self
+
+        class SwaggerEndpoint(create_swagger_endpoint(self._swagger_object)):  # type: ignore[misc]
+            def get(self: Any) -> Any:
+                cache_dir = get_config("SPEC_CACHE_DIR")
+                if not cache_dir:
+                    api.build_spec()
+                    return super().get()
+                snapshot = api.spec_snapshot(str(cache_dir), super().get)
+                if is_not_modified(snapshot.etag, None, request.headers.get("If-None-Match"), None):
+                    return Response(status=HTTPStatus.NOT_MODIFIED, headers={"ETag": snapshot.etag})
+                return Response(snapshot.body, mimetype=api.default_mediatype, headers={"ETag": snapshot.etag})
+
+        return SwaggerEndpoint
+
+    def _spec_settings(self: Any) -> dict[str, Any]:
+        """
+        :return: the api properties and configuration settings that affect the swagger spec
+        """
+        settings = {name: get_config(name) for name in SPEC_SETTINGS}
+        settings["swagger"] = {key: self._swagger_object.get(key) for key in ("host", "basePath", "info")}
+        settings["custom_swagger"] = self._custom_swagger
+        settings["resources"] = self._spec_resources
+        return settings
+
+    def spec_snapshot(self: Any, cache_dir: str, render: Callable[[], Any]) -> SpecSnapshot:
+        """
+        Load the swagger spec snapshot of the exposed objects from `cache_dir`,
+        or generate and save it when no snapshot matches the current fingerprint.
+
+        :param cache_dir: SPEC_CACHE_DIR
+        :param render: function that returns the generated swagger.json
+        :return: snapshot
+        """
+        state = (len(self._spec_models), len(self._spec_resources))
+        if self._spec_snapshot is not None and self._spec_snapshot[:2] == state:
+            return self._spec_snapshot[2]
+        fingerprint = schema_fingerprint(self._spec_models, self._spec_settings())
+        snapshot = load_snapshot(cache_dir, "swagger", fingerprint)
+        if snapshot is None:
+            self.build_spec()
+            body = output_json(render(), HTTPStatus.OK).get_data()
+            snapshot = save_snapshot(cache_dir, "swagger", fingerprint, body)
+            safrs.log.info(f"Saved the swagger spec snapshot {fingerprint} in {cache_dir}")
+        self._spec_snapshot = (*state, snapshot)
+        return snapshot
 
     def update_spec(self: Any) -> None:
         """
         :param custom_swagger: swagger spec to be added to the swagger.json
         """
-        _swagger_doc = self.get_swagger_doc()
-        safrs.dict_merge(_swagger_doc, self._custom_swagger)
+        safrs.dict_merge(self._swagger_object, self._custom_swagger)
+
+    def get_swagger_doc(self: Any) -> Any:
+        """
+        :return: the swagger spec
+        """
+        return self.build_spec()
+
+    def build_spec(self: Any) -> dict[str, Any]:
+        """
+        Generate the swagger documentation of the objects that have been exposed since the previous call.
+        Exposing an object only registers the routes: the documentation of a large number of objects is expensive
+        to generate (the sample ids are queried from the database, the docstrings are parsed, ...),
+        so it's deferred until the swagger is requested, unless DEFERRED_SWAGGER is disabled.
+
+        This requires an app context.
+
+        :return: the swagger spec
+        """
+        with self._spec_lock:
+            if self._spec_builders:
+                builders, self._spec_builders = self._spec_builders, []
+                try:
+                    for builder in builders:
+                        builder()
+                finally:
+                    sample_id.cache_clear()
+                self.update_spec()
+        return self._swagger_object
+
+    def _defer_spec(self: Any, builder: Callable[[], None]) -> None:
+        """
+        :param builder: function that adds documentation to the swagger spec, called by build_spec
+        """
+        self._spec_builders.append(builder)
+        if not get_config("DEFERRED_SWAGGER"):
+            self.build_spec()
 
     def expose_object(self: Any, safrs_object: Any, url_prefix: Any='', **properties: Any) -> Any:
         """This methods creates the API url endpoints for the SAFRObjects
@@ -131,10 +272,10 @@ class Class_API(SAFRSRestAPI):
         RESOURCE_URL_FMT = cast(str, get_config("RESOURCE_URL_FMT"))  # configurable resource collection url formatter
         url = RESOURCE_URL_FMT.format(url_prefix, safrs_object._s_collection_name)
         swagger_decorator = swagger_doc(safrs_object) if self.swaggerui_blueprint else lambda x: x
-        api_class = api_decorator(type(api_class_name, (rest_api,), properties), swagger_decorator)
+        api_class = api_decorator(type(api_class_name, (rest_api,), properties), swagger_decorator, deferred=True)
 
         safrs.log.info(f"Exposing {safrs_object._s_collection_name} on {url}, endpoint: {endpoint}")
-        self.add_resource(api_class, url, endpoint=endpoint, methods=["GET", "POST"])
+        self.add_resource(api_class, url, endpoint=endpoint, methods=["GET", "POST", "PATCH", "DELETE"])
 
         INSTANCE_URL_FMT = cast(str, get_config("INSTANCE_URL_FMT"))
         url = INSTANCE_URL_FMT.format(url_prefix, safrs_object._s_collection_name, safrs_object.__name__)
@@ -142,9 +283,32 @@ class Class_API(SAFRSRestAPI):
 
         # Expose the instances
         safrs.log.info(f"Exposing {safrs_object._s_type} instances on {url}, endpoint: {endpoint}")
-        api_class = api_decorator(type(api_class_name + "_i", (rest_api,), properties), swagger_decorator)
+        api_class = api_decorator(type(api_class_name + "_i", (rest_api,), properties), swagger_decorator, deferred=True)
         self.add_resource(api_class, url, endpoint=endpoint, methods=["GET", "PATCH", "DELETE"])
+        self._defer_spec(lambda: self._document_tag(safrs_object))
+
+        for relationship in safrs_object._s_relationships.values():
+            self.expose_relationship(relationship, url, tags, properties)
 
+        self._defer_spec(self._document_definitions)
+        self._als_resources.append(safrs_object)
+        self._spec_models.append(safrs_object)
+        if self._atomic_models is not None:
+            self._register_atomic_model(safrs_object)
+
+    def _register_atomic_model(self: Any, safrs_object: Any) -> None:
+        """
+        Allow atomic operations on `safrs_object`
+        """
+        # the custom decorators (eg. authentication) of the object can't be applied to atomic operations
+        decorators = getattr(safrs_object, "custom_decorators", []) + getattr(safrs_object, "decorators", [])
+        if not decorators:
+            self._atomic_models[safrs_object._s_type] = safrs_object
+
+    def _document_tag(self: Any, safrs_object: Any) -> None:
+        """
+        Add the swagger tag of `safrs_object`, documented by the object docstring
+        """
         try:
             object_doc = parse_object_doc(safrs_object)
         except Exception as exc:
@@ -153,10 +317,10 @@ class Class_API(SAFRSRestAPI):
         object_doc["name"] = safrs_object._s_collection_name
         self._swagger_object["tags"].append(object_doc)
 
-        for relationship in safrs_object._s_relationships.values():
-            self.expose_relationship(relationship, url, tags, properties)
-
-        # add newly created schema references to the "definitions"
+    def _document_definitions(self: Any) -> None:
+        """
+        Add newly created schema references to the "definitions"
+        """
         for def_name, definition in Schema._references.items():
             if self._swagger_object["definitions"].get(def_name):
                 continue
@@ -167,9 +331,6 @@ class Class_API(SAFRSRestAPI):
                 continue
             self._swagger_object["definitions"][def_name] = {"properties": definition.properties}
 
-        self.update_spec()
-        self._als_resources.append(safrs_object)
-
     def expose(self: Any, *safrs_objects: Any, url_prefix: Any='', **properties: Any) -> Any:
         """
         Expose multiple objects at once
@@ -202,7 +363,7 @@ def expose_methods(self: Any, url_prefix: Any, tags: Any, safrs_object: Any, pro
             endpoint = ENDPOINT_FMT.format(url_prefix, safrs_object._s_collection_name + "." + method_name)
             swagger_decorator = swagger_method_doc(safrs_object, method_name, tags)
             properties.update({"method_name": method_name, "http_methods": safrs_object.http_methods})
-            api_class = api_decorator(type(api_method_class_name, (rpc_api,), properties), swagger_decorator)
+            api_class = api_decorator(type(api_method_class_name, (rpc_api,), properties), swagger_decorator, deferred=True)
             meth_name = safrs_object._s_class_name + "." + api_method.__name__
             safrs.log.info(f"Exposing method {meth_name} on {url}, endpoint: {endpoint}")
             self.add_resource(api_class, url, endpoint=endpoint, methods=get_http_methods(api_method), jsonapi_rpc=True)
@@ -278,8 +439,10 @@ class Parent_X_target_API(SAFRSRestRelationshipAPI):
 
         properties["SAFRSObject"] = rel_object
         properties["http_methods"] = target_object.http_methods
+        # the relationship documentation may set the url parameter names, this has to happen before the routes are added
+        _ensure_relationship_swagger_attrs(parent_class, target_object)
         swagger_decorator = swagger_relationship_doc(rel_object, tags)
-        api_class = api_decorator(type(api_class_name, (relationship_api,), properties), swagger_decorator)
+        api_class = api_decorator(type(api_class_name, (relationship_api,), properties), swagger_decorator, deferred=True)
 
         # Expose the relationship for the parent class:
         # GET requests to this endpoint retrieve all item ids
@@ -362,10 +525,6 @@ def _update_path_item_method(
         if not method_doc:
             return
 
-        collection_summary = method_doc.pop("collection_summary", method_doc.get("summary", None))
-        if not exposing_instance and collection_summary:
-            method_doc["summary"] = collection_summary
-
         path_item_method = cast(dict[str, Any], path_item.get(method))
         method_doc["operationId"] = self._get_operation_id(path_item_method.get("summary", ""))
 
@@ -398,6 +557,18 @@ def _build_swagger_path_item(
 
         swagger_url = extract_swagger_path(url)
         exposing_instance = self._is_exposing_instance(swagger_url, safrs_instance_suffix, relationship)
+        # the collection summaries (and the resulting operationIds) and request bodies differ from the instance ones,
+        # they're replaced before the path item is validated
+        for method_doc in path_item.values():
+            if not isinstance(method_doc, dict):
+                continue
+            collection_summary = method_doc.pop("collection_summary", None)
+            if not exposing_instance and collection_summary:
+                method_doc["summary"] = collection_summary
+            collection_body = method_doc.pop("collection_body", None)
+            if not exposing_instance and collection_body:
+                parameters = [param for param in method_doc.get("parameters", []) if param.get("in") != "body"]
+                method_doc["parameters"] = parameters + [collection_body]
         for method in self.get_resource_methods(resource):
             if not self._is_resource_method_allowed(method, methods):
                 path_item.pop(method, None)
@@ -437,14 +608,25 @@ def add_resource(self: Any, resource: Any, *urls: Any, **kwargs: Any) -> Any:
         We also have to filter out the unwanted parameters
         """
         relationship = kwargs.pop("relationship", False)  # relationship object
-        SAFRS_INSTANCE_SUFFIX = cast(str, get_config("OBJECT_ID_SUFFIX")) + "}"
         methods = kwargs.get("methods", None)
-
-        path_item: dict[str, Any] = {}
-        self._add_oas_resource_definitions(resource, path_item)
         is_jsonapi_rpc = kwargs.pop("jsonapi_rpc", False)  # check if the exposed method is a jsonapi_rpc method
         deprecated = kwargs.pop("deprecated", False)  # deprecated functionality: still working but not shown in swagger
 
+        self._defer_spec(lambda: self._document_resource(resource, urls, relationship, is_jsonapi_rpc, deprecated, methods))
+        self._spec_resources.append([resource.__name__, [str(url) for url in urls], methods, deprecated])
+        # disable API methods that were not set by the SAFRSObject
+        self._set_method_not_allowed_handlers(resource)
+        # pylint: disable=bad-super-call
+        super(FRSApiBase, self).add_resource(resource, *urls, **kwargs)
+
+    def _document_resource(self: Any, resource: Any, urls: Any, relationship: Any, is_jsonapi_rpc: bool, deprecated: bool, methods: Any) -> None:
+        """
+        Add the swagger path items of `resource` (called by build_spec)
+        """
+        document_methods(resource)
+        SAFRS_INSTANCE_SUFFIX = cast(str, get_config("OBJECT_ID_SUFFIX")) + "}"
+        path_item: dict[str, Any] = {}
+        self._add_oas_resource_definitions(resource, path_item)
         for url in urls:
             self._build_swagger_path_item(
                 resource,
@@ -457,11 +639,6 @@ def add_resource(self: Any, resource: Any, *urls: Any, **kwargs: Any) -> Any:
                 SAFRS_INSTANCE_SUFFIX,
             )
 
-        # disable API methods that were not set by the SAFRSObject
-        self._set_method_not_allowed_handlers(resource)
-        # pylint: disable=bad-super-call
-        super(FRSApiBase, self).add_resource(resource, *urls, **kwargs)
-
     def _add_oas_req_params(self: Any, resource: Any, path_item: Any, method: Any, exposing_instance: Any, is_jsonapi_rpc: Any, swagger_url: Any) -> Any:
         """
         Add the request parameters to the swagger (filter, sort)
@@ -490,6 +667,10 @@ def _add_oas_req_params(self: Any, resource: Any, path_item: Any, method: Any, e
                 parameters.append(param)
                 parameters += list(resource.get_swagger_filters())
 
+            if method == "delete" and not (exposing_instance or is_jsonapi_rpc):
+                # deleting from a collection requires a filter, cfr. SAFRSRestAPI._delete_collection
+                parameters += list(resource.get_swagger_filters())
+
             if not (parameter.get("in") == "path" and object_id not in swagger_url) and parameter not in parameters:
                 # Only if a path param is in path url then we add the param
                 parameters.append(parameter)
@@ -628,7 +809,36 @@ def get(self: Any) -> Any:
         return json.dumps(result, indent=4)
 
 
-def api_decorator(cls: Any, swagger_decorator: Any) -> Any:
+def _document_method(cls: Any, swagger_decorator: Any, method: Any) -> Any:
+    """
+    :return: `method` decorated with the swagger documentation
+    """
+    try:
+        # Add swagger documentation
+        return swagger_decorator(method)
+    except RecursionError:  # pragma: no cover
+        # Got this error when exposing WP DB, TODO: investigate where it comes from
+        safrs.log.error(f"Failed to generate documentation for {cls} {method} (Recursion Error)")
+    except Exception as exc:
+        safrs.log.exception(exc)
+        safrs.log.error(f"Failed to generate documentation for {method}")
+    return method
+
+
+def document_methods(cls: Any) -> None:
+    """
+    Generate the swagger documentation of the http methods of an api class that was decorated with `api_decorator(deferred=True)`
+    :param cls: decorated api class
+    """
+    swagger_decorator = getattr(cls, "_swagger_decorator", None)
+    for method_name, method in getattr(cls, "_swagger_methods", {}).items():
+        operation = getattr(_document_method(cls, swagger_decorator, method), "__swagger_operation_object", None)
+        if operation is not None:
+            setattr(getattr(cls, method_name), "__swagger_operation_object", operation)
+    cls._swagger_methods = {}
+
+
+def api_decorator(cls: Any, swagger_decorator: Any, deferred: bool = False) -> Any:
     """Decorator for the API views:
         - add swagger documentation ( swagger_decorator )
         - add cors
@@ -639,11 +849,14 @@ def api_decorator(cls: Any, swagger_decorator: Any) -> Any:
 
     :param cls: The class that will be decorated (e.g. SAFRSRestAPI, SAFRSRestRelationshipAPI)
     :param swagger_decorator: function that will generate the swagger
+    :param deferred: don't generate the swagger yet, it will be generated by `document_methods`
     :return: decorated class
     """
 
     cors_domain = get_config("cors_domain")
     cls.http_methods = {}  # holds overridden http methods, note: cls also has "methods" set, but it's not related to this
+    cls._swagger_decorator = swagger_decorator
+    cls._swagger_methods = {}  # methods to be documented by document_methods
     for method_name in [
         "patch",
         "post",
@@ -674,16 +887,10 @@ def api_decorator(cls: Any, swagger_decorator: Any) -> Any:
         setattr(decorated_method, "SAFRSObject", cls.SAFRSObject)
 
         if method_name != "options":
-            try:
-                # Add swagger documentation
-                decorated_method = swagger_decorator(decorated_method)
-            except RecursionError:  # pragma: no cover
-                # Got this error when exposing WP DB, TODO: investigate where it comes from
-                safrs.log.error(f"Failed to generate documentation for {cls} {decorated_method} (Recursion Error)")
-
-            except Exception as exc:
-                safrs.log.exception(exc)
-                safrs.log.error(f"Failed to generate documentation for {decorated_method}")
+            if deferred:
+                cls._swagger_methods[method_name] = decorated_method
+            else:
+                decorated_method = _document_method(cls, swagger_decorator, decorated_method)
 
             # The user can add custom decorators
             # Apply the custom decorators, specified as class variable list
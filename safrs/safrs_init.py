@@ -2,11 +2,12 @@
 import os
 import sys
 from flask_swagger_ui import get_swaggerui_blueprint
-from flask import Flask, g
+from flask import Flask, g, request
 from flask_sqlalchemy import SQLAlchemy
 from .request import SAFRSRequest
 from .response import SAFRSResponse
 from .jsonapi_filters import FilteringStrategy
+from .timing import start_request_timing, finish_request_timing
 from functools import wraps
 import safrs
 import flask.app
@@ -69,6 +70,20 @@ class SAFRS:
     filtering_strategy = FilteringStrategy()
 
     OPTIMIZED_LOADING = True
+    STREAM_COLLECTIONS = False  # stream collection responses for all models (can also be enabled per model with SAFRSConfig.stream)
+    STREAM_YIELD_PER = 1000  # number of rows fetched and serialized at once when streaming
+    COUNT_STRATEGY = "exact"  # collection count strategy: "exact", "cached", "estimated" or "none", cfr. count_strategy.py
+    CONDITIONAL_GET = False  # ETag/Last-Modified headers and 304 responses for all models (can also be enabled per model with SAFRSConfig.conditional_get)
+    RESPONSE_CACHE = False  # in-memory GET response cache for all models (can also be enabled per model with SAFRSConfig.response_cache)
+    RESPONSE_CACHE_BYTES = 64 * 2**20  # max. total size of the cached responses, cfr. response_cache.py
+    BULK_CREATE = True  # insert the items of a bulk POST in batches and commit once, cfr. bulk.py
+    BULK_CREATE_BATCH_SIZE = 1000  # number of rows per bulk INSERT statement
+    ATOMIC_OPERATIONS = False  # expose the JSON:API atomic operations endpoint, cfr. atomic.py
+    ATOMIC_URL = "/operations"  # url of the atomic operations endpoint (relative to the api prefix)
+    DEFERRED_SWAGGER = True  # generate the swagger when it's first requested instead of when the objects are exposed, cfr. SAFRSAPI.build_spec
+    SPEC_CACHE_DIR = None  # directory where the generated swagger spec is saved and loaded by other processes with the same models, cfr. spec_cache.py
+    SERVER_TIMING = False  # measure the phases of the requests and add a Server-Timing header, cfr. timing.py
+    JSON_BACKEND = "json"  # json serialization backend: "json", "orjson" or "auto" (orjson if installed), cfr. json_backend.py
 
     def __init__(self: Any, app: flask.app.Flask, *args: Any, **kwargs: Any) -> None:
         """
@@ -120,6 +135,20 @@ def init_ja_data() -> Any:
             # ja_included holds all included instances
             g.ja_data = set()
             g.ja_included = set()
+            # relationships and linkage prefetched by relationship_loader.py
+            g.ja_related = {}
+            g.ja_linkage = {}
+
+        @app.before_request
+        def start_timing() -> Any:
+            g.safrs_timing = start_request_timing(request.method, request.path)
+
+        @app.after_request
+        def finish_timing(response: Any) -> Any:
+            token = g.pop("safrs_timing", None)
+            if token is not None:
+                finish_request_timing(token, response.headers)
+            return response
 
         # pylint: disable=unused-argument,unused-variable
         @app.teardown_appcontext
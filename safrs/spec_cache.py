@@ -0,0 +1,175 @@
+# Persisted swagger/openapi spec snapshots
+#
+# Generating the spec of a large number of models is expensive and every process (eg. every gunicorn worker
+# and every pod) generates the same document. When the SPEC_CACHE_DIR setting is set, the generated spec is
+# serialized once and written to a snapshot file in this directory. The file name contains a fingerprint of the
+# exposed models (columns, relationships, jsonapi_rpc methods, docstrings) and the settings that affect the spec,
+# processes with the same fingerprint load the serialized bytes instead of generating the spec.
+# The snapshot is served with a strong ETag (the hash of the bytes), so clients can revalidate with If-None-Match.
+#
+# The snapshot files are never invalidated: a model or settings change results in a different fingerprint,
+# and thus in a new file. Note that the sample ids in the spec are queried when the snapshot is generated.
+#
+# `verify_snapshot` compares a snapshot with a freshly generated spec (cfr. safrs.fastapi.openapi.diff).
+#
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Optional
+
+import sqlalchemy
+import safrs
+from .jsonapi_attr import is_jsonapi_attr
+from .swagger_doc import get_doc, get_http_methods
+
+# custom (safrs) column attributes that are used to generate the spec
+COLUMN_DOC_ATTRS = ("description", "sample", "swagger_type", "format", "filterable", "name_format", "required", "default_filter", "expose")
+
+
+def _column_signature(column: Any) -> dict[str, Any]:
+    """
+    :param column: sqla column
+    :return: the properties of `column` that appear in the spec
+    """
+    result = {
+        "name": column.name,
+        "type": repr(column.type),
+        "nullable": column.nullable,
+        "primary_key": column.primary_key,
+        "foreign_keys": sorted(fk.target_fullname for fk in column.foreign_keys),
+    }
+    for attr_name in COLUMN_DOC_ATTRS:
+        if hasattr(column, attr_name):
+            result[attr_name] = getattr(column, attr_name)
+    return result
+
+
+def model_signature(model: Any) -> dict[str, Any]:
+    """
+    :param model: SAFRSBase subclass
+    :return: json serializable description of the `model` properties that are used to generate the spec
+    """
+    mapper = sqlalchemy.inspect(model)
+    jsonapi_attrs = {}
+    for attr_name, attr in model._s_jsonapi_attrs.items():
+        jsonapi_attrs[attr_name] = attr.__doc__ if is_jsonapi_attr(attr) else getattr(attr, "key", attr_name)
+    rpc_methods = []
+    for method in model._s_get_jsonapi_rpc_methods():
+        rpc_methods.append([method.__name__, get_http_methods(method), get_doc(method), method.__doc__])
+    return {
+        "name": model.__name__,
+        "doc": model.__doc__,
+        "type": model._s_type,
+        "collection": model._s_collection_name,
+        "object_id": model._s_object_id,
+        "http_methods": sorted(model.http_methods),
+        "allow_client_generated_ids": getattr(model, "allow_client_generated_ids", False),
+        "columns": [_column_signature(column) for column in mapper.columns],
+        "relationships": [
+            [rel.key, rel.direction.name, rel.mapper.class_.__name__, rel.uselist] for rel in model._s_relationships.values()
+        ],
+        "jsonapi_attrs": jsonapi_attrs,
+        "rpc_methods": sorted(rpc_methods, key=lambda method: method[0]),
+    }
+
+
+def schema_fingerprint(models: list[Any], settings: Any) -> str:
+    """
+    :param models: exposed SAFRSBase subclasses
+    :param settings: json serializable settings that affect the spec (urls, config, ...)
+    :return: fingerprint of the spec generated for these models and settings
+    """
+    signature = {
+        "safrs": safrs.__version__,
+        "models": [model_signature(model) for model in models],
+        "settings": settings,
+    }
+    data = json.dumps(signature, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class SpecSnapshot:
+    """
+    Serialized spec with its ETag
+    """
+
+    def __init__(self: Any, body: bytes, fingerprint: str) -> None:
+        self.body = body
+        self.fingerprint = fingerprint
+        self.etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+
+    @property
+    def spec(self: Any) -> dict[str, Any]:
+        """
+        :return: the deserialized spec
+        """
+        return json.loads(self.body)
+
+
+def snapshot_path(cache_dir: str, name: str, fingerprint: str) -> str:
+    """
+    :param cache_dir: SPEC_CACHE_DIR
+    :param name: name of the spec, eg. "swagger"
+    :param fingerprint: schema fingerprint
+    :return: path of the snapshot file
+    """
+    return os.path.join(cache_dir, f"{name}-{fingerprint}.json")
+
+
+def load_snapshot(cache_dir: str, name: str, fingerprint: str) -> Optional[SpecSnapshot]:
+    """
+    :return: the snapshot with this fingerprint or None if it hasn't been saved yet
+    """
+    try:
+        with open(snapshot_path(cache_dir, name, fingerprint), "rb") as snapshot_file:
+            body = snapshot_file.read()
+    except OSError:
+        return None
+    safrs.log.debug(f"Loaded {name} spec snapshot {fingerprint}")
+    return SpecSnapshot(body, fingerprint)
+
+
+def save_snapshot(cache_dir: str, name: str, fingerprint: str, body: bytes) -> SpecSnapshot:
+    """
+    Write the serialized spec to the snapshot file.
+    If another process saved the snapshot first, its bytes are used,
+    so all processes serve the same document (with the same ETag)
+
+    :param body: serialized spec
+    :return: snapshot
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{name}-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(body)
+            # hard link: fails if the snapshot exists, the file is never overwritten
+            os.link(tmp_path, snapshot_path(cache_dir, name, fingerprint))
+        finally:
+            os.unlink(tmp_path)
+    except FileExistsError:
+        safrs.log.debug(f"The {name} spec snapshot {fingerprint} was saved by another process")
+    except OSError as exc:
+        safrs.log.warning(f"Failed to save the {name} spec snapshot in {cache_dir}: {exc}")
+        return SpecSnapshot(body, fingerprint)
+    return load_snapshot(cache_dir, name, fingerprint) or SpecSnapshot(body, fingerprint)
+
+
+def verify_snapshot(snapshot: SpecSnapshot, spec: dict[str, Any]) -> dict[str, Any]:
+    """
+    Compare a snapshot with a freshly generated spec (eg. in a test or a deployment check)
+
+    :param snapshot: snapshot
+    :param spec: generated swagger or openapi spec
+    :return: diff report (cfr. safrs.fastapi.openapi.diff_openapi_documents), all the report lists are empty if the snapshot matches
+    """
+    # imported here because the safrs.fastapi package requires fastapi
+    from .fastapi.openapi.diff import diff_openapi_documents
+
+    snapshot_spec = snapshot.spec
+    report = diff_openapi_documents(spec, snapshot_spec)
+    extra = diff_openapi_documents(snapshot_spec, spec)
+    report["extra_tags"] = extra["missing_tags"]
+    return report
@@ -2,10 +2,12 @@
 # # Functions for api documentation: these decorators generate the swagger schemas
 # This should evolve to a more declarative version in the future with templates
 #
+import copy
 import inspect
 import datetime
 import json
 import flask
+from functools import lru_cache
 from http import HTTPStatus
 import yaml  # type: ignore[import-untyped]
 from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOMANY, MANYTOONE
@@ -37,6 +39,21 @@
 Schema._references = {}
 
 
+@lru_cache(maxsize=1024)
+def _load_doc(raw_doc: str) -> Any:
+    """
+    :param raw_doc: yaml part of a docstring
+    :return: parsed yaml, the same docstrings are used for the methods of all exposed objects
+    """
+    try:
+        return yaml.safe_load(raw_doc)
+    except (SyntaxError, yaml.scanner.ScannerError) as exc:
+        safrs.log.error(f"Failed to parse documentation {raw_doc} ({exc})")
+        return {"description": raw_doc}
+    except Exception:
+        raise SystemValidationError("Failed to parse api doc")
+
+
 # pylint: disable=redefined-builtin,line-too-long,protected-access,logging-format-interpolation
 def parse_object_doc(object: Callable) -> dict[str, Any]:
     """
@@ -45,22 +62,24 @@ def parse_object_doc(object: Callable) -> dict[str, Any]:
     api_doc = {}
     obj_doc = str(inspect.getdoc(object))
     raw_doc = obj_doc.split(DOC_DELIMITER)[0]
-    yaml_doc = None
-
-    try:
-        yaml_doc = yaml.safe_load(raw_doc)
-    except (SyntaxError, yaml.scanner.ScannerError) as exc:
-        safrs.log.error(f"Failed to parse documentation {raw_doc} ({exc})")
-        yaml_doc = {"description": raw_doc}
-    except Exception:
-        raise SystemValidationError("Failed to parse api doc")
+    yaml_doc = _load_doc(raw_doc)
 
     if isinstance(yaml_doc, dict):
-        api_doc.update(yaml_doc)
+        # the documentation is modified by the callers
+        api_doc.update(copy.deepcopy(yaml_doc))
 
     return api_doc
 
 
+@lru_cache(maxsize=None)
+def sample_id(cls: Any) -> Any:
+    """
+    :param cls: SAFRSBase subclass
+    :return: `cls._s_sample_id()`, this queries the database so it's memoized while the swagger is built (cfr. SAFRSAPI.build_spec)
+    """
+    return cls._s_sample_id()
+
+
 def jsonapi_rpc(http_methods: Optional[List[str]] = None, valid_jsonapi: bool = True) -> Callable:
     """
     Decorator to expose functions in the REST API:
@@ -349,7 +368,7 @@ def swagger_doc_gen(func: Any, instance: Any=False) -> Any:
         """
         Decorator used to document SAFRSRestAPI HTTP methods exposed in the API
         """
-        default_id = cls._s_sample_id()
+        default_id = sample_id(cls)
         class_name = cls.__name__
         collection_name = cls._s_collection_name
         http_method = func.__name__.lower()
@@ -386,7 +405,7 @@ def swagger_doc_gen(func: Any, instance: Any=False) -> Any:
         sample_dict = cls._s_sample_dict()
 
         # Samples with "id" are used for GET and PATCH
-        sample_instance = {"attributes": sample_dict, "type": cls._s_type, "id": cls._s_sample_id()}
+        sample_instance = {"attributes": sample_dict, "type": cls._s_type, "id": sample_id(cls)}
 
         if http_method == "get":
             sample_rels: dict[str, Any] = {}
@@ -410,6 +429,8 @@ def swagger_doc_gen(func: Any, instance: Any=False) -> Any:
             responses[HTTPStatus.OK.value] = {"schema": coll_sample_data, "description": HTTPStatus.OK.description}
 
         elif http_method == "patch":
+            # the collection summary results in a distinct operationId for bulk updates
+            doc["collection_summary"] = f"Update a collection of {class_name} objects"
             post_model, responses = cls._s_get_swagger_doc(http_method)
             parameters.append(
                 {
@@ -421,6 +442,14 @@ def swagger_doc_gen(func: Any, instance: Any=False) -> Any:
                 }
             )
             responses[HTTPStatus.OK.value] = {"schema": inst_sample_data, "description": HTTPStatus.OK.description}
+            # a PATCH to the collection updates a list of instances (bulk update)
+            doc["collection_body"] = {
+                "name": "PATCH body",
+                "in": "body",
+                "description": f"{class_name} attributes (list of {class_name} objects)",
+                "schema": coll_sample_data,
+                "required": True,
+            }
 
         elif http_method == "post":
             _, responses = cls._s_get_swagger_doc(http_method)
@@ -443,6 +472,7 @@ def swagger_doc_gen(func: Any, instance: Any=False) -> Any:
             responses[HTTPStatus.CREATED.value] = {"schema": inst_sample_data, "description": HTTPStatus.CREATED.description}
 
         elif http_method == "delete":
+            doc["collection_summary"] = f"Delete a collection of {class_name} objects"
             _, responses = cls._s_get_swagger_doc(http_method)
         elif http_method != "options":
             # one of 'options', 'head', 'delete'
@@ -483,7 +513,7 @@ def _relationship_parameters(parent_class: Any, child_class: Any, class_name: st
             "name": parent_class._s_object_id,
             "in": "path",
             "type": "string",
-            "default": parent_class._s_sample_id(),
+            "default": sample_id(parent_class),
             "description": f"{parent_class.__name__} item",
             "required": True,
         },
@@ -491,7 +521,7 @@ def _relationship_parameters(parent_class: Any, child_class: Any, class_name: st
             "name": child_class._s_object_id,
             "in": "path",
             "type": "string",
-            "default": child_class._s_sample_id(),
+            "default": sample_id(child_class),
             "description": f"{class_name} item",
             "required": True,
         },
@@ -505,7 +535,7 @@ def _relationship_model_name(relationship: Any, class_name: str) -> str:
 
 
 def _relationship_data_payload(relationship: Any, child_class: Any) -> Any:
-    data: Any = {"type": child_class._s_type, "id": child_class._s_sample_id()}
+    data: Any = {"type": child_class._s_type, "id": sample_id(child_class)}
     if relationship.direction in (ONETOMANY, MANYTOMANY):
         return [data]
     return data
@@ -648,7 +678,7 @@ def swagger_doc_gen(func: Any) -> Any:
             parameters.append({"name": model_name, "in": "body", "description": description, "schema": param_model, "required": True})
 
         # URL Path Parameter
-        default_id = cls._s_sample_id()
+        default_id = sample_id(cls)
         parameters.append(
             {"name": cls._s_object_id, "in": "path", "type": "string", "default": default_id, "required": True}
         )  # parameter id, e.g. UserId
@@ -688,6 +718,16 @@ def default_paging_parameters() -> list[dict[str, Any]]:
         "description": "Max number of items",
     }
     parameters.append(param)
+
+    for cursor_arg, description in (("page[after]", "next"), ("page[before]", "previous")):
+        param = {
+            "type": "string",
+            "name": cursor_arg,
+            "in": "query",
+            "required": False,
+            "description": f"Page cursor from the {description} link (keyset pagination)",
+        }
+        parameters.append(param)
     return parameters
 
 
@@ -0,0 +1,148 @@
+# Per-request phase timing
+#
+# When the SERVER_TIMING setting is enabled or when a callback is registered with `register_timing_callback`,
+# the durations of the phases of the GET requests are measured:
+# - filter: jsonapi_filter (building the filter query or filtering a list)
+# - sort: jsonapi_sort
+# - count: the collection count
+# - paginate: the execution of the (paginated) query
+# - include: fetching the included instances and the relationship linkage
+# - attributes: the serialization of the jsonapi attributes (_s_jsonapi_attrs), summed over all instances
+# - query: the retrieval of a single instance
+# - encode: the json encoding of the response document
+# Phases may be nested, eg. the attributes of the flask responses are serialized while the document is encoded,
+# the included instances of the fastapi responses are serialized while they're fetched.
+# and they're added to the response in a Server-Timing header (https://www.w3.org/TR/server-timing/), eg.
+#   Server-Timing: filter;dur=0.12, sort;dur=0.05, count;dur=1.30, paginate;dur=4.21, encode;dur=2.02, total;dur=8.10
+# (durations in milliseconds). The registered callbacks are called with the RequestTimings when the request is finished.
+#
+# The timings are kept in a ContextVar, when timing is disabled `timed` returns a no-op context manager.
+#
+import contextlib
+import time
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Optional, cast
+
+import safrs
+from .config import get_config
+
+# timing callbacks, called with the RequestTimings of every request
+_callbacks: list[Callable[["RequestTimings"], None]] = []
+NOT_TIMED = contextlib.nullcontext()
+
+
+class RequestTimings:
+    """
+    The phase durations (in seconds) of a request
+    """
+
+    def __init__(self: Any, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.phases: dict[str, float] = {}
+        self.start = time.perf_counter()
+        self.total = 0.0
+
+    def add(self: Any, phase: str, duration: float) -> None:
+        """
+        :param phase: phase name, the durations of a phase are summed
+        :param duration: seconds
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def server_timing(self: Any) -> str:
+        """
+        :return: Server-Timing header value
+        """
+        metrics = [f"{phase};dur={duration * 1000:.2f}" for phase, duration in self.phases.items()]
+        metrics.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("safrs_request_timings", default=None)
+
+
+class _Timer:
+    """
+    Adds the duration of the `with` block to the timings of the current request
+    """
+
+    __slots__ = ("timings", "phase", "start")
+
+    def __init__(self: Any, timings: RequestTimings, phase: str) -> None:
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self: Any) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self: Any, *exc_info: Any) -> None:
+        self.timings.add(self.phase, time.perf_counter() - self.start)
+
+
+def timed(phase: str) -> Any:
+    """
+    :param phase: phase name
+    :return: context manager that measures the duration of `phase` (a no-op when the request isn't timed)
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return NOT_TIMED
+    return _Timer(timings, phase)
+
+
+def register_timing_callback(callback: Callable[[RequestTimings], None]) -> None:
+    """
+    Register a callback that will be called with the RequestTimings of every request (this enables the timing)
+
+    :param callback: function that takes a RequestTimings argument
+    """
+    _callbacks.append(callback)
+
+
+def unregister_timing_callback(callback: Callable[[RequestTimings], None]) -> None:
+    """
+    :param callback: previously registered callback
+    """
+    _callbacks.remove(callback)
+
+
+def timing_enabled() -> bool:
+    """
+    :return: True if the requests have to be timed
+    """
+    return bool(_callbacks) or bool(get_config("SERVER_TIMING"))
+
+
+def start_request_timing(method: str, path: str) -> Optional[Token[Optional[RequestTimings]]]:
+    """
+    Start timing the current request
+
+    :param method: http method
+    :param path: request path
+    :return: token to pass to finish_request_timing, None if timing is disabled
+    """
+    if not timing_enabled():
+        return None
+    return _request_timings.set(RequestTimings(method, path))
+
+
+def finish_request_timing(token: Token[Optional[RequestTimings]], headers: Any = None) -> RequestTimings:
+    """
+    Stop timing the current request, add the Server-Timing header and call the timing callbacks
+
+    :param token: result of start_request_timing
+    :param headers: response headers or None if there's no response
+    :return: timings
+    """
+    timings = cast(RequestTimings, _request_timings.get())
+    _request_timings.reset(token)
+    timings.total = time.perf_counter() - timings.start
+    if headers is not None and get_config("SERVER_TIMING"):
+        headers["Server-Timing"] = timings.server_timing()
+    for callback in _callbacks:
+        try:
+            callback(timings)
+        except Exception as exc:
+            safrs.log.exception(f"Timing callback {callback} failed: {exc}")
+    return timings
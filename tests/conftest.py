@@ -0,0 +1,106 @@
+"""
+Fixtures for the request tests:
+the `make_app` fixture creates a flask app with an in-memory sqlite db that exposes the models in models.py,
+the safrs settings passed to `make_app` are restored after the test
+"""
+import decimal
+import pytest
+from flask import Flask
+from sqlalchemy import event
+import safrs
+from safrs import SAFRSAPI
+from safrs.config import get_config
+from safrs.count_strategy import clear_count_cache
+from safrs.response_cache import get_response_cache
+from models import Book, Person, db
+
+JSONAPI_HEADERS = {"Content-Type": "application/vnd.api+json"}
+ATOMIC_HEADERS = {"Content-Type": 'application/vnd.api+json; ext="https://jsonapi.org/ext/atomic"'}
+
+
+def normalized(document):
+    """
+    :return: the jsonapi document with the included resources in a fixed order
+    """
+    document["included"] = sorted(document.get("included", []), key=lambda item: (item["type"], item["id"]))
+    return document
+
+
+def seed(n_people, books_per):
+    """
+    Add `n_people` people with `books_per` books each, the first person is friends with the next two
+    """
+    people = [Person(name=f"p{i}", email=f"p{i}@x.org", price=decimal.Decimal("1.50"), blob=b"\x01\x02") for i in range(n_people)]
+    for i, person in enumerate(people):
+        db.session.add(person)
+        for j in range(books_per):
+            db.session.add(Book(title=f"b{i}-{j}", author=person))
+    if people:
+        people[0].friends = people[1:3]
+    db.session.commit()
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    """
+    :return: function that creates the app, keyword arguments are set as safrs.SAFRS settings
+    """
+
+    def make(n_people=3, books_per=2, **settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(safrs.SAFRS, name, value)
+        get_config.cache_clear()
+        app = Flask("safrs_tests")
+        app.config.update(SQLALCHEMY_DATABASE_URI="sqlite://")
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            app.api = SAFRSAPI(app, host="localhost", port=5000, app_db=db)
+            app.api.expose_object(Person)
+            app.api.expose_object(Book)
+            seed(n_people, books_per)
+        return app
+
+    yield make
+    get_config.cache_clear()
+    get_response_cache().clear()
+    clear_count_cache()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    """
+    :return: list of the sql statements executed by the app's engine
+    """
+    executed = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda conn, cursor, statement, *args: executed.append(statement))
+    return executed
+
+
+@pytest.fixture
+def model_config(monkeypatch):
+    """
+    :return: function that sets the SAFRSConfig (__safrs_config__) of a model for the duration of the test
+    """
+    changed = []
+
+    def configure(model, **config):
+        monkeypatch.setattr(model, "__safrs_config__", config, raising=False)
+        model._s_clear_config_cache()
+        changed.append(model)
+
+    yield configure
+    monkeypatch.undo()
+    for model in changed:
+        model._s_clear_config_cache()
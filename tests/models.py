@@ -0,0 +1,56 @@
+"""
+Models used by the request tests
+"""
+import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from safrs import SAFRSBase, jsonapi_attr
+
+db = SQLAlchemy()
+
+friendships = db.Table(
+    "friendships",
+    db.Column("person_id", db.Integer, db.ForeignKey("People.id")),
+    db.Column("friend_id", db.Integer, db.ForeignKey("People.id")),
+)
+
+
+class Person(SAFRSBase, db.Model):
+    """
+    description: person
+    """
+
+    __tablename__ = "People"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    email = db.Column(db.String)
+    created = db.Column(db.DateTime, default=datetime.datetime(2020, 1, 2, 3, 4, 5))
+    price = db.Column(db.Numeric(10, 2))
+    blob = db.Column(db.LargeBinary)
+    books = db.relationship("Book", back_populates="author")
+    friends = db.relationship(
+        "Person", secondary=friendships, primaryjoin="Person.id==friendships.c.person_id", secondaryjoin="Person.id==friendships.c.friend_id"
+    )
+
+    @jsonapi_attr
+    def upper_name(self):
+        """
+        name in uppercase
+        """
+        return (self.name or "").upper()
+
+    @upper_name.expression
+    def upper_name(cls):
+        return func.upper(cls.name)
+
+
+class Book(SAFRSBase, db.Model):
+    """
+    description: book
+    """
+
+    __tablename__ = "Books"
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String)
+    author_id = db.Column(db.Integer, db.ForeignKey("People.id"))
+    author = db.relationship("Person", back_populates="books")
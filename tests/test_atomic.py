@@ -0,0 +1,104 @@
+"""
+JSON:API atomic operations: https://jsonapi.org/ext/atomic/
+"""
+import pytest
+import safrs
+from conftest import ATOMIC_HEADERS
+from models import Book, Person
+
+
+def post_operations(client, operations):
+    return client.post("/operations", json={"atomic:operations": operations}, headers=ATOMIC_HEADERS)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(ATOMIC_OPERATIONS=True)
+
+
+def test_operations_are_executed_in_order(client):
+    operations = [
+        {"op": "add", "data": {"type": "Person", "lid": "a", "attributes": {"name": "new"}}},
+        {"op": "add", "data": {"type": "Book", "lid": "b", "attributes": {"title": "T"}, "relationships": {"author": {"data": {"type": "Person", "lid": "a"}}}}},
+        {"op": "update", "data": {"type": "Person", "lid": "a", "attributes": {"name": "renamed"}}},
+        {"op": "update", "ref": {"type": "Person", "id": "1"}, "data": {"type": "Person", "id": "1", "attributes": {"name": "p0b"}}},
+        {"op": "add", "ref": {"type": "Person", "lid": "a", "relationship": "books"}, "data": [{"type": "Book", "id": "1"}]},
+        {"op": "remove", "ref": {"type": "Book", "id": "2"}},
+    ]
+    response = post_operations(client, operations)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/vnd.api+json")
+    results = response.json["atomic:results"]
+    assert len(results) == len(operations)
+    person_id, book_id = results[0]["data"]["id"], results[1]["data"]["id"]
+    assert results[0]["data"]["type"] == "Person"
+
+    assert client.get(f"/Books/{book_id}/author").json["data"]["id"] == person_id
+    assert client.get(f"/People/{person_id}/").json["data"]["attributes"]["name"] == "renamed"
+    assert sorted(book["id"] for book in client.get(f"/People/{person_id}/books").json["data"]) == sorted(["1", book_id])
+    assert client.get("/People/1/").json["data"]["attributes"]["name"] == "p0b"
+    assert client.get("/Books/2/").status_code == 404
+
+
+def test_failed_operation_rolls_back_the_request(client):
+    count = client.get("/People/").json["meta"]["count"]
+    operations = [
+        {"op": "add", "data": {"type": "Person", "attributes": {"name": "x"}}},
+        {"op": "update", "data": {"type": "Person", "id": "999", "attributes": {"name": "y"}}},
+    ]
+    response = post_operations(client, operations)
+    assert response.status_code == 404
+    assert response.json["errors"][0]["source"] == {"pointer": "/atomic:operations/1/data/id"}
+    assert client.get("/People/").json["meta"]["count"] == count
+
+
+@pytest.mark.parametrize(
+    "operations, status_code, pointer",
+    [
+        ([], 400, "/atomic:operations"),
+        ([{"op": "x"}], 400, "/atomic:operations/0/op"),
+        ([{"op": "add", "data": {"type": "Nope"}}], 404, "/atomic:operations/0/data/type"),
+        ([{"op": "remove", "ref": {"type": "Book", "lid": "unknown"}}], 400, "/atomic:operations/0/ref/lid"),
+    ],
+)
+def test_invalid_operations(client, operations, status_code, pointer):
+    response = post_operations(client, operations)
+    assert response.status_code == status_code
+    assert response.json["errors"][0]["source"] == {"pointer": pointer}
+
+
+def test_operations_respect_http_methods(client, monkeypatch):
+    monkeypatch.setattr(Book, "http_methods", ["GET", "PATCH"])
+    assert post_operations(client, [{"op": "add", "data": {"type": "Book", "attributes": {"title": "x"}}}]).status_code == 405
+    assert post_operations(client, [{"op": "remove", "ref": {"type": "Book", "id": "1"}}]).status_code == 405
+    assert post_operations(client, [{"op": "update", "data": {"type": "Book", "id": "1", "attributes": {"title": "y"}}}]).status_code == 200
+
+
+def test_endpoint_is_disabled_by_default(make_app):
+    client = make_app().test_client()
+    assert post_operations(client, [{"op": "remove", "ref": {"type": "Book", "id": "1"}}]).status_code in (404, 405)
+    assert client.get("/Books/1/").status_code == 200
+
+
+def test_objects_exposed_before_the_endpoint(make_app):
+    app = make_app()
+    app.api.expose_atomic_operations()
+    client = app.test_client()
+    response = post_operations(client, [{"op": "add", "data": {"type": "Person", "attributes": {"name": "z"}}}])
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "attribute, value",
+    [
+        ("db_commit", True),
+        ("_s_post", classmethod(lambda cls, **attributes: safrs.SAFRSBase._s_post.__func__(cls, **attributes))),
+        ("_s_patch", lambda self, **attributes: safrs.SAFRSBase._s_patch(self, **attributes)),
+    ],
+)
+def test_models_that_may_commit_are_refused(client, monkeypatch, attribute, value):
+    monkeypatch.setattr(Person, attribute, value)
+    count = client.get("/People/").json["meta"]["count"]
+    response = post_operations(client, [{"op": "add", "data": {"type": "Person", "attributes": {"name": "z"}}}])
+    assert response.status_code == 403
+    assert client.get("/People/").json["meta"]["count"] == count
@@ -0,0 +1,57 @@
+"""
+Serialization of the jsonapi attributes
+"""
+import datetime
+import decimal
+import json
+from sqlalchemy.ext.hybrid import hybrid_method
+from safrs.attr_serializer import get_attr_serializer
+from safrs.json_encoder import SAFRSJSONEncoder
+from models import Person, db
+
+
+def test_attribute_types(client):
+    attributes = client.get("/People/1/").json["data"]["attributes"]
+    assert attributes == {
+        "name": "p0",
+        "email": "p0@x.org",
+        "created": "2020-01-02 03:04:05",
+        "price": 1.5,
+        "blob": "0102",
+        "upper_name": "P0",
+    }
+
+
+def test_same_output_as_the_json_encoder(app):
+    with app.app_context():
+        person = db.session.get(Person, 1)
+        person.created = datetime.datetime(2021, 5, 6, 7, 8, 9, 10)
+        person.price = decimal.Decimal("3.14")
+        legacy = {name: json.loads(json.dumps(getattr(person, name), cls=SAFRSJSONEncoder)) for name in Person._s_jsonapi_attrs.keys()}
+        assert get_attr_serializer(Person, None, SAFRSJSONEncoder)(person) == legacy
+
+
+def test_custom_encoder(app):
+    class Encoder(SAFRSJSONEncoder):
+        def default(self, value):
+            if isinstance(value, decimal.Decimal):
+                return str(value)
+            return super().default(value)
+
+    app.json_encoder = Encoder
+    assert app.test_client().get("/People/1/").json["data"]["attributes"]["price"] == "1.50"
+
+
+def test_instance_permissions(client, monkeypatch):
+    def check_perm(self, attr_name, permission="r"):
+        # only the email of the first person can be read, the class level check allows all attributes
+        return attr_name != "email" or not isinstance(self, Person) or self.name == "p0"
+
+    monkeypatch.setattr(Person, "_s_check_perm", hybrid_method(check_perm))
+    get_attr_serializer.cache_clear()
+    try:
+        emails = [person["attributes"]["email"] for person in client.get("/People/").json["data"]]
+    finally:
+        monkeypatch.undo()
+        get_attr_serializer.cache_clear()
+    assert emails == ["p0@x.org", "", ""]
@@ -0,0 +1,26 @@
+"""
+The startup benchmark runs with a small synthetic schema
+"""
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+
+@pytest.mark.parametrize("adapter", ["flask", "fastapi"])
+def test_bench_startup(tmp_path, adapter):
+    if adapter == "fastapi":
+        pytest.importorskip("fastapi")
+        pytest.importorskip("httpx")
+    output = tmp_path / "startup.json"
+    command = [sys.executable, os.path.join(BENCHMARKS, "bench_startup.py"), "--tables", "4", "--relationships", "3"]
+    command += ["--adapters", adapter, "--repeat", "1", "--output", str(output)]
+    subprocess.run(command, check=True, capture_output=True, cwd=tmp_path)
+    results = json.loads(output.read_text())
+    assert (results["tables"], results["relationships"]) == (4, 3)
+    durations = results["durations"][adapter]
+    assert set(durations) == {"import", "declare", "expose", "spec", "first_request", "second_request"}
+    assert all(duration > 0 for duration in durations.values())
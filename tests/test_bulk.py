@@ -0,0 +1,163 @@
+"""
+Bulk requests: POST, PATCH and DELETE with multiple resources
+"""
+import pytest
+import safrs
+from sqlalchemy import event
+from safrs.bulk import bulk_insert_supported
+from conftest import JSONAPI_HEADERS
+from models import Book, Person, db
+
+
+@pytest.fixture
+def commits(app):
+    """
+    :return: list with an item for every transaction committed by the app's engine
+    """
+    committed = []
+    with app.app_context():
+        event.listen(db.engine, "commit", lambda conn: committed.append(conn))
+    return committed
+
+
+def test_bulk_post(client, statements, commits):
+    data = [{"type": "Person", "attributes": {"name": f"new{i}", "created": "2021-01-01 10:00:00", "price": "2.5"}} for i in range(20)]
+    response = client.post("/People/", json={"data": data}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 201
+    created = response.json["data"]
+    assert [person["attributes"]["name"] for person in created] == [f"new{i}" for i in range(20)]
+    assert len({person["id"] for person in created}) == 20
+    assert len(commits) == 1
+    assert not any(statement.startswith("SELECT") for statement in statements)
+
+    attributes = client.get(f"/People/{created[-1]['id']}/").json["data"]["attributes"]
+    assert attributes["name"] == "new19"
+    assert attributes["created"].startswith("2021-01-01")
+    assert float(attributes["price"]) == 2.5
+
+
+def test_bulk_post_with_relationships(client):
+    data = [{"type": "Book", "attributes": {"title": f"t{i}"}, "relationships": {"author": {"data": {"type": "Person", "id": "2"}}}} for i in range(2)]
+    response = client.post("/Books/", json={"data": data}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 201
+    for book in response.json["data"]:
+        author = book["relationships"]["author"]["data"]
+        assert client.get(f"/Books/{book['id']}/author").json["data"]["id"] == author["id"]
+
+
+def test_single_post(client):
+    response = client.post("/People/", json={"data": {"type": "Person", "attributes": {"name": "single"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 201
+    assert response.json["data"]["attributes"]["name"] == "single"
+
+
+def test_failed_bulk_post_is_rolled_back(client):
+    count = client.get("/People/").json["meta"]["count"]
+    data = [{"type": "Person", "attributes": {"name": "ok"}}, {"type": "Book", "attributes": {"title": "wrong"}}]
+    response = client.post("/People/", json={"data": data}, headers=JSONAPI_HEADERS)
+    assert response.status_code >= 400
+    assert client.get("/People/").json["meta"]["count"] == count
+
+
+def test_models_with_hooks_are_created_per_row(client, monkeypatch):
+    parse = Person._s_parse_attr_value
+    monkeypatch.setattr(Person, "_s_parse_attr_value", lambda self, name, value: parse(self, name, value.upper() if name == "name" else value))
+    bulk_insert_supported.cache_clear()
+    try:
+        data = [{"type": "Person", "attributes": {"name": f"hook{i}"}} for i in range(3)]
+        response = client.post("/People/", json={"data": data}, headers=JSONAPI_HEADERS)
+    finally:
+        monkeypatch.undo()
+        bulk_insert_supported.cache_clear()
+    assert response.status_code == 201
+    assert [person["attributes"]["name"] for person in response.json["data"]] == ["HOOK0", "HOOK1", "HOOK2"]
+
+
+def test_bulk_patch(client, statements, commits):
+    data = [{"type": "Person", "id": str(i), "attributes": {"name": f"u{i}", "price": "3.25"}} for i in (1, 2, 3)]
+    response = client.patch("/People/", json={"data": data}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 202
+    assert response.json == {}
+    # the instances are selected at once and the UPDATEs are flushed together
+    assert [statement.split()[0] for statement in statements] == ["SELECT", "UPDATE"]
+    assert len(commits) == 1
+    for i in (1, 2, 3):
+        attributes = client.get(f"/People/{i}/").json["data"]["attributes"]
+        assert (attributes["name"], float(attributes["price"])) == (f"u{i}", 3.25)
+
+
+def test_bulk_patch_matches_ids_by_identity(client):
+    response = client.patch("/People/", json={"data": [{"type": "Person", "id": "01", "attributes": {"name": "one"}}]}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 202
+    assert client.get("/People/1/").json["data"]["attributes"]["name"] == "one"
+
+
+def test_failed_bulk_patch(client):
+    data = [
+        {"type": "Person", "id": "1", "attributes": {"name": "changed"}},
+        {"type": "Book", "id": "2"},
+        {"type": "Person", "id": "9999", "attributes": {"name": "x"}},
+        {"type": "Person", "attributes": {"name": "y"}},
+    ]
+    response = client.patch("/People/", json={"data": data}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 400
+    errors = [(error["code"], error["source"]["pointer"]) for error in response.json["errors"]]
+    assert errors == [("403", "/data/1/type"), ("404", "/data/2"), ("400", "/data/3/id")]
+    # nothing is applied
+    assert client.get("/People/1/").json["data"]["attributes"]["name"] == "p0"
+
+
+def test_models_with_a_custom_patch(client, monkeypatch):
+    monkeypatch.setattr(Person, "_s_patch", lambda self, **attributes: safrs.SAFRSBase._s_patch(self, **attributes))
+    response = client.patch("/People/", json={"data": [{"type": "Person", "id": "1", "attributes": {"name": "x"}}]}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 405
+    assert client.get("/People/1/").json["data"]["attributes"]["name"] == "p0"
+
+
+def titles(client):
+    return sorted(book["attributes"]["title"] for book in client.get("/Books/?page[limit]=100").json["data"])
+
+
+def test_bulk_delete(client, statements):
+    response = client.delete("/Books/?filter[title]=b0-0,b1-1,unknown")
+    assert response.status_code == 200
+    assert response.json == {"meta": {"count": 2}}
+    assert [statement.split()[0] for statement in statements] == ["DELETE"]
+    assert titles(client) == ["b0-1", "b1-0", "b2-0", "b2-1"]
+
+
+def test_bulk_delete_per_instance(client):
+    # deleting a person removes the friendships association rows, so the people are deleted one by one
+    response = client.delete("/People/?filter[name]=p0,p1")
+    assert response.status_code == 200
+    assert response.json == {"meta": {"count": 2}}
+    assert [person["attributes"]["name"] for person in client.get("/People/").json["data"]] == ["p2"]
+
+
+def test_bulk_delete_requires_a_filter(client):
+    response = client.delete("/Books/")
+    assert response.status_code == 400
+    assert len(titles(client)) == 6
+
+
+def test_bulk_delete_is_scoped_by_s_get(client, monkeypatch):
+    monkeypatch.setattr(Book, "_s_get", classmethod(lambda cls, **kwargs: cls.jsonapi_filter().filter(Book.author_id != 1)))
+    response = client.delete("/Books/?filter[title]=b0-0,b1-0")
+    assert response.json == {"meta": {"count": 1}}
+    monkeypatch.undo()
+    assert titles(client) == ["b0-0", "b0-1", "b1-1", "b2-0", "b2-1"]
+
+
+def test_bulk_delete_on_mysql(app, client, monkeypatch):
+    # mysql can't select from the table it deletes from: the primary keys are selected first
+    with app.app_context():
+        monkeypatch.setattr(db.engine.dialect, "name", "mysql")
+    response = client.delete("/Books/?filter[title]=b0-0,b2-1")
+    assert response.json == {"meta": {"count": 2}}
+    monkeypatch.undo()
+    assert titles(client) == ["b0-1", "b1-0", "b1-1", "b2-0"]
+
+
+def test_bulk_delete_swagger(client):
+    parameters = client.get("/swagger.json").json["paths"]["/Books/"]["delete"]["parameters"]
+    assert {"filter[title]", "filter"} <= {parameter["name"] for parameter in parameters}
@@ -0,0 +1,77 @@
+"""
+Conditional GET: ETag / Last-Modified response headers and "304 Not Modified" responses
+"""
+import pytest
+from sqlalchemy import update
+from conftest import JSONAPI_HEADERS
+from models import Book, Person, db
+
+
+@pytest.fixture
+def app(make_app, model_config):
+    model_config(Book, conditional_get=True, cache_control="private, max-age=5")
+    model_config(Person, conditional_get=True)
+    return make_app()
+
+
+@pytest.mark.parametrize("url", ["/Books/1/", "/Books/?page[limit]=3", "/Books/1/?include=author", '/Books/?filter={"name":"title","op":"like","val":"b1%"}'])
+def test_not_modified(client, statements, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert response.headers["Cache-Control"] == "private, max-age=5"
+
+    statements.clear()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    # the validators are computed without querying the db
+    assert statements == []
+
+    assert client.get(url, headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_modified_after_patch(client):
+    etags = {url: client.get(url).headers["ETag"] for url in ["/Books/1/", "/Books/1/?include=author", "/Books/"]}
+    response = client.patch("/Books/1/", json={"data": {"type": "Book", "id": "1", "attributes": {"title": "new"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 200
+    for url, etag in etags.items():
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+
+def test_related_model_changes(client):
+    etag = client.get("/Books/1/?include=author").headers["ETag"]
+    response = client.patch("/People/1/", json={"data": {"type": "Person", "id": "1", "attributes": {"name": "new"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 200
+    assert client.get("/Books/1/?include=author", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_collection_modified_after_post(client):
+    etag = client.get("/Books/").headers["ETag"]
+    response = client.post("/Books/", json={"data": {"type": "Book", "attributes": {"title": "new"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 201
+    assert client.get("/Books/", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("change", ["orm", "bulk"])
+def test_modified_outside_the_api(app, client, change):
+    etag = client.get("/Books/1/").headers["ETag"]
+    with app.app_context():
+        if change == "orm":
+            db.session.get(Book, 1).title = "changed"
+        else:
+            db.session.execute(update(Book).where(Book.id == 1).values(title="changed"))
+        db.session.commit()
+    assert client.get("/Books/1/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_disabled_by_default(make_app):
+    client = make_app().test_client()
+    response = client.get("/Books/1/")
+    assert "ETag" not in response.headers
+    assert client.get("/Books/1/", headers={"If-None-Match": "*"}).status_code == 200
@@ -0,0 +1,58 @@
+"""
+Collection count strategies (COUNT_STRATEGY setting and SAFRSConfig.count_strategy)
+"""
+import pytest
+from sqlalchemy import text
+from safrs.count_strategy import clear_count_cache
+from safrs.errors import SystemValidationError
+from conftest import JSONAPI_HEADERS
+from models import Book, db
+
+
+def test_exact(client):
+    meta = client.get("/Books/?page[limit]=2").json["meta"]
+    assert (meta["count"], meta["total"]) == (6, 6)
+    assert client.get("/Books/?filter[title]=b0-0,b1-0").json["meta"]["count"] == 2
+
+
+def test_none(make_app):
+    client = make_app(COUNT_STRATEGY="none").test_client()
+    document = client.get("/Books/?page[limit]=2").json
+    assert document["meta"]["count"] is None
+    assert len(document["data"]) == 2
+    assert "next" in document["links"] and "last" not in document["links"]
+
+
+def test_cached(make_app, model_config):
+    model_config(Book, count_strategy="cached", count_ttl=60)
+    app = make_app()
+    client = app.test_client()
+    assert client.get("/Books/").json["meta"]["count"] == 6
+    # the counts are cached per filter
+    assert client.get("/Books/?filter[title]=b0-0").json["meta"]["count"] == 1
+    response = client.post("/Books/", json={"data": {"type": "Book", "attributes": {"title": "new"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 201
+    assert client.get("/Books/").json["meta"]["count"] == 6
+    clear_count_cache(Book)
+    assert client.get("/Books/").json["meta"]["count"] == 7
+
+
+def test_estimated(make_app):
+    app = make_app(COUNT_STRATEGY="estimated")
+    client = app.test_client()
+    # without statistics the exact count is used
+    assert "count_estimated" not in client.get("/Books/").json["meta"]
+    with app.app_context():
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+    meta = client.get("/Books/").json["meta"]
+    assert (meta["count"], meta["count_estimated"]) == (6, True)
+    # filtered collections are counted exactly
+    meta = client.get("/Books/?filter[title]=b0-0").json["meta"]
+    assert meta["count"] == 1 and "count_estimated" not in meta
+
+
+def test_invalid_strategy(model_config):
+    model_config(Book, count_strategy="unknown")
+    with pytest.raises(SystemValidationError):
+        Book._s_count_strategy
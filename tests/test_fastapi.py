@@ -0,0 +1,148 @@
+"""
+FastAPI adapter: collections, includes, streaming, keyset pagination and the async mode
+"""
+import datetime
+import pytest
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, relationship, scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+import safrs
+from safrs import SAFRSBase
+
+fastapi = pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+from safrs.fastapi.api import SafrsFastAPI  # noqa: E402
+
+Base = declarative_base()
+
+
+class Author(SAFRSBase, Base):
+    """
+    description: author
+    """
+
+    __tablename__ = "Authors"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    created = Column(DateTime, default=datetime.datetime(2020, 1, 2, 3, 4, 5))
+    novels = relationship("Novel", back_populates="author")
+
+
+class Novel(SAFRSBase, Base):
+    """
+    description: novel
+    """
+
+    __tablename__ = "Novels"
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    author_id = Column(Integer, ForeignKey("Authors.id"))
+    author = relationship("Author", back_populates="novels")
+
+
+class DB:
+    """
+    safrs.DB replacement for the models above (safrs.DB is the Flask-SQLAlchemy object otherwise)
+    """
+
+    Model = Base
+
+    def __init__(self, session):
+        self.session = session
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/fastapi.db", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        for i in range(4):
+            author = Author(name=f"a{i}")
+            session.add(author)
+            session.add_all(Novel(title=f"n{i}-{j}", author=author) for j in range(3))
+        session.commit()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def make_client(monkeypatch, engine):
+    """
+    :return: function that creates a TestClient for the api, keyword arguments are passed to SafrsFastAPI
+    """
+    session = scoped_session(sessionmaker(bind=engine, autoflush=False))
+    monkeypatch.setattr(safrs, "DB", DB(session))
+
+    def make(**kwargs):
+        app = fastapi.FastAPI()
+        api = SafrsFastAPI(app, **kwargs)
+        api.expose_object(Author)
+        api.expose_object(Novel)
+        return TestClient(app)
+
+    yield make
+    session.remove()
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
+
+
+def ids(document):
+    return [item["id"] for item in document["data"]]
+
+
+def test_collection(client):
+    response = client.get("/Novels?sort=-title&page[limit]=4")
+    assert response.status_code == 200
+    document = response.json()
+    assert [novel["attributes"]["title"] for novel in document["data"]] == ["n3-2", "n3-1", "n3-0", "n2-2"]
+    assert document["meta"]["count"] == 4
+    assert client.get("/Authors/2").json()["data"]["attributes"] == {"name": "a1", "created": "2020-01-02 03:04:05"}
+    assert ids(client.get('/Authors?filter={"name":"name","op":"in","val":["a1","a3"]}').json()) == ["2", "4"]
+
+
+def test_include(client):
+    document = client.get("/Novels?include=author&page[offset]=2&page[limit]=3").json()
+    assert ids(document) == ["3", "4", "5"]
+    assert sorted(author["id"] for author in document["included"]) == ["1", "2"]
+    document = client.get("/Authors/1?include=novels").json()
+    assert sorted(novel["id"] for novel in document["included"]) == ["1", "2", "3"]
+
+
+def test_streamed_include(client, monkeypatch, model_config):
+    expected = client.get("/Authors?include=novels").json()
+    model_config(Author, stream=True)
+    monkeypatch.setattr(safrs.SAFRS, "STREAM_YIELD_PER", 2)
+    response = client.get("/Authors?include=novels")
+    assert response.status_code == 200
+    assert "content-length" not in response.headers
+    document = response.json()
+    key = lambda item: (item["type"], item["id"])  # noqa: E731
+    assert document["data"] == expected["data"]
+    assert sorted(document["included"], key=key) == sorted(expected["included"], key=key)
+
+
+def test_keyset_pagination(client):
+    url, pages = "/Novels?sort=title&page[after]=&page[limit]=5", []
+    while url:
+        document = client.get(url).json()
+        pages.append(ids(document))
+        url = document["links"].get("next")
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert sum(pages, []) == ids(client.get("/Novels?sort=title&page[limit]=100").json())
+
+
+def test_async_session(make_client, engine):
+    pytest.importorskip("greenlet")
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(engine.url.set(drivername="sqlite+aiosqlite"))
+    client = make_client(async_session=async_sessionmaker(async_engine))
+    assert client.get("/Novels?sort=-title&page[limit]=4").json()["data"][0]["attributes"]["title"] == "n3-2"
+    assert sorted(novel["id"] for novel in client.get("/Authors/1?include=novels").json()["included"]) == ["1", "2", "3"]
+    response = client.patch("/Authors/1", json={"data": {"type": "Author", "id": "1", "attributes": {"name": "changed"}}})
+    assert response.status_code == 200
+    assert client.get("/Authors/1").json()["data"]["attributes"]["name"] == "changed"
@@ -0,0 +1,87 @@
+"""
+JSON filter= query argument (nested and/or/not filters) and jsonapi_attr sql expressions
+"""
+import json
+import pytest
+from urllib.parse import quote
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(n_people=5, books_per=1)
+
+
+def names(client, filt, url="/People/"):
+    response = client.get(f"{url}?filter={quote(json.dumps(filt))}&sort=id")
+    assert response.status_code == 200
+    return [item["attributes"]["name"] for item in response.json["data"]]
+
+
+@pytest.mark.parametrize(
+    "filt, expected",
+    [
+        ({"name": "name", "op": "eq", "val": "p1"}, ["p1"]),
+        ({"name": "id", "op": "ge", "val": "4"}, ["p3", "p4"]),
+        ({"name": "id", "op": "gt", "val": 3.0}, ["p3", "p4"]),
+        ({"name": "name", "op": "in", "val": ["p0", "p2", "x"]}, ["p0", "p2"]),
+        ({"name": "name", "op": "in", "val": "p0,p2"}, ["p0", "p2"]),
+        ({"name": "name", "op": "not_in", "val": ["p0", "p2"]}, ["p1", "p3", "p4"]),
+        ({"name": "name", "op": "like", "val": "p%"}, ["p0", "p1", "p2", "p3", "p4"]),
+        ({"name": "email", "op": "is", "val": None}, []),
+        ({"name": "email", "op": "is_not", "val": None}, ["p0", "p1", "p2", "p3", "p4"]),
+        ({"or": [{"name": "name", "val": "p0"}, {"and": [{"name": "id", "op": "gt", "val": 3}, {"name": "name", "op": "ne", "val": "p4"}]}]}, ["p0", "p3"]),
+        ({"not": {"or": [{"name": "name", "val": "p0"}, {"name": "name", "val": "p1"}]}}, ["p2", "p3", "p4"]),
+        ([{"name": "name", "val": "p0"}, {"name": "name", "val": "p1"}, {"name": "id", "op": "in", "val": [1, 3]}], ["p0"]),
+        ({"name": "created", "op": "lt", "val": "2020-01-03"}, ["p0", "p1", "p2", "p3", "p4"]),
+        ({"name": "upper_name", "op": "in", "val": ["P1", "P3"]}, ["p1", "p3"]),
+    ],
+)
+def test_filter(client, filt, expected):
+    assert names(client, filt) == expected
+
+
+def test_values_are_bound_per_request(client):
+    # the compiled filter is cached by shape, the values of every request must be used
+    for name in ("p1", "p2", "p3"):
+        assert names(client, {"name": "name", "val": name}) == [name]
+
+
+def test_relationship_filter(client):
+    assert names(client, {"name": "name", "val": "p0"}, "/People/1/friends") == []
+    assert names(client, {"name": "name", "op": "in", "val": ["p1", "p2", "p3"]}, "/People/1/friends") == ["p1", "p2"]
+
+
+@pytest.mark.parametrize(
+    "filt",
+    [
+        "{",
+        {"name": "name", "op": "unknown", "val": "p1"},
+        {"name": "unknown", "val": "p1"},
+        {"name": "id", "val": "x"},
+        {"name": "id", "val": 1.5},
+        {"name": "created", "val": "yesterday"},
+        {"name": "name", "op": "in", "val": 5},
+        {"name": "email", "op": "is", "val": "x"},
+        {"and": []},
+        {"op": "eq", "val": "p1"},
+    ],
+)
+def test_invalid_filter(client, filt):
+    filter_arg = filt if isinstance(filt, str) else json.dumps(filt)
+    response = client.get(f"/People/?filter={quote(filter_arg)}")
+    assert response.status_code == 400
+
+
+def test_jsonapi_attr_expression(client, statements):
+    response = client.get("/People/?filter[upper_name]=P2&sort=-upper_name")
+    assert [person["attributes"]["upper_name"] for person in response.json["data"]] == ["P2"]
+    # the filter is applied in sql
+    assert any("upper(" in statement for statement in statements)
+    response = client.get("/People/?sort=-upper_name")
+    assert [person["attributes"]["upper_name"] for person in response.json["data"]] == ["P4", "P3", "P2", "P1", "P0"]
+
+
+def test_jsonapi_attr_swagger_filters(client):
+    paths = client.get("/swagger.json").json["paths"]
+    for path in ("/People/", "/People/{PersonId}/friends"):
+        assert "filter[upper_name]" in [parameter["name"] for parameter in paths[path]["get"]["parameters"]]
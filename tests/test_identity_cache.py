@@ -0,0 +1,43 @@
+"""
+Identity map lookups and the request-scoped instance memo of get_instance
+"""
+import pytest
+from sqlalchemy import update
+from safrs.errors import NotFoundError
+from conftest import JSONAPI_HEADERS
+from models import Person, db
+
+
+def selects(statements):
+    return [statement for statement in statements if statement.startswith("SELECT")]
+
+
+def test_repeated_lookups(app, statements):
+    with app.test_request_context():
+        person = Person.get_instance("1")
+        assert Person.get_instance("01") is person
+        assert Person.get_instance(1) is person
+        assert len(selects(statements)) == 1
+
+
+def test_missing_instances(app):
+    with app.test_request_context():
+        assert Person.get_instance("99", failsafe=True) is None
+        for jsonapi_id in ("99", "x"):
+            with pytest.raises(NotFoundError):
+                Person.get_instance(jsonapi_id)
+
+
+def test_the_memo_is_cleared_on_commit(app):
+    with app.test_request_context():
+        assert Person.get_instance("1").name == "p0"
+        db.session.execute(update(Person).where(Person.id == 1).values(name="changed"))
+        db.session.commit()
+        assert Person.get_instance("1").name == "changed"
+
+
+def test_patch_retrieves_the_instance_once(client, statements):
+    response = client.patch("/People/1/", json={"data": {"type": "Person", "id": "1", "attributes": {"name": "x"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 200
+    # the instance is selected and refreshed after the commit
+    assert len(selects(statements)) == 2
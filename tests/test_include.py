@@ -0,0 +1,65 @@
+"""
+Compound documents (include=) and the resource linkage of to-many relationships
+"""
+import pytest
+from sqlalchemy import event
+from models import db
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(n_people=6, books_per=4)
+
+
+def linkage(resource, rel_name):
+    return [item["id"] for item in resource["relationships"][rel_name]["data"]]
+
+
+def included(document):
+    return sorted((item["type"], int(item["id"])) for item in document.get("included", []))
+
+
+def test_include(client):
+    document = client.get("/People/?include=books,friends.books&sort=id&page[limit]=2").json
+    first, second = document["data"]
+    assert linkage(first, "friends") == ["2", "3"]
+    # page[limit] also limits the relationship data, friend 2 (p1) is in the primary data
+    books = [("Book", book_id) for book_id in (1, 2, 5, 6, 9, 10)]
+    assert included(document) == sorted(books + [("Person", 3)])
+    assert linkage(second, "books") == ["5", "6"]
+
+
+def test_include_many_to_one(client):
+    document = client.get("/Books/?include=author&sort=id&page[limit]=6").json
+    assert [book["relationships"]["author"]["data"]["id"] for book in document["data"]] == ["1"] * 4 + ["2"] * 2
+    assert included(document) == [("Person", 1), ("Person", 2)]
+
+
+def test_include_is_batched(make_app):
+    counts = []
+    for n_people in (2, 8):
+        app = make_app(n_people=n_people, books_per=4)
+        client = app.test_client()
+        executed = []
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", lambda conn, cursor, statement, *args: executed.append(statement))
+        assert client.get("/People/?include=books,friends.books").status_code == 200
+        counts.append(len(executed))
+    # the number of queries doesn't depend on the number of resources
+    assert counts[0] == counts[1]
+
+
+def test_included_relationship_paging(client):
+    document = client.get("/People/1/?include=books&page[books][limit]=2&page[books][offset]=1").json
+    assert linkage(document["data"], "books") == ["2", "3"]
+    assert included(document) == [("Book", 2), ("Book", 3)]
+
+
+def test_linkage_paging(client, statements):
+    document = client.get("/People/1/?fields[Person]=books&page[books][offset]=1&page[books][limit]=2").json
+    books = document["data"]["relationships"]["books"]
+    assert linkage(document["data"], "books") == ["2", "3"]
+    assert books["meta"]["count"] == 4
+    assert document["data"]["attributes"] == {}
+    # the linkage is selected without loading the books
+    assert not any('"Books".title' in statement for statement in statements)
@@ -0,0 +1,50 @@
+"""
+JSON serialization backends (JSON_BACKEND setting)
+"""
+import pytest
+from safrs.json_backend import get_json_backend
+from conftest import normalized
+from models import Person, db
+
+URLS = ["/People/?include=books&sort=id", "/People/1/", "/Books/1/?include=author"]
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    return request.param
+
+
+def rename(app, name):
+    with app.app_context():
+        db.session.get(Person, 1).name = name
+        db.session.commit()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_backends_serialize_alike(make_app, backend, stream):
+    expected = make_app().test_client()
+    client = make_app(JSON_BACKEND=backend, STREAM_COLLECTIONS=stream).test_client()
+    for url in URLS:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert normalized(response.json) == normalized(expected.get(url).json)
+    attributes = client.get("/People/1/").json["data"]["attributes"]
+    assert (attributes["price"], attributes["blob"], attributes["created"]) == (1.5, "0102", "2020-01-02 03:04:05")
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+def test_ensure_ascii(make_app, backend, stream, ensure_ascii):
+    app = make_app(JSON_BACKEND=backend, STREAM_COLLECTIONS=stream)
+    app.json.ensure_ascii = ensure_ascii
+    rename(app, "Zoë 😀")
+    response = app.test_client().get("/People/")
+    assert response.data.isascii() == ensure_ascii
+    assert response.json["data"][0]["attributes"]["name"] == "Zoë 😀"
+
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        get_json_backend("unknown")
@@ -0,0 +1,64 @@
+"""
+Keyset (cursor) pagination: page[after] and page[before]
+"""
+import pytest
+from urllib.parse import urlsplit
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(n_people=3, books_per=5)
+
+
+def relative(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+
+def walk(client, url, direction="next"):
+    """
+    :return: the ids of the pages that are returned by following the `direction` links
+    """
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([item["id"] for item in response.json["data"]])
+        url = response.json["links"].get(direction)
+        url = url and relative(url)
+    return pages
+
+
+@pytest.mark.parametrize("sort", ["", "-id", "title", "-title", "author_id,-id", "-author_id,title"])
+def test_cursor_pages_cover_the_collection(client, sort):
+    expected = [book["id"] for book in client.get(f"/Books/?sort={sort}&page[limit]=100").json["data"]]
+    pages = walk(client, f"/Books/?sort={sort}&page[after]=&page[limit]=4")
+    assert [len(page) for page in pages] == [4, 4, 4, 3]
+    assert sum(pages, []) == expected
+
+
+def test_prev_links(client):
+    first = client.get("/Books/?sort=title&page[after]=&page[limit]=4").json
+    assert "prev" not in first["links"]
+    second = client.get(relative(first["links"]["next"])).json
+    assert second["meta"]["count"] == 15
+    assert walk(client, relative(second["links"]["prev"]), "prev") == [[book["id"] for book in first["data"]]]
+
+
+def test_the_cursor_condition_is_applied_in_sql(client, statements):
+    first = client.get("/Books/?sort=title,-id&page[after]=&page[limit]=4").json
+    statements.clear()
+    client.get(relative(first["links"]["next"]))
+    paged = [statement for statement in statements if "LIMIT" in statement]
+    assert len(paged) == 1
+    assert '"Books".title >' in paged[0]
+
+
+def test_relationship_cursor_links(client):
+    links = client.get("/People/1/books?sort=-id&page[after]=&page[limit]=2").json["links"]
+    assert relative(links["next"]).startswith("/People/1/books?")
+    assert walk(client, "/People/1/books?sort=-id&page[after]=&page[limit]=2") == [["5", "4"], ["3", "2"], ["1"]]
+
+
+def test_invalid_cursor(client):
+    assert client.get("/Books/?page[after]=xx&page[limit]=4").status_code == 400
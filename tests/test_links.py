@@ -0,0 +1,32 @@
+"""
+Instance and relationship links
+"""
+from flask import url_for
+from models import Person
+
+
+def test_links_equal_url_for(app, client):
+    document = client.get("/People/?include=books").json
+    with app.test_request_context():
+        for person in document["data"]:
+            url = url_for(Person.get_endpoint(type="instance"), PersonId=person["id"])
+            assert person["links"]["self"] == url
+            assert person["relationships"]["books"]["links"]["self"] == url + "books"
+    for book in document["included"]:
+        assert book["links"]["self"] == f"/Books/{book['id']}/"
+
+
+def test_script_root(client):
+    # the links of requests with a different script root are built separately
+    for script_name in ("/app", "", "/other"):
+        document = client.get("/People/1/", environ_overrides={"SCRIPT_NAME": script_name}).json
+        assert document["data"]["links"]["self"] == f"{script_name}/People/1/"
+        assert document["data"]["relationships"]["friends"]["links"]["self"] == f"{script_name}/People/1/friends"
+
+
+def test_url_prefix(make_app):
+    app = make_app()
+    with app.app_context():
+        app.api.expose_object(Person, url_prefix="/v2")
+    person = app.test_client().get("/v2/People/1/").json["data"]
+    assert person["links"]["self"] == "/v2/People/1/"
@@ -0,0 +1,39 @@
+"""
+Filtering, sorting and paginating relationship collections
+"""
+import json
+import pytest
+from urllib.parse import quote
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(n_people=3, books_per=4)
+
+
+def ids(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return [item["id"] for item in response.json["data"]]
+
+
+def test_filter(client):
+    assert ids(client, "/People/1/books?filter[title]=b0-1,b0-3,b1-0&sort=-title") == ["4", "2"]
+    filt = quote(json.dumps({"or": [{"name": "title", "val": "b0-0"}, {"name": "title", "val": "b1-1"}]}))
+    assert ids(client, f"/People/1/books?filter={filt}") == ["1"]
+    assert ids(client, "/People/1/friends?filter[name]=p2") == ["3"]
+
+
+def test_filter_sort_and_paginate_in_one_query(client, statements):
+    filt = quote(json.dumps({"name": "title", "op": "like", "val": "b0%"}))
+    response = client.get(f"/People/1/books?filter={filt}&sort=-id&page[limit]=2&page[offset]=1")
+    assert [book["id"] for book in response.json["data"]] == ["3", "2"]
+    assert response.json["meta"]["count"] == 4
+    books = [statement for statement in statements if 'FROM "Books"' in statement and "count(" not in statement]
+    # the books of the person aren't loaded to be filtered in python
+    assert len(books) == 1
+    assert "LIKE" in books[0] and "LIMIT" in books[0]
+
+
+def test_invalid_filter(client):
+    assert client.get('/People/1/books?filter={"name":"unknown","val":1}').status_code == 400
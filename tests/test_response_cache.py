@@ -0,0 +1,82 @@
+"""
+Server-side GET response cache with write-driven invalidation
+"""
+import pytest
+from sqlalchemy import update
+from safrs.response_cache import get_response_cache
+from conftest import JSONAPI_HEADERS
+from models import Book, Person, db
+
+
+@pytest.fixture
+def app(make_app, model_config):
+    model_config(Book, response_cache=True)
+    model_config(Person, response_cache=True)
+    return make_app()
+
+
+def patch(client, url, type_, id_, **attributes):
+    response = client.patch(url, json={"data": {"type": type_, "id": id_, "attributes": attributes}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("headers", [{}, JSONAPI_HEADERS])
+@pytest.mark.parametrize("url", ["/Books/1/", "/Books/?page[limit]=3&sort=title", "/Books/1/?include=author", "/People/1/books"])
+def test_cached_response(client, statements, headers, url):
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    statements.clear()
+    second = client.get(url, headers=headers)
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert second.headers["Content-Type"] == first.headers["Content-Type"]
+    assert statements == []
+
+
+def test_argument_order(client, statements):
+    client.get("/Books/?page[limit]=3&sort=title")
+    statements.clear()
+    client.get("/Books/?sort=title&page[limit]=3")
+    assert statements == []
+
+
+def test_repeated_arguments(client):
+    client.get("/Books/?sort=title")
+    client.get("/Books/?sort=title&sort=-title")
+    assert get_response_cache().stats()["entries"] == 2
+
+
+def test_credentials_are_part_of_the_key(client):
+    hits = get_response_cache().stats()["hits"]
+    client.set_cookie("session", "a")
+    client.get("/Books/")
+    client.set_cookie("session", "b")
+    client.get("/Books/")
+    client.get("/Books/", headers={"Authorization": "Bearer x"})
+    stats = get_response_cache().stats()
+    assert (stats["entries"], stats["hits"]) == (3, hits)
+
+
+def test_invalidated_by_writes(client):
+    urls = ["/Books/1/", "/Books/1/?include=author", "/People/1/books"]
+    for url in urls:
+        client.get(url)
+    patch(client, "/People/1/", "Person", "1", name="changed")
+    assert b"changed" in client.get("/Books/1/?include=author").data
+    patch(client, "/Books/1/", "Book", "1", title="changed")
+    assert b"changed" in client.get("/Books/1/").data
+    assert b"changed" in client.get("/People/1/books").data
+
+
+def test_invalidated_by_bulk_statements(app, client):
+    client.get("/Books/1/")
+    with app.app_context():
+        db.session.execute(update(Book).where(Book.id == 1).values(title="changed"))
+        db.session.commit()
+    assert client.get("/Books/1/").json["data"]["attributes"]["title"] == "changed"
+
+
+def test_disabled_by_default(make_app):
+    client = make_app().test_client()
+    client.get("/Books/")
+    assert get_response_cache().stats()["entries"] == 0
@@ -0,0 +1,57 @@
+"""
+Sorting by related attributes
+"""
+import pytest
+from conftest import JSONAPI_HEADERS
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    # p0, p1, p2 -> c, a, b
+    for person_id, name in (("1", "c"), ("2", "a"), ("3", "b")):
+        response = client.patch(f"/People/{person_id}/", json={"data": {"type": "Person", "id": person_id, "attributes": {"name": name}}}, headers=JSONAPI_HEADERS)
+        assert response.status_code == 200
+    client.post("/Books/", json={"data": {"type": "Book", "attributes": {"title": "anonymous"}}}, headers=JSONAPI_HEADERS)
+    return client
+
+
+def titles(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return [book["attributes"]["title"] for book in response.json["data"]]
+
+
+def names(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return [person["attributes"]["name"] for person in response.json["data"]]
+
+
+def test_sort_by_to_one_relationship(client, statements):
+    assert titles(client, "/Books/?sort=author.name,title") == ["anonymous", "b1-0", "b1-1", "b2-0", "b2-1", "b0-0", "b0-1"]
+    assert titles(client, "/Books/?sort=-author.name,-title") == ["b0-1", "b0-0", "b2-1", "b2-0", "b1-1", "b1-0", "anonymous"]
+    # the related table is joined, the books are sorted and paginated in sql
+    paged = [statement for statement in statements if "LIMIT" in statement and '"Books"' in statement]
+    assert any("JOIN" in statement and "ORDER BY" in statement for statement in paged)
+
+
+def test_sort_by_to_many_relationship(client):
+    # the people are sorted by the min./max. title of their books
+    assert names(client, "/People/?sort=-books.title") == ["b", "a", "c"]
+    # people without friends are sorted as NULL
+    assert names(client, "/People/?sort=-friends.name,id") == ["c", "a", "b"]
+
+
+def test_sort_pages(client):
+    pages = [titles(client, f"/Books/?sort=author.name,title&page[offset]={offset}&page[limit]=3") for offset in (0, 3, 6)]
+    assert sum(pages, []) == titles(client, "/Books/?sort=author.name,title")
+
+
+def test_sort_relationship_collection(client):
+    assert names(client, "/People/1/friends?sort=-name") == ["b", "a"]
+
+
+@pytest.mark.parametrize("sort", ["author.unknown", "unknown.name", "title.author"])
+def test_invalid_paths_are_ignored(client, sort):
+    assert titles(client, f"/Books/?sort={sort},-id") == titles(client, "/Books/?sort=-id")
@@ -0,0 +1,44 @@
+"""
+Sparse fieldsets (fields[type]=...) and the columns selected from the database
+"""
+from conftest import JSONAPI_HEADERS
+
+
+def selected_columns(statements, table):
+    """
+    :return: the columns of `table` in the select clause of the paged statement
+    """
+    statement = next(statement for statement in statements if "LIMIT" in statement and f'FROM "{table}"' in statement)
+    select_clause = statement.split("FROM")[0]
+    return {column.split(" AS ")[0].split(".")[1] for column in select_clause[len("SELECT ") :].split(", ")}
+
+
+def test_columns_are_projected(client, statements):
+    response = client.get("/People/?fields[Person]=name")
+    assert response.status_code == 200
+    assert [person["attributes"] for person in response.json["data"]] == [{"name": "p0"}, {"name": "p1"}, {"name": "p2"}]
+    assert selected_columns(statements, "People") == {"id", "name"}
+
+
+def test_relationship_columns_are_selected(client, statements):
+    response = client.get("/Books/?fields[Book]=title&include=author&fields[Person]=email")
+    book = response.json["data"][0]
+    assert book["attributes"] == {"title": "b0-0"}
+    assert book["relationships"]["author"]["data"] == {"id": "1", "type": "Person"}
+    assert sorted(person["attributes"]["email"] for person in response.json["included"]) == ["p0@x.org", "p1@x.org", "p2@x.org"]
+    assert all(person["attributes"].keys() == {"email"} for person in response.json["included"])
+    # the foreign key is needed for the relationship
+    assert selected_columns(statements, "Books") == {"id", "title", "author_id"}
+
+
+def test_jsonapi_attr_fields(client):
+    response = client.get("/People/?fields[Person]=upper_name,email")
+    assert response.json["data"][0]["attributes"] == {"upper_name": "P0", "email": "p0@x.org"}
+
+
+def test_write_after_a_sparse_read(client):
+    client.get("/People/?fields[Person]=name")
+    response = client.patch("/People/1/", json={"data": {"type": "Person", "id": "1", "attributes": {"name": "changed"}}}, headers=JSONAPI_HEADERS)
+    assert response.status_code == 200
+    attributes = client.get("/People/1/").json["data"]["attributes"]
+    assert (attributes["name"], attributes["email"], attributes["blob"]) == ("changed", "p0@x.org", "0102")
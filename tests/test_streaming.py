@@ -0,0 +1,38 @@
+"""
+Streamed collection responses
+"""
+import pytest
+from conftest import normalized
+from models import Book
+
+
+def streamed(response):
+    # the length of a streamed response isn't known when the headers are sent
+    return "Content-Length" not in response.headers
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["/Books/", "/Books/?sort=-title&page[limit]=5&page[offset]=2", "/People/?include=books,friends.books", "/Books/?include=author&fields[Book]=title", "/People/?page[limit]=0"],
+)
+def test_streamed_response_equals_the_buffered_response(make_app, url):
+    expected = make_app(n_people=5, books_per=3).test_client().get(url)
+    response = make_app(n_people=5, books_per=3, STREAM_COLLECTIONS=True, STREAM_YIELD_PER=2).test_client().get(url)
+    assert response.status_code == expected.status_code == 200
+    assert streamed(response) and not streamed(expected)
+    assert response.headers["Content-Type"] == expected.headers["Content-Type"]
+    assert normalized(response.json) == normalized(expected.json)
+
+
+def test_stream_per_model(make_app, model_config):
+    model_config(Book, stream=True)
+    client = make_app().test_client()
+    assert streamed(client.get("/Books/"))
+    assert not streamed(client.get("/People/"))
+    # instances aren't streamed
+    assert not streamed(client.get("/Books/1/"))
+
+
+def test_streamed_errors(make_app):
+    client = make_app(STREAM_COLLECTIONS=True).test_client()
+    assert client.get('/Books/?filter={"name":"unknown","val":1}').status_code == 400
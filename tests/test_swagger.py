@@ -0,0 +1,79 @@
+"""
+Deferred swagger generation and persisted spec snapshots
+"""
+import os
+import pytest
+from safrs.spec_cache import schema_fingerprint
+from models import Book, Person
+
+
+def operations(spec):
+    """
+    :return: the operations of the spec with their parameter names
+    (the definitions and sample ids depend on the swagger schemas created before and on the data in the db)
+    """
+    return {
+        (path, method, operation["summary"], tuple(parameter["name"] for parameter in operation["parameters"]))
+        for path, path_item in spec["paths"].items()
+        for method, operation in path_item.items()
+    }
+
+
+def test_deferred_spec_equals_the_eager_spec(make_app):
+    eager = make_app(DEFERRED_SWAGGER=False)
+    assert eager.api._spec_builders == []
+    deferred = make_app(DEFERRED_SWAGGER=True)
+    # exposing the objects only registers the spec builders
+    assert deferred.api._spec_builders
+    spec = deferred.test_client().get("/swagger.json").json
+    assert deferred.api._spec_builders == []
+    assert operations(spec) == operations(eager.test_client().get("/swagger.json").json)
+    assert {"/People/", "/People/{PersonId}/", "/People/{PersonId}/books", "/Books/"} <= set(spec["paths"])
+
+
+def test_objects_exposed_after_the_spec_was_built(make_app):
+    app = make_app()
+    with app.app_context():
+        app.api.build_spec()
+        app.api.expose_object(Book, url_prefix="/v2")
+    assert "/v2/Books/" in app.test_client().get("/swagger.json").json["paths"]
+
+
+@pytest.fixture
+def snapshot_app(make_app, tmp_path):
+    def make():
+        return make_app(SPEC_CACHE_DIR=str(tmp_path))
+
+    return make
+
+
+def test_spec_snapshot(snapshot_app, tmp_path):
+    expected = snapshot_app().test_client().get("/swagger.json")
+    assert len(os.listdir(tmp_path)) == 1
+
+    app = snapshot_app()
+    client = app.test_client()
+    response = client.get("/swagger.json")
+    assert response.status_code == 200
+    assert response.data == expected.data
+    assert response.headers["ETag"] == expected.headers["ETag"]
+    # the snapshot is loaded, the spec isn't generated
+    assert app.api._spec_builders
+    assert len(os.listdir(tmp_path)) == 1
+
+    response = client.get("/swagger.json", headers={"If-None-Match": expected.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_snapshot_matches_the_generated_spec(snapshot_app, make_app):
+    snapshot = snapshot_app().test_client().get("/swagger.json").json
+    assert operations(snapshot) == operations(make_app().test_client().get("/swagger.json").json)
+
+
+def test_fingerprint(monkeypatch):
+    fingerprint = schema_fingerprint([Person, Book], {})
+    assert fingerprint == schema_fingerprint([Person, Book], {})
+    assert fingerprint != schema_fingerprint([Person, Book], {"SWAGGER_PREFIX": "x"})
+    assert fingerprint != schema_fingerprint([Person], {})
+    monkeypatch.setattr(Book, "__doc__", "description: changed")
+    assert fingerprint != schema_fingerprint([Person, Book], {})
@@ -0,0 +1,62 @@
+"""
+Per-request phase timing: Server-Timing header and timing callbacks
+"""
+import pytest
+from safrs.timing import register_timing_callback, unregister_timing_callback
+from conftest import JSONAPI_HEADERS
+
+
+@pytest.fixture
+def callback():
+    timings = []
+    register_timing_callback(timings.append)
+    yield timings
+    unregister_timing_callback(timings.append)
+
+
+def phases(header):
+    return [metric.split(";")[0] for metric in header.split(", ")]
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("/Books/?include=author", ["filter", "sort", "count", "paginate", "include", "encode", "total"]),
+        ("/People/1/books", ["filter", "sort", "count", "paginate", "encode", "total"]),
+        ("/Books/1/", ["query", "encode", "total"]),
+    ],
+)
+def test_server_timing(make_app, url, expected):
+    response = make_app(SERVER_TIMING=True).test_client().get(url)
+    assert response.status_code == 200
+    header = response.headers["Server-Timing"]
+    assert set(expected) <= set(phases(header))
+    assert phases(header)[-1] == "total"
+    for metric in header.split(", "):
+        assert float(metric.split(";dur=")[1]) >= 0
+
+
+def test_disabled_by_default(client):
+    assert "Server-Timing" not in client.get("/Books/").headers
+
+
+def test_timing_callback(client, callback):
+    response = client.get("/Books/?page[limit]=1")
+    # the callbacks enable the timing, the header requires SERVER_TIMING
+    assert "Server-Timing" not in response.headers
+    client.patch("/Books/1/", json={"data": {"type": "Book", "id": "1", "attributes": {"title": "x"}}}, headers=JSONAPI_HEADERS)
+    assert [(timings.method, timings.path) for timings in callback] == [("GET", "/Books/"), ("PATCH", "/Books/1/")]
+    assert {"count", "paginate"} <= set(callback[0].phases)
+    assert callback[0].total > 0
+
+
+def test_failing_callback(client, callback):
+    def fail(timings):
+        raise RuntimeError(timings)
+
+    register_timing_callback(fail)
+    try:
+        assert client.get("/Books/").status_code == 200
+    finally:
+        unregister_timing_callback(fail)
+    assert len(callback) == 1